@@ -0,0 +1,247 @@
+'''Local stand-in for the Portainer endpoints used by core/portainer.py, for benchmarks.'''
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from fake_registry import image_digest
+
+class FakePortainer:
+    '''Serve a generated Portainer instance with configurable size, latency and error rate.'''
+
+    def __init__(self, environments: int = 2, stacks: int = 10, latency: float = 0.0, refresh_latency: float = 0.0,
+                 redeploy_latency: float = 0.0, error_rate: float = 0.0, outdated_ratio: float = 0.2,
+                 unused_images: int = 5, seed: int = 0, registry: str = 'registry.local', git_repository: tuple = None, git_ratio: float = 0.0,
+                 self_update_restart: float = None):
+        self.latency = latency
+        self.refresh_latency = refresh_latency
+        self.redeploy_latency = redeploy_latency
+        self.error_rate = error_rate
+        self.registry = registry
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_counts = {}
+
+        # With self_update_restart, a newer version is available and the instance answers 503 for that many seconds after updating
+        self.self_update_restart = self_update_restart
+        self.version = '2.21.0'
+        self.restarting_until = 0
+
+        self.environments = [
+            {'Id': env_id, 'Name': f'env-{env_id}', 'Type': 2, 'URL': f'tcp://10.0.0.{env_id}:9001', 'Status': 1, 'GroupId': 1, 'TagIds': [],
+             'Snapshots': []}
+            for env_id in range(1, environments + 1)
+        ]
+
+        self.stacks = {}
+        for env in self.environments:
+            for index in range(stacks):
+                stack_id = env['Id'] * 100000 + index
+                self.stacks[stack_id] = {
+                    'Id': stack_id,
+                    'Name': f'stack-{env["Id"]}-{index}',
+                    'Type': 2,
+                    'EndpointId': env['Id'],
+                    'Status': 1,
+                    'Env': [{'name': 'TAG', 'value': 'latest'}],
+                    'CreationDate': 1700000000,
+                    'UpdateDate': 1700000000,
+                    'GitConfig': None,
+                    'outdated': self.random.random() < outdated_ratio
+                }
+
+                # Git stacks of a local repository, (url, previous commit, head commit); outdated ones run the previous commit
+                if git_repository and self.random.random() < git_ratio:
+                    url, previous, head = git_repository
+                    self.stacks[stack_id]['GitConfig'] = {
+                        'URL': url, 'ReferenceName': 'refs/heads/main', 'ConfigFilePath': 'docker-compose.yml',
+                        'ConfigHash': previous if self.stacks[stack_id]['outdated'] else head, 'Authentication': None
+                    }
+                    self.stacks[stack_id]['outdated'] = False
+                    self.stacks[stack_id]['git_head'] = head
+
+        self.images = {
+            env['Id']: [
+                {'id': f'sha256:{env["Id"]:04x}{index:060x}', 'tags': [f'app:{index}'], 'used': index >= unused_images,
+                 'size': 50000000 + index, 'created': 1700000000 + index}
+                for index in range(unused_images * 2)
+            ]
+            for env in self.environments
+        }
+
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        '''Start serving on a background thread and return the base URL.'''
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, avoid the Nagle/delayed ACK stall on every response
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload = fake.handle(self.command, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        '''Stop the server.'''
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, method: str, raw_path: str, body: bytes):
+        '''Answer a request, returning the HTTP status and the JSON payload.'''
+        parts = urlsplit(raw_path)
+        path = parts.path.rstrip('/') or '/'
+        query = parse_qs(parts.query)
+
+        # Request counters, read by the benchmark harness and not counted themselves
+        if path == '/__benchmark/requests':
+            with self.lock:
+                return 200, dict(self.request_counts)
+
+        endpoint = method + ' ' + re.sub(r'/(sha256:)?[0-9a-f]*\d[0-9a-f]*(?=/|$)', '/{id}', path)
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if time.monotonic() < self.restarting_until:
+            return 503, {'message': 'Restarting'}
+
+        if path != '/' and self.error_rate and self.random.random() < self.error_rate:
+            return 502, {'message': 'Injected error'}
+
+        if path == '/':
+            return 200, {}
+        if path == '/api/system/status':
+            return 200, {'Version': self.version}
+        if path == '/api/system/version':
+            latest = '2.22.0' if self.self_update_restart is not None else self.version
+            return 200, {'UpdateAvailable': latest != self.version, 'LatestVersion': latest, 'ServerVersion': self.version}
+        if path == '/api/system/update' and method == 'POST':
+            self.version = '2.22.0'
+            self.restarting_until = time.monotonic() + (self.self_update_restart or 0)
+            return 200, {'UpdateAvailable': False}
+        if path == '/api/endpoints':
+            return 200, self.environments
+        if path == '/api/stacks':
+            filters = json.loads(query.get('filters', ['{}'])[0])
+            env_id = filters.get('EndpointID')
+            return 200, [self._public(stack) for stack in self.stacks.values() if env_id is None or stack['EndpointId'] == env_id]
+        if path == '/api/stacks/image_status/clear':
+            return 200, {}
+
+        match = re.fullmatch(r'/api/stacks/(\d+)(/.*)?', path)
+        if match:
+            stack = self.stacks.get(int(match.group(1)))
+            if not stack:
+                return 404, {'message': 'Stack not found'}
+            return self._handle_stack(method, stack, match.group(2) or '')
+
+        match = re.fullmatch(r'/api/docker/(\d+)/images', path)
+        if match:
+            return 200, self.images.get(int(match.group(1)), [])
+
+        match = re.fullmatch(r'/api/endpoints/(\d+)/docker/images/prune', path)
+        if match:
+            images = self.images.get(int(match.group(1)), [])
+            unused = [image for image in images if not image['used']]
+            self.images[int(match.group(1))] = [image for image in images if image['used']]
+            return 200, {'ImagesDeleted': [{'Deleted': image['id']} for image in unused], 'SpaceReclaimed': sum(image['size'] for image in unused)}
+
+        match = re.fullmatch(r'/api/endpoints/(\d+)/docker/images/([^/]+)', path)
+        if match and method == 'DELETE':
+            images = self.images.get(int(match.group(1)), [])
+            self.images[int(match.group(1))] = [image for image in images if image['id'] != match.group(2)]
+            return 200, [{'Deleted': match.group(2)}]
+
+        match = re.fullmatch(r'/api/endpoints/(\d+)/docker/images/json', path)
+        if match:
+            return 200, self._docker_images()
+
+        match = re.fullmatch(r'/api/endpoints/(\d+)/docker/containers/json', path)
+        if match:
+            labels = json.loads(query.get('filters', ['{}'])[0]).get('label', [])
+            project = next((label.partition('=')[2] for label in labels if label.startswith('com.docker.compose.project=')), None)
+            return 200, [
+                self._container(stack) for stack in self.stacks.values()
+                if stack['EndpointId'] == int(match.group(1)) and project in (None, stack['Name'])
+            ]
+
+        return 404, {'message': 'Not found'}
+
+    def _handle_stack(self, method: str, stack: dict, suffix: str):
+        if suffix == '/images_status':
+            if self.refresh_latency:
+                time.sleep(self.refresh_latency)
+            return 200, {'Status': 'outdated' if stack['outdated'] else 'updated', 'Message': ''}
+        if suffix == '/file':
+            return 200, {'StackFileContent': f'services:\n  app:\n    image: {self.registry}/app-{stack["Id"] % 7}:${{TAG}}\n'}
+        if suffix in ('', '/git/redeploy') and method == 'PUT':
+            if self.redeploy_latency:
+                time.sleep(self.redeploy_latency)
+            stack['outdated'] = False
+            stack['UpdateDate'] += 1
+            if suffix == '/git/redeploy':
+                stack['GitConfig']['ConfigHash'] = stack['git_head']
+            return 200, self._public(stack)
+        if suffix == '' and method == 'GET':
+            return 200, self._public(stack)
+        return 404, {'message': 'Not found'}
+
+    def _docker_images(self):
+        '''Current and previous image of every repository, with their repository digests.'''
+        images = []
+        for index in range(7):
+            repository = f'app-{index}'
+            for outdated in (False, True):
+                images.append({'Id': self._image_id(index, outdated), 'RepoTags': [f'{self.registry}/{repository}:latest'] if not outdated else [],
+                               'RepoDigests': [f'{self.registry}/{repository}@{image_digest(repository, outdated)}']})
+        return images
+
+    def _container(self, stack: dict):
+        return {
+            'Id': f'{stack["Id"]:064x}',
+            'Names': [f'/{stack["Name"]}-app-1'],
+            'ImageID': self._image_id(stack['Id'] % 7, stack['outdated']),
+            'State': 'running',
+            'Status': 'Up 5 seconds (healthy)',
+            'Labels': {'com.docker.compose.project': stack['Name'], 'com.docker.compose.service': 'app'}
+        }
+
+    @staticmethod
+    def _image_id(index: int, outdated: bool):
+        return f'sha256:{index + (1000 if outdated else 0):064x}'
+
+    @staticmethod
+    def _public(stack: dict):
+        return {key: value for key, value in stack.items() if key not in ('outdated', 'git_head')}
@@ -0,0 +1,97 @@
+'''Local stand-in for a registry v2 API, answering manifest HEAD requests for benchmarks.'''
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+def image_digest(repository: str, outdated: bool = False):
+    '''Digest served for the current image of a repository, or the one of the previous push.'''
+    value = sum(map(ord, repository)) + (1000 if outdated else 0)
+    return f'sha256:{value:064x}'
+
+class FakeRegistry:
+    '''Serve manifest digests for any repository and tag, optionally behind a Bearer token challenge.'''
+
+    def __init__(self, latency: float = 0.0, token_auth: bool = False):
+        self.latency = latency
+        self.token_auth = token_auth
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.server = None
+        self.thread = None
+
+    @property
+    def host(self):
+        host, port = self.server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self, host: str = '127.0.0.1', port: int = 0):
+        '''Start serving on a background thread and return the registry host.'''
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                status, headers, payload = fake.handle(self.command, self.path, self.headers.get('Authorization', ''))
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(data)
+
+            do_GET = do_HEAD = _handle
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.host
+
+    def stop(self):
+        '''Stop the server.'''
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, method: str, raw_path: str, authorization: str):
+        '''Answer a request, returning the HTTP status, extra headers and the JSON payload.'''
+        parts = urlsplit(raw_path)
+        path = parts.path
+
+        if path == '/__benchmark/requests':
+            with self.lock:
+                return 200, {}, dict(self.request_counts)
+
+        with self.lock:
+            endpoint = f'{method} {re.sub(r"^/v2/.+/manifests/.+$", "/v2/{name}/manifests/{tag}", path)}'
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path == '/token':
+            scope = parse_qs(parts.query).get('scope', [''])[0]
+            return 200, {}, {'token': f'token:{scope}', 'expires_in': 300}
+
+        match = re.fullmatch(r'/v2/(.+)/manifests/([^/]+)', path)
+        if not match:
+            return 404, {}, {'errors': [{'code': 'NAME_UNKNOWN'}]}
+
+        repository = match.group(1)
+        if self.token_auth and authorization != f'Bearer token:repository:{repository}:pull':
+            challenge = f'Bearer realm="http://{self.host}/token",service="fake-registry",scope="repository:{repository}:pull"'
+            return 401, {'WWW-Authenticate': challenge}, {'errors': [{'code': 'UNAUTHORIZED'}]}
+
+        return 200, {'Docker-Content-Digest': image_digest(repository),
+                     'Content-Type': 'application/vnd.oci.image.index.v1+json'}, None
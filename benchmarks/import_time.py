@@ -0,0 +1,77 @@
+'''Measure the startup cost of portainerStackUpdate: wall-clock time of short invocations and the slowest imports.
+
+Example:
+    python benchmarks/import_time.py --repeat 20
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Everything a scheduled run imports before its first request to Portainer
+RUN_IMPORTS = 'import main; import yaml; from logs.console_logger import ConsoleLogger; from core.instance_updater import InstanceUpdater'
+
+def scenarios(directory: str):
+    '''Command lines measured, run from the src directory.'''
+    return {
+        'help': [sys.executable, 'main.py', '--help'],
+        'init-config': [sys.executable, 'main.py', '--init-config', '--config', os.path.join(directory, 'config.yml')],
+        'run imports': [sys.executable, '-c', RUN_IMPORTS],
+        'interpreter only': [sys.executable, '-c', 'pass']
+    }
+
+def time_command(command: list[str], repeat: int, directory: str):
+    '''Median and minimum wall-clock time of a command over `repeat` runs.'''
+    samples = []
+    for _ in range(repeat):
+        config_path = os.path.join(directory, 'config.yml')
+        if os.path.exists(config_path):
+            os.remove(config_path)
+        started = time.perf_counter()
+        subprocess.run(command, cwd=SRC, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - started)
+    return {'median_seconds': round(statistics.median(samples), 4), 'min_seconds': round(min(samples), 4)}
+
+def slowest_imports(limit: int):
+    '''Modules with the highest cumulative import time for a scheduled run, from python -X importtime.'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', RUN_IMPORTS], cwd=SRC, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.strip()))
+
+    # Top-level entries only, nested ones are already part of their parent
+    return [{'module': module, 'cumulative_ms': round(cumulative / 1000, 1)}
+            for cumulative, module in sorted(imports, reverse=True) if module == module.lstrip()][:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of portainerStackUpdate')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs of each command')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports listed')
+    parser.add_argument('--output', type=str, help='Also write the results as JSON to this path')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        timings = {name: time_command(command, args.repeat, directory) for name, command in scenarios(directory).items()}
+    imports = slowest_imports(args.top)
+
+    for name, timing in timings.items():
+        print(f'{name:<18} median {timing["median_seconds"] * 1000:7.1f} ms   min {timing["min_seconds"] * 1000:7.1f} ms')
+    print('Slowest top-level imports of a scheduled run:')
+    for entry in imports:
+        print(f'  {entry["cumulative_ms"]:>7} ms  {entry["module"]}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'parameters': vars(args), 'timings': timings, 'imports': imports}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
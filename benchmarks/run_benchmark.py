@@ -0,0 +1,207 @@
+'''Run the full main() flow against local fake Portainer instances and report wall-clock time, requests and memory.
+
+Example:
+    python benchmarks/run_benchmark.py --instances 4 --environments 3 --stacks 120 --refresh-latency 0.05 --workers 4
+'''
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory falls back to tracemalloc there
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yaml
+import main as portainer_stack_update
+from fake_portainer import FakePortainer
+from fake_registry import FakeRegistry
+
+def build_config(urls: list[str], registry: str, args: argparse.Namespace):
+    '''Generate a configuration file pointing at the fake instances.'''
+    return {
+        'logging': {'type': 'console'},
+        'maxWorkers': args.workers,
+        'engine': args.engine,
+        'gitCheck': {'enabled': bool(args.git_stacks)},
+        'registryCheck': {
+            'enabled': args.registry_check,
+            'registries': [{'host': registry, 'insecure': True}]
+        },
+        'instances': [
+            {
+                'name': f'bench-{index}',
+                'host': url,
+                'accessToken': 'benchmark',
+                'updateStacksWithGitIntegration': True,
+                'deleteUnusedImages': args.delete_unused_images,
+                'refreshConcurrency': args.refresh_concurrency,
+                'redeployConcurrency': args.redeploy_concurrency,
+                'healthCheckTimeout': args.health_check_timeout,
+                'updatePortainerVersion': args.self_update_restart is not None and index == 0,
+                'imageCleanup': {'concurrency': args.cleanup_concurrency, 'prune': args.cleanup_prune},
+            }
+            for index, url in enumerate(urls)
+        ]
+    }
+
+def create_git_repository(directory: str):
+    '''Create a local bare repository with two commits on main, returning (url, previous commit, head commit).'''
+    bare = os.path.join(directory, 'stacks.git')
+    work = os.path.join(directory, 'work')
+
+    def git(*arguments: str, cwd: str = None):
+        return subprocess.run(['git', '-c', 'user.name=benchmark', '-c', 'user.email=benchmark@localhost', *arguments],
+                              cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+
+    git('init', '--bare', '--initial-branch=main', bare)
+    git('init', '--initial-branch=main', work)
+    commits = []
+    for message in ('first', 'second'):
+        git('commit', '--allow-empty', '-m', message, cwd=work)
+        commits.append(git('rev-parse', 'HEAD', cwd=work))
+    git('push', bare, 'main', cwd=work)
+    return (bare, *commits)
+
+def serve_fakes(args: argparse.Namespace, urls: multiprocessing.Queue, stop: multiprocessing.Event, git_repository: tuple = None):
+    '''Run the fake instances and registry in their own process so they do not compete with the measured run.'''
+    registry = FakeRegistry(latency=args.registry_latency, token_auth=True)
+    registry_host = registry.start()
+    fakes = [
+        FakePortainer(environments=args.environments, stacks=args.stacks, latency=args.latency,
+                      refresh_latency=args.refresh_latency, redeploy_latency=args.redeploy_latency,
+                      error_rate=args.error_rate, outdated_ratio=args.outdated_ratio, seed=index, registry=registry_host,
+                      git_repository=git_repository, git_ratio=args.git_stacks,
+                      self_update_restart=args.self_update_restart if index == 0 else None)
+        for index in range(args.instances)
+    ]
+    urls.put(([fake.start() for fake in fakes], registry_host))
+    stop.wait()
+    for fake in fakes + [registry]:
+        fake.stop()
+
+def run(args: argparse.Namespace):
+    git_directory = tempfile.TemporaryDirectory()
+    git_repository = create_git_repository(git_directory.name) if args.git_stacks else None
+
+    url_queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    server_process = multiprocessing.Process(target=serve_fakes, args=(args, url_queue, stop, git_repository), daemon=True)
+    server_process.start()
+    urls, registry_host = url_queue.get(timeout=30)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config_path = os.path.join(directory, 'config.yml')
+            report_path = os.path.join(directory, 'report.json')
+            with open(config_path, 'w') as file:
+                yaml.safe_dump(build_config(urls, registry_host, args), file)
+
+            argv = ['portainerStackUpdate', '--config', config_path, '--report', report_path, '--no-cache']
+            if args.processes:
+                argv += ['--processes', str(args.processes)]
+            output = io.StringIO()
+
+            trace_memory = args.trace_memory or resource is None
+            if trace_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(output), _patched_argv(argv):
+                portainer_stack_update.main()
+            elapsed = time.perf_counter() - started
+            if trace_memory:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            else:
+                # ru_maxrss is reported in KiB on Linux
+                peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+            with open(report_path) as file:
+                report = json.load(file)
+
+        request_counts = {}
+        for url in urls + [f'http://{registry_host}']:
+            with urllib.request.urlopen(f'{url}/__benchmark/requests') as response:
+                for endpoint, count in json.load(response).items():
+                    request_counts[endpoint] = request_counts.get(endpoint, 0) + count
+    finally:
+        stop.set()
+        server_process.join(10)
+        git_directory.cleanup()
+
+    return {
+        'parameters': vars(args),
+        'wall_clock_seconds': round(elapsed, 3),
+        'peak_memory_bytes': peak_memory,
+        'peak_memory_source': 'tracemalloc' if trace_memory else 'max_rss',
+        'total_requests': sum(request_counts.values()),
+        'requests': dict(sorted(request_counts.items())),
+        'phases': report.get('phases', {}),
+        'log_lines': output.getvalue().count('\n')
+    }
+
+@contextlib.contextmanager
+def _patched_argv(argv: list[str]):
+    original = sys.argv
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = original
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark portainerStackUpdate against local fake Portainer instances')
+    parser.add_argument('--instances', type=int, default=2, help='Number of fake Portainer instances')
+    parser.add_argument('--environments', type=int, default=2, help='Environments per instance')
+    parser.add_argument('--stacks', type=int, default=50, help='Stacks per environment')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--refresh-latency', type=float, default=0.0, help='Extra seconds for each images status refresh (registry check)')
+    parser.add_argument('--redeploy-latency', type=float, default=0.0, help='Extra seconds for each stack redeploy')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 502')
+    parser.add_argument('--outdated-ratio', type=float, default=0.2, help='Fraction of stacks reported as outdated')
+    parser.add_argument('--workers', type=int, default=1, help='maxWorkers used for the run')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads', help='Execution engine used for the run')
+    parser.add_argument('--processes', type=int, help='Split the instances across this many processes (peak memory and log lines only cover the parent)')
+    parser.add_argument('--refresh-concurrency', type=int, default=4, help='refreshConcurrency of every instance')
+    parser.add_argument('--redeploy-concurrency', type=int, default=1, help='redeployConcurrency of every instance')
+    parser.add_argument('--health-check-timeout', type=float, default=0, help='healthCheckTimeout of every instance, 0 disables health gating')
+    parser.add_argument('--registry-check', action='store_true', help='Compare Compose stacks with a fake registry instead of refreshing them in Portainer')
+    parser.add_argument('--registry-latency', type=float, default=0.0, help='Seconds added to every fake registry request')
+    parser.add_argument('--git-stacks', type=float, default=0.0,
+                        help='Fraction of stacks deployed from a local bare Git repository, the outdated ones run its previous commit (enables gitCheck)')
+    parser.add_argument('--self-update-restart', type=float,
+                        help='Offer a Portainer update on the first instance, which then answers 503 for this many seconds (enables updatePortainerVersion)')
+    parser.add_argument('--delete-unused-images', action='store_true', help='Enable deleteUnusedImages on every instance')
+    parser.add_argument('--cleanup-concurrency', type=int, default=4, help='imageCleanup concurrency of every instance')
+    parser.add_argument('--cleanup-prune', action='store_true', help='Remove unused images with a single prune call per environment')
+    parser.add_argument('--trace-memory', action='store_true', help='Measure peak Python allocations with tracemalloc (slows the run down)')
+    parser.add_argument('--output', type=str, help='Also write the results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args)
+
+    print(f'Wall-clock time: {results["wall_clock_seconds"]} s')
+    print(f'Peak memory:     {results["peak_memory_bytes"] / 1024 / 1024:.1f} MiB ({results["peak_memory_source"]})')
+    print(f'Requests:        {results["total_requests"]}')
+    for endpoint, count in results['requests'].items():
+        print(f'  {count:>7}  {endpoint}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
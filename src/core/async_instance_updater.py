@@ -0,0 +1,28 @@
+from core.async_portainer import AsyncPortainer
+from core.flow_step import drive_async
+from core.instance_updater import InstanceUpdater
+
+class AsyncInstanceUpdater(InstanceUpdater):
+    '''Run the instance -> environment -> stack flow of InstanceUpdater on an event loop with an AsyncPortainer client.'''
+
+    async def run(self, connector, defer_restart: bool = False):
+        '''Process every environment and stack of the Portainer instance, then send its summary if summaries are per instance.
+
+        With defer_restart, returns True once a Portainer self-update is started, run must then be called again.
+        '''
+        restarting = False
+        try:
+            restarting = await self._run(connector, defer_restart)
+            return restarting
+        finally:
+            if not restarting:
+                self._send_summary()
+
+    async def _run(self, connector, defer_restart: bool = False):
+        if not self._start():
+            return False
+
+        async with AsyncPortainer(url=self.host, access_token=self.access_token, connector=connector, verify_ssl=self.verify_ssl,
+                                  metrics=self.metrics, instance_name=self.name, policy=self.request_policy) as portainer:
+            portainer.deadline = self.deadline
+            return await drive_async(self._flow(defer_restart), portainer)
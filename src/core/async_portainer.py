@@ -0,0 +1,276 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+import aiohttp
+from core.circuit_breaker import CircuitBreaker
+from core.metrics import Metrics, endpoint_label
+from core.portainer import ENVIRONMENT_FIELDS, IMAGE_FIELDS, STACK_FIELDS, STREAM_CHUNK_SIZE
+from core.request_policy import RequestPolicy
+from errors.instance_timeout_error import InstanceTimeoutError
+from errors.portainer_error import PortainerError
+from errors.stack_not_found_error import StackNotFoundError
+from utils.json_stream import aiter_json_array
+
+def create_connector(limit: int = 100, limit_per_host: int = 10):
+    '''Create the connection pool shared by every AsyncPortainer of a run.'''
+    return aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+
+class AsyncPortainer:
+    '''Asyncio counterpart of Portainer, exposing the same methods as coroutines.'''
+
+    def __init__(self, url: str, access_token: str, connector: aiohttp.BaseConnector, verify_ssl: bool = False,
+                 metrics: Metrics = None, instance_name: str = None, policy: RequestPolicy = None):
+        self.url = url
+        self.metrics = metrics
+        self.instance_name = instance_name or url
+        self.policy = policy or RequestPolicy()
+        self.breaker = CircuitBreaker(self.instance_name, self.policy.failure_threshold, self.policy.reset_timeout)
+        self.ssl = True if verify_ssl else False
+
+        # Monotonic time at which the current run of the instance must stop, set by the updater
+        self.deadline = None
+
+        # Initialize the session on top of the shared connection pool
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            headers={'X-API-Key': access_token, 'Content-Type': 'application/json'})
+
+    async def close(self):
+        '''Close the session, leaving the shared connection pool open.'''
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def remaining(self):
+        '''Seconds left before the deadline of the current run, None without a deadline.'''
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def _timeout(self, redeploy: bool = False):
+        '''Timeouts of a request, which cannot outlast the time budget of the run.'''
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise InstanceTimeoutError(f'Portainer instance {self.instance_name} exceeded its time budget, not sending any more requests.')
+        connect_timeout, read_timeout = self.policy.timeout(redeploy=redeploy, remaining=remaining)
+        # The read timeout applies to each read, the total one stops a slow body at the deadline
+        return aiohttp.ClientTimeout(total=remaining, sock_connect=connect_timeout, sock_read=read_timeout)
+
+    @asynccontextmanager
+    async def _send(self, method: str, path: str, redeploy: bool = False, **kwargs):
+        '''Send a request with the instance timeouts, retries and circuit breaker, recording its metrics.
+
+        Yields the response of the last attempt. Retries follow RequestPolicy.retry_delay, the rules urllib3 applies
+        for the blocking client, and are only sent before the body is read. As with urllib3, the circuit breaker
+        records the outcome of the request once, whatever the number of attempts.
+        '''
+        started = time.monotonic()
+        response = None
+        failed = False
+        attempt = 0
+
+        try:
+            # Checked once per request like the blocking client, a retry of the half-open trial call is still that call
+            timeout = self._timeout(redeploy)
+            self.breaker.before_call()
+            while True:
+                attempt += 1
+                response = None
+                try:
+                    response = await self.session.request(method, f'{self.url}{path}', ssl=self.ssl, timeout=timeout, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    # A request that could not connect never reached Portainer and can be sent again whatever its method
+                    delay = self.policy.retry_delay(method, attempt, sent=not isinstance(e, aiohttp.ClientConnectorError), remaining=self.remaining())
+                    if delay is None:
+                        self.breaker.record_failure()
+                        raise
+                else:
+                    delay = self.policy.retry_delay(method, attempt, response.status, remaining=self.remaining())
+                    if delay is None:
+                        self.breaker.record_status(response.status)
+                        break
+                    response.release()
+                await asyncio.sleep(delay)
+                try:
+                    timeout = self._timeout(redeploy)
+                except InstanceTimeoutError:
+                    # The budget ran out before the retry, the request failed
+                    self.breaker.record_failure()
+                    raise
+
+            async with response:
+                yield response
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if self.metrics and attempt:
+                sent = len(json.dumps(kwargs['json'])) if 'json' in kwargs else 0
+                self.metrics.observe_request(self.instance_name, endpoint_label(method, path), time.monotonic() - started,
+                                             bytes_sent=sent, bytes_received=response.content.total_bytes if response is not None else 0,
+                                             retries=attempt - 1, error=failed or not response.ok)
+
+    async def _request(self, method: str, path: str, error_message: str, parse_json: bool = True, redeploy: bool = False,
+                       not_found: str = None, **kwargs):
+        '''Send a request to Portainer and return the decoded JSON body, raising StackNotFoundError(not_found) on a 404 if given.'''
+        try:
+            async with self._send(method, path, redeploy=redeploy, **kwargs) as response:
+                body = await response.read()
+                if response.status == 404 and not_found:
+                    raise StackNotFoundError(not_found)
+                response.raise_for_status()
+                return json.loads(body) if parse_json else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise PortainerError(f'{error_message}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
+    async def _iter_list(self, path: str, error_message: str, fields: tuple, **kwargs):
+        '''Stream a JSON array response, yielding its items one by one with only the given fields.'''
+        try:
+            async with self._send('GET', path, **kwargs) as response:
+                response.raise_for_status()
+                async for item in aiter_json_array(response.content.iter_chunked(STREAM_CHUNK_SIZE), fields):
+                    yield item
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise PortainerError(f'{error_message}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
+    async def ping(self):
+        '''Ping the Portainer instance to check if it's reachable.'''
+        await self._request('GET', '', 'Failed to reach Portainer', parse_json=False)
+
+    async def check_if_portainer_needs_update(self):
+        '''Check if the Portainer instance needs an update.'''
+        data = await self._request('GET', '/api/system/version', 'Failed to get Portainer version')
+        return data.get('UpdateAvailable', False)
+
+    async def update_portainer_version(self):
+        '''Update the Portainer instance to the last version.'''
+        data = await self._request('POST', '/api/system/update', 'Failed to update Portainer', redeploy=True)
+        return not data.get('UpdateAvailable', False)
+
+    async def probe_version(self):
+        '''Return the version a restarting instance reports on /api/system/status, or None while it does not answer.'''
+        timeout = self._timeout()
+        try:
+            async with self.session.get(f'{self.url}/api/system/status', ssl=self.ssl, timeout=timeout) as response:
+                if response.status != 200:
+                    return None
+                return (await response.json(content_type=None)).get('Version') or None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def get_environments(self, exclude_snapshots: bool = True):
+        '''Get the list of environments from Portainer, without the heavy Docker snapshots by default.'''
+        return await self._request('GET', '/api/endpoints', 'Failed to get environments',
+                                   params={'excludeSnapshots': 'true'} if exclude_snapshots else None)
+
+    def iter_environments(self, fields: tuple = ENVIRONMENT_FIELDS):
+        '''Stream the environments without their Docker snapshots, keeping only the given fields.'''
+        return self._iter_list('/api/endpoints', 'Failed to get environments', fields, params={'excludeSnapshots': 'true'})
+
+    async def get_environment_stacks(self, environment_id: int):
+        '''Get the stacks for a specific environment.'''
+        filters = json.dumps({'EndpointID': environment_id, 'IncludeOrphanedStacks': False})
+        return await self._request('GET', '/api/stacks', f'Failed to get stacks for environment {environment_id}',
+                                   params={'filters': filters})
+
+    def iter_environment_stacks(self, environment_id: int, fields: tuple = STACK_FIELDS):
+        '''Stream the stacks of a specific environment, keeping only the given fields.'''
+        filters = json.dumps({'EndpointID': environment_id, 'IncludeOrphanedStacks': False})
+        return self._iter_list('/api/stacks', f'Failed to get stacks for environment {environment_id}', fields, params={'filters': filters})
+
+    async def get_stack(self, stack_id: int):
+        '''Get a single stack with its current configuration.'''
+        return await self._request('GET', f'/api/stacks/{stack_id}', f'Failed to get stack {stack_id}', not_found=f'Stack {stack_id} no longer exists.')
+
+    async def clear_images_status(self, environment_id: int):
+        '''Clear the status of images in a specific environment.'''
+        await self._request('POST', '/api/stacks/image_status/clear', f'Failed to clear images status for environment {environment_id}',
+                            parse_json=False, params={'environmentId': environment_id})
+
+    async def refresh_stack_images(self, stack_id: int):
+        '''Refresh the images for a specific stack.'''
+        data = await self._request('GET', f'/api/stacks/{stack_id}/images_status', f'Failed to refresh images for stack {stack_id}',
+                                   params={'refresh': 'true'})
+        return data.get('Status', 'updated')
+
+    async def update_stack(self, stack_id: int, environment_id: int, env: list[str], stack_file_content: str, prune: bool, webhook: str):
+        '''Update a stack in a specific environment.'''
+        data = {
+            'StackFileContent': stack_file_content,
+            'Env': env,
+            'id': environment_id,
+            'PullImage': True,
+            'Prune': prune,
+            'Webhook': webhook
+        }
+        return await self._request('PUT', f'/api/stacks/{stack_id}', f'Failed to update stack {stack_id} in environment {environment_id}',
+                                   params={'endpointId': environment_id}, json=data, redeploy=True)
+
+    async def update_stack_with_git(self, stack_id: int, environment_id: int, repository_authentication: bool, repository_git_credential_id: int, repository_password: str,
+                                    repository_reference_name: str, repository_username: str, env: list[str], prune: bool):
+        '''Update a stack in a specific environment using Git.'''
+        data = {
+            'PullImage': True,
+            'RepositoryAuthentication': repository_authentication,
+            'RepositoryGitCredentialID': repository_git_credential_id,
+            'RepositoryPassword': repository_password,
+            'RepositoryReferenceName': repository_reference_name,
+            'RepositoryUsername': repository_username,
+            'Env': env,
+            'Prune': prune
+        }
+        return await self._request('PUT', f'/api/stacks/{stack_id}/git/redeploy', f'Failed to update stack {stack_id} in environment {environment_id} using Git',
+                                   params={'endpointId': environment_id}, json=data, redeploy=True)
+
+    async def get_images_with_usage(self, environment_id: int):
+        '''Get images with usage in a specific environment.'''
+        return await self._request('GET', f'/api/docker/{environment_id}/images', f'Failed to get images with usage for environment {environment_id}',
+                                   params={'withUsage': 'true'})
+
+    def iter_images_with_usage(self, environment_id: int, fields: tuple = IMAGE_FIELDS):
+        '''Stream the images of a specific environment with their usage, keeping only the given fields.'''
+        return self._iter_list(f'/api/docker/{environment_id}/images', f'Failed to get images with usage for environment {environment_id}',
+                               fields, params={'withUsage': 'true'})
+
+    async def delete_image(self, environment_id: int, image_id: str):
+        '''Delete an image from a specific environment.'''
+        await self._request('DELETE', f'/api/endpoints/{environment_id}/docker/images/{image_id}', f'Failed to delete image {image_id} from environment {environment_id}',
+                            parse_json=False, params={'force': 'false'})
+
+    async def prune_images(self, environment_id: int):
+        '''Delete every unused image of a specific environment in a single call.'''
+        filters = json.dumps({'dangling': ['false']})
+        return await self._request('POST', f'/api/endpoints/{environment_id}/docker/images/prune', f'Failed to prune images in environment {environment_id}',
+                                   params={'filters': filters}, redeploy=True)
+
+    async def get_stack_file_content(self, stack_id: int):
+        '''Get the stack file content for a specific stack.'''
+        data = await self._request('GET', f'/api/stacks/{stack_id}/file', f'Failed to get stack file content for stack {stack_id}')
+        return data.get('StackFileContent', '')
+
+    async def get_compose_containers(self, environment_id: int):
+        '''Get every container of a Docker Compose project in a specific environment, including stopped ones.'''
+        filters = json.dumps({'label': ['com.docker.compose.project']})
+        return await self._request('GET', f'/api/endpoints/{environment_id}/docker/containers/json',
+                                   f'Failed to get containers for environment {environment_id}',
+                                   params={'all': 1, 'filters': filters})
+
+    async def get_docker_images(self, environment_id: int):
+        '''Get the Docker images of a specific environment with their repository digests.'''
+        return await self._request('GET', f'/api/endpoints/{environment_id}/docker/images/json',
+                                   f'Failed to get Docker images for environment {environment_id}')
+
+    async def get_stack_containers(self, environment_id: int, stack_name: str):
+        '''Get the containers of a Docker Compose stack, including stopped ones.'''
+        filters = json.dumps({'label': [f'com.docker.compose.project={stack_name}']})
+        return await self._request('GET', f'/api/endpoints/{environment_id}/docker/containers/json',
+                                   f'Failed to get containers of stack {stack_name} in environment {environment_id}',
+                                   params={'all': 1, 'filters': filters})
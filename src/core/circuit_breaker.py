@@ -0,0 +1,51 @@
+import threading
+import time
+from errors.circuit_open_error import CircuitOpenError
+
+class CircuitBreaker:
+    '''Stop calling an instance after repeated failures, letting a single trial call through once reset_timeout elapses.'''
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def before_call(self):
+        '''Raise CircuitOpenError if the instance must not be called right now.'''
+        if self.failure_threshold <= 0:
+            return
+
+        with self.lock:
+            if self.opened_at is None:
+                return
+
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.trial_in_flight:
+                # Half-open: let one call check if the instance recovered
+                self.trial_in_flight = True
+                return
+
+        raise CircuitOpenError(f'Portainer instance {self.name} failed {self.failures} times in a row, skipping calls to it for now.')
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failure_threshold > 0 and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def record_status(self, status: int):
+        '''Record an answer of the instance, only server side errors count against it, a 404 means it is alive.'''
+        if status >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
@@ -0,0 +1,61 @@
+from dataclasses import dataclass, field
+from core.instance_config import InstanceConfig, fingerprint
+
+# Registry credential keys left out of the fingerprint, like the access tokens of the instances
+REGISTRY_SECRET_KEYS = ('username', 'password')
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    '''The configuration file compiled into settings, read once per run.
+
+    The fingerprint changes whenever a setting changes, so anything stored between runs can be keyed on it.
+    '''
+    logging: dict = field(default_factory=dict)
+    max_workers: int = 1
+    engine: str = 'threads'
+    connections_per_host: int = 10
+    cache: dict = field(default_factory=dict)
+    metrics: dict = field(default_factory=dict)
+    registry_check: dict = field(default_factory=dict)
+    git_check: dict = field(default_factory=dict)
+    daemon: dict = field(default_factory=dict)
+    instances: tuple = ()
+    fingerprint: str = ''
+
+    @classmethod
+    def from_dict(cls, config: dict):
+        '''Compile a configuration checked by validate_config. Raises ValueError if a setting cannot be used.'''
+        max_workers = config.get('maxWorkers')
+        if max_workers is None:
+            max_workers = 1
+        if max_workers < 1:
+            raise ValueError('"maxWorkers" must be a positive integer.')
+
+        engine = config.get('engine') or 'threads'
+        if engine not in ('threads', 'async'):
+            raise ValueError('"engine" must be either "threads" or "async".')
+
+        instances = tuple(InstanceConfig.from_dict(index, instance) for index, instance in enumerate(config.get('instances') or []))
+
+        # Secrets stay out of the hash, the logging section only holds notification credentials
+        settings = {key: value for key, value in config.items() if key not in ('logging', 'instances')}
+        settings['instances'] = [instance.fingerprint for instance in instances]
+        registry_check = config.get('registryCheck') or {}
+        if registry_check.get('registries'):
+            settings['registryCheck'] = {**registry_check, 'registries': [
+                {key: value for key, value in registry.items() if key not in REGISTRY_SECRET_KEYS}
+                for registry in registry_check['registries'] if isinstance(registry, dict)
+            ]}
+
+        return cls(
+            logging=config.get('logging') or {},
+            max_workers=max_workers,
+            engine=engine,
+            connections_per_host=max(1, config.get('connectionsPerHost') or 10),
+            cache=config.get('cache') or {},
+            metrics=config.get('metrics') or {},
+            registry_check=registry_check,
+            git_check=config.get('gitCheck') or {},
+            daemon=config.get('daemon') or {},
+            instances=instances,
+            fingerprint=fingerprint(settings))
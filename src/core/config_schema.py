@@ -0,0 +1,156 @@
+from difflib import get_close_matches
+
+# Schema of the configuration file. A type or tuple of types checks a value, a dict checks a mapping with known keys
+# ('*' accepts any key), a one-item list checks every item of a list, and a tuple of schemas accepts any of them.
+NUMBER = (int, float)
+NAMES = [str]
+
+INSTANCE_SCHEMA = {
+    'name': str,
+    'host': str,
+    'accessToken': str,
+    'verifySSL': bool,
+    'updatePortainerVersion': bool,
+    'updateStacksWithGitIntegration': bool,
+    'pruneServices': bool,
+    'deleteUnusedImages': bool,
+    'imageCleanup': {
+        'concurrency': int,
+        'prune': bool,
+        'keepLastTags': int,
+        'reclaimTarget': (int, float, str),
+        'dryRun': bool,
+        'always': bool
+    },
+    'refreshConcurrency': int,
+    'redeployConcurrency': int,
+    'healthCheckTimeout': NUMBER,
+    'healthCheckInterval': NUMBER,
+    'stackPriorities': {'*': NUMBER},
+    'stackGroups': [NAMES],
+    'schedule': (str, int),
+    'connectTimeout': NUMBER,
+    'readTimeout': NUMBER,
+    'redeployTimeout': NUMBER,
+    'retries': int,
+    'retryBackoff': NUMBER,
+    'circuitBreakerThreshold': int,
+    'circuitBreakerReset': NUMBER,
+    'instanceTimeout': NUMBER,
+    'selfUpdateTimeout': NUMBER,
+    'ignoreStacks': NAMES,
+    'includeStacks': (NAMES, {'*': NAMES})
+}
+
+CONFIG_SCHEMA = {
+    'logging': {
+        'type': str,
+        'webhookUrl': str,
+        'botToken': str,
+        'chatId': (str, int),
+        'notifications': str,
+        'summary': str,
+        'file': str
+    },
+    'maxWorkers': int,
+    'engine': str,
+    'connectionsPerHost': int,
+    'cache': {
+        'enabled': bool,
+        'path': str,
+        'ttl': NUMBER,
+        'maxEntries': int,
+        'discoveryTtl': NUMBER
+    },
+    'metrics': {
+        'report': str,
+        'prometheusPort': int
+    },
+    'registryCheck': {
+        'enabled': bool,
+        'poolSize': int,
+        'timeout': NUMBER,
+        'ttl': NUMBER,
+        'registries': [{
+            'host': str,
+            'username': str,
+            'password': str,
+            'insecure': bool
+        }]
+    },
+    'gitCheck': {
+        'enabled': bool,
+        'timeout': NUMBER,
+        'ttl': NUMBER
+    },
+    'daemon': {
+        'defaultSchedule': (str, int),
+        'staggerSeconds': NUMBER,
+        'discoveryInterval': NUMBER
+    },
+    'instances': [INSTANCE_SCHEMA]
+}
+
+TYPE_NAMES = {str: 'a string', bool: 'true or false', int: 'an integer', float: 'a number', list: 'a list', dict: 'a mapping'}
+
+def validate_config(config: dict):
+    '''Check the configuration against the schema, returning one message per problem found.'''
+    errors = []
+    _check(config, CONFIG_SCHEMA, '', errors)
+    return errors
+
+def _check(value, schema, path: str, errors: list):
+    # Keys left empty in the YAML file fall back to their default
+    if value is None:
+        return
+
+    if isinstance(schema, tuple):
+        for option in schema:
+            option_errors = []
+            _check(value, option, path, option_errors)
+            if not option_errors:
+                return
+            # A list or mapping of the expected shape reports what is wrong inside it
+            if isinstance(option, (list, dict)) and isinstance(value, type(option)):
+                errors.extend(option_errors)
+                return
+        errors.append(f'"{path}" must be {" or ".join(_describe(option) for option in schema)}.')
+    elif isinstance(schema, dict):
+        if not isinstance(value, dict):
+            errors.append(f'"{path}" must be a mapping.')
+            return
+        for key, item in value.items():
+            child = f'{path}.{key}' if path else str(key)
+            if key in schema:
+                _check(item, schema[key], child, errors)
+            elif '*' in schema:
+                _check(item, schema['*'], child, errors)
+            else:
+                errors.append(_unknown_key(key, schema, child))
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            errors.append(f'"{path}" must be a list.')
+            return
+        for position, item in enumerate(value):
+            _check(item, schema[0], f'{path}[{position}]', errors)
+    elif isinstance(value, bool) and schema is not bool:
+        # YAML true/false are bools, which Python also counts as integers
+        errors.append(f'"{path}" must be {_describe(schema)}.')
+    elif not isinstance(value, schema):
+        errors.append(f'"{path}" must be {_describe(schema)}.')
+
+def _unknown_key(key, schema: dict, path: str):
+    '''Report an unknown key, suggesting the closest known one since it is most likely a typo.'''
+    suggestions = get_close_matches(str(key), list(schema), n=1)
+    if suggestions:
+        return f'Unknown key "{path}", did you mean "{suggestions[0]}"?'
+    return f'Unknown key "{path}".'
+
+def _describe(schema):
+    if isinstance(schema, list):
+        return 'a list'
+    if isinstance(schema, dict):
+        return 'a mapping'
+    if isinstance(schema, tuple):
+        return ' or '.join(dict.fromkeys(_describe(option) for option in schema))
+    return TYPE_NAMES.get(schema, schema.__name__)
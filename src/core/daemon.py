@@ -0,0 +1,101 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from core.config import Config
+from core.instance_updater import InstanceUpdater
+from core.run_context import RunContext
+from core.schedule import Schedule
+from errors.schedule_error import ScheduleError
+from logs.base_logger import BaseLogger
+from logs.buffered_logger import BufferedLogger
+
+class ScheduledInstance:
+    '''An instance updater kept alive between runs, with its schedule and next run time.'''
+
+    def __init__(self, updater: InstanceUpdater, logger: BufferedLogger, schedule: Schedule, offset: timedelta, now: datetime):
+        self.updater = updater
+        self.logger = logger
+        self.schedule = schedule
+        self.offset = offset
+        self.future = None
+
+        # Interval schedules start right away, cron schedules wait for their first slot
+        self.slot = now if schedule.interval is not None else schedule.next_run(now)
+        self.next_run = self.slot + offset
+
+    def advance(self, now: datetime):
+        '''Move to the next slot in the future, skipping the ones missed while running.'''
+        while self.slot + self.offset <= now:
+            self.slot = self.schedule.next_run(self.slot)
+        self.next_run = self.slot + self.offset
+
+    def run(self):
+        try:
+            self.updater.run()
+        except Exception as e:
+            self.updater.report_unexpected_error(e)
+        finally:
+            self.logger.flush()
+
+class Daemon:
+    '''Long-lived mode that runs every instance on its own schedule, keeping sessions and discovery warm.'''
+
+    def __init__(self, config: Config, logger: BaseLogger, context: RunContext = None, workers: int = 1):
+        daemon_config = config.daemon
+        default_schedule = daemon_config.get('defaultSchedule', '15m')
+        stagger = daemon_config.get('staggerSeconds', 30)
+        discovery_ttl = daemon_config.get('discoveryInterval', 3600)
+
+        self.logger = logger
+        self.workers = workers
+        self.stop_event = threading.Event()
+        self.instances = []
+
+        now = datetime.now()
+        for instance in config.instances:
+            # Spread the instances so they do not all fire at the same time
+            offset = timedelta(seconds=len(self.instances) * stagger)
+            instance_logger = BufferedLogger(logger)
+            updater = InstanceUpdater(instance.index, instance, instance_logger, context, discovery_ttl=discovery_ttl)
+            try:
+                # The first slot of a cron schedule is computed here too
+                scheduled = ScheduledInstance(updater, instance_logger, Schedule(instance.schedule or default_schedule), offset, now)
+            except ScheduleError as e:
+                logger.log(f'Instance at index {instance.index} has an invalid schedule and will not run: {e}', level='ERROR')
+                continue
+            self.instances.append(scheduled)
+
+    def stop(self, *_):
+        '''Ask the daemon to stop once the running instances finish.'''
+        self.stop_event.set()
+
+    def run(self):
+        '''Run the instances on their schedules until SIGTERM or SIGINT is received.'''
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if not self.instances:
+            self.logger.log('No instance with a valid schedule, the daemon has nothing to do.', level='ERROR')
+            return
+
+        self.logger.log(f'Daemon started with {len(self.instances)} scheduled instances.')
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self.stop_event.is_set():
+                now = datetime.now()
+                for scheduled in self.instances:
+                    if scheduled.next_run > now:
+                        continue
+
+                    # Never run the same instance twice at the same time
+                    if scheduled.future is None or scheduled.future.done():
+                        scheduled.future = executor.submit(scheduled.run)
+                    scheduled.advance(now)
+
+                next_run = min(scheduled.next_run for scheduled in self.instances)
+                self.stop_event.wait(max(0.0, (next_run - datetime.now()).total_seconds()))
+
+            self.logger.log('Stop requested, waiting for the running instances to finish.')
+
+        self.logger.log('Daemon stopped.')
@@ -0,0 +1,118 @@
+import threading
+import time
+from concurrent.futures import Future
+import yaml
+from core.image_reference import ImageReference, interpolate
+from core.registry_client import RegistryClient
+from errors.registry_error import RegistryError
+
+class DigestResolver:
+    '''Resolve each unique image reference once per run, shared by every stack, environment and instance.'''
+
+    def __init__(self, client: RegistryClient, ttl: float = 300):
+        self.client = client
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.digests = {}
+
+    @classmethod
+    def from_config(cls, registry_config: dict, metrics=None):
+        '''Build the resolver from the registryCheck section of the configuration.'''
+        client = RegistryClient(registries=registry_config.get('registries'), pool_size=registry_config.get('poolSize', 10),
+                                timeout=registry_config.get('timeout', 10), metrics=metrics)
+        return cls(client, ttl=registry_config.get('ttl', 300))
+
+    def close(self):
+        self.client.close()
+
+    def resolve(self, reference: ImageReference):
+        '''Return the remote digest of the reference, or None if it cannot be resolved.
+
+        Concurrent callers asking for the same reference wait for a single registry request.
+        '''
+        key = (reference.registry, reference.repository, reference.tag)
+        with self.lock:
+            resolved_at, future = self.digests.get(key, (0, None))
+            owner = future is None or time.monotonic() - resolved_at >= self.ttl
+            if owner:
+                future = Future()
+                self.digests[key] = (time.monotonic(), future)
+
+        if owner:
+            try:
+                future.set_result(self.client.get_digest(reference))
+            except RegistryError:
+                # Failures are remembered too, a registry that is down is not asked again for every stack
+                future.set_result(None)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+        return future.result()
+
+    @staticmethod
+    def compose_images(stack_file_content: str, env: list[dict]):
+        '''Return the image reference of each service of a Compose file, with the stack variables substituted.
+
+        Returns None if the file cannot be parsed or an image uses a variable without a value.
+        '''
+        try:
+            compose = yaml.safe_load(stack_file_content)
+        except yaml.YAMLError:
+            return None
+
+        services = compose.get('services') if isinstance(compose, dict) else None
+        if not isinstance(services, dict):
+            return None
+
+        variables = {variable.get('name'): variable.get('value') for variable in env or []}
+        images = {}
+        for service_name, service in services.items():
+            image = service.get('image') if isinstance(service, dict) else None
+            if not image:
+                # Services built from a Dockerfile have no registry image to compare
+                return None
+            image = interpolate(str(image), variables)
+            if not image:
+                return None
+            images[service_name] = ImageReference.parse(image)
+
+        return images
+
+    @staticmethod
+    def running_digests(containers: list[dict], images: list[dict]):
+        '''Map (compose project, service) to the repository digests of the images their containers run.'''
+        image_digests = {}
+        for image in images:
+            image_digests[image.get('Id')] = {digest.partition('@')[2] for digest in image.get('RepoDigests') or []}
+
+        running = {}
+        for container in containers:
+            labels = container.get('Labels') or {}
+            key = (labels.get('com.docker.compose.project'), labels.get('com.docker.compose.service'))
+            running.setdefault(key, []).append(image_digests.get(container.get('ImageID'), set()))
+
+        return running
+
+    def stack_status(self, stack_name: str, stack_file_content: str, env: list[dict], running: dict):
+        '''Compare the running images of a stack with the registry. Returns 'outdated', 'updated' or None when unknown.'''
+        images = self.compose_images(stack_file_content, env)
+        if not images:
+            return None
+
+        for service_name, reference in images.items():
+            containers = running.get((stack_name, service_name))
+            if not containers:
+                return None
+
+            # A reference pinned to a digest always runs that digest
+            if reference.digest:
+                continue
+
+            digest = self.resolve(reference)
+            if digest is None or not all(containers):
+                return None
+            if any(digest not in digests for digests in containers):
+                return 'outdated'
+
+        return 'updated'
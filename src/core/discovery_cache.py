@@ -0,0 +1,91 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Stack fields kept in the cache, everything the update loop reads before a redeploy
+_STACK_FIELDS = ('Id', 'Name', 'EndpointId', 'Type', 'Status', 'CreationDate', 'UpdateDate')
+
+# Git fields kept in the cache, the ones the Git check compares with the remote
+_GIT_FIELDS = ('URL', 'ReferenceName', 'ConfigFilePath', 'ConfigHash')
+
+class DiscoveryCache:
+    '''On-disk cache of the stack listing of each environment, reused for `ttl` seconds.
+
+    This is a plain TTL cache: nothing tells when the stacks of an environment change without listing them, so stacks
+    created, deleted or edited since the listing are only seen once it expires.
+    '''
+
+    def __init__(self, path: str, ttl: int = 3600):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # Git credentials of the stacks listed by this process, kept in memory only
+        self.credentials = {}
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # Listings stored with an environment fingerprint by earlier versions
+        self.connection.execute('DROP TABLE IF EXISTS environment_stacks')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS stack_listings (
+                instance TEXT NOT NULL,
+                environment_id INTEGER NOT NULL,
+                stacks TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (instance, environment_id)
+            )''')
+        self.connection.execute('DELETE FROM stack_listings WHERE fetched_at < ?', (time.time() - self.ttl,))
+        self.connection.commit()
+
+    def get_stacks(self, instance: str, environment_id: int):
+        '''Return the cached stack listing of the environment, or None if it must be listed again.
+
+        Git stacks that need credentials only get them back when this process listed them, otherwise their GitConfig
+        has `Authenticated` set and no `Authentication`.
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT stacks, fetched_at FROM stack_listings WHERE instance = ? AND environment_id = ?',
+                (instance, environment_id)).fetchone()
+
+        if not row:
+            return None
+
+        stacks, fetched_at = row
+        if time.time() - fetched_at >= self.ttl:
+            return None
+
+        stacks = json.loads(stacks)
+        for stack in stacks:
+            authentication = self.credentials.get((instance, stack.get('Id')))
+            if authentication and stack.get('GitConfig'):
+                stack['GitConfig']['Authentication'] = authentication
+        return stacks
+
+    def set_stacks(self, instance: str, environment_id: int, stacks: list[dict]):
+        '''Store a slim copy of the stack listing of the environment.'''
+        slim_stacks = [self._slim_stack(stack) for stack in stacks]
+        with self.lock:
+            for stack in stacks:
+                authentication = (stack.get('GitConfig') or {}).get('Authentication')
+                if authentication:
+                    self.credentials[(instance, stack.get('Id'))] = authentication
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stack_listings (instance, environment_id, stacks, fetched_at) VALUES (?, ?, ?, ?)',
+                (instance, environment_id, json.dumps(slim_stacks), time.time()))
+            self.connection.commit()
+
+    def close(self):
+        '''Close the database connection.'''
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def _slim_stack(stack: dict):
+        # Env and Git credentials are not written to disk, the stack is fetched again before a redeploy
+        slim = {field: stack.get(field) for field in _STACK_FIELDS}
+        git_config = stack.get('GitConfig')
+        if git_config:
+            slim['GitConfig'] = {key: git_config.get(key) for key in _GIT_FIELDS}
+            slim['GitConfig']['Authenticated'] = bool(git_config.get('Authentication'))
+        return slim
@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+@dataclass(frozen=True, slots=True)
+class FlowStep:
+    '''One I/O operation yielded by an update flow, carried out by the engine driving it.
+
+    The update logic is written once as generators yielding steps, `drive` runs them with the blocking Portainer
+    client and threads, `drive_async` with AsyncPortainer on an event loop. A flow receives the result of each step,
+    or has its exception raised at the yield.
+    '''
+    kind: str
+    target: object
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    concurrency: int = 1
+    return_exceptions: bool = True
+
+    @classmethod
+    def call(cls, method: str, *args, **kwargs):
+        '''Call a method of the Portainer client.'''
+        return cls('call', method, args, kwargs)
+
+    @classmethod
+    def collect(cls, method: str, *args, **kwargs):
+        '''Read a streamed listing of the Portainer client into a list.'''
+        return cls('collect', method, args, kwargs)
+
+    @classmethod
+    def blocking(cls, function, *args, **kwargs):
+        '''Call a blocking function shared by every engine (git, registry lookups), on a thread of the event loop for asyncio.'''
+        return cls('blocking', function, args, kwargs)
+
+    @classmethod
+    def sleep(cls, seconds: float):
+        return cls('sleep', seconds)
+
+    @classmethod
+    def gather(cls, items: list, concurrency: int, return_exceptions: bool = True):
+        '''Run flows or steps with at most `concurrency` of them at a time, returning their results in order.
+
+        With return_exceptions, a failed item returns its exception, otherwise the first failure cancels the items
+        that have not started and is raised.
+        '''
+        return cls('gather', list(items), concurrency=max(1, concurrency), return_exceptions=return_exceptions)
+
+def drive(flow, client):
+    '''Run a flow with a blocking client, returning its result.'''
+    result, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error is not None else flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = _execute(step, client), None
+        except Exception as e:
+            result, error = None, e
+
+def _execute(step: FlowStep, client):
+    if step.kind == 'call':
+        return getattr(client, step.target)(*step.args, **step.kwargs)
+    if step.kind == 'collect':
+        return list(getattr(client, step.target)(*step.args, **step.kwargs))
+    if step.kind == 'blocking':
+        return step.target(*step.args, **step.kwargs)
+    if step.kind == 'sleep':
+        return time.sleep(step.target)
+    if step.kind == 'gather':
+        return _gather(step, client)
+    raise ValueError(f'Unknown flow step {step.kind}.')
+
+def _gather(step: FlowStep, client):
+    def run(item):
+        return _execute(item, client) if isinstance(item, FlowStep) else drive(item, client)
+
+    items = step.target
+    if step.concurrency == 1 or len(items) <= 1:
+        results = []
+        for item in items:
+            try:
+                results.append(run(item))
+            except Exception as e:
+                if not step.return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(step.concurrency, len(items))) as executor:
+        futures = [executor.submit(run, item) for item in items]
+        if step.return_exceptions:
+            return [future.exception() or future.result() for future in futures]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            # Items that have not started yet are dropped, the running ones finish
+            for future in futures:
+                future.cancel()
+            raise
+
+async def drive_async(flow, client):
+    '''Run a flow with an AsyncPortainer client on the running event loop, returning its result.'''
+    result, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error is not None else flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = await _execute_async(step, client), None
+        except Exception as e:
+            result, error = None, e
+
+async def _execute_async(step: FlowStep, client):
+    import asyncio
+
+    if step.kind == 'call':
+        return await getattr(client, step.target)(*step.args, **step.kwargs)
+    if step.kind == 'collect':
+        return [item async for item in getattr(client, step.target)(*step.args, **step.kwargs)]
+    if step.kind == 'blocking':
+        return await asyncio.to_thread(step.target, *step.args, **step.kwargs)
+    if step.kind == 'sleep':
+        return await asyncio.sleep(step.target)
+    if step.kind == 'gather':
+        semaphore = asyncio.Semaphore(step.concurrency)
+
+        async def run(item):
+            async with semaphore:
+                return await (_execute_async(item, client) if isinstance(item, FlowStep) else drive_async(item, client))
+
+        tasks = [asyncio.ensure_future(run(item)) for item in step.target]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=step.return_exceptions)
+        finally:
+            for task in tasks:
+                task.cancel()
+    raise ValueError(f'Unknown flow step {step.kind}.')
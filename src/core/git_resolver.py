@@ -0,0 +1,119 @@
+import base64
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from urllib.parse import urlsplit
+from errors.git_error import GitError
+
+class GitResolver:
+    '''Resolve the current commit of each Git repository and reference once per run, shared by every stack using them.
+
+    Uses `git ls-remote`, which only reads the references of the remote without cloning it.
+    '''
+
+    def __init__(self, timeout: float = 30, ttl: float = 300):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.commits = {}
+
+    @classmethod
+    def from_config(cls, git_config: dict):
+        '''Build the resolver from the gitCheck section of the configuration.'''
+        return cls(timeout=git_config.get('timeout', 30), ttl=git_config.get('ttl', 300))
+
+    def resolve(self, git_config: dict):
+        '''Return the commit the reference of a stack GitConfig points to, or None if it cannot be resolved.
+
+        Concurrent callers asking for the same repository and reference wait for a single lookup.
+        '''
+        url = git_config.get('URL')
+        reference = git_config.get('ReferenceName') or 'HEAD'
+        if not url:
+            return None
+
+        key = (url, reference)
+        with self.lock:
+            resolved_at, future = self.commits.get(key, (0, None))
+            owner = future is None or time.monotonic() - resolved_at >= self.ttl
+            if owner:
+                future = Future()
+                self.commits[key] = (time.monotonic(), future)
+
+        if owner:
+            authentication = git_config.get('Authentication') or {}
+            try:
+                future.set_result(self.ls_remote(url, reference, authentication.get('Username'), authentication.get('Password')))
+            except GitError:
+                # Stacks waiting for this lookup share its failure, later ones try again since their credentials may differ
+                with self.lock:
+                    if self.commits.get(key, (0, None))[1] is future:
+                        del self.commits[key]
+                future.set_result(None)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+
+        return future.result()
+
+    def ls_remote(self, url: str, reference: str, username: str = None, password: str = None):
+        '''Ask the remote which commit the reference points to. Raises GitError if it cannot be read.'''
+        # The second pattern lists the commit an annotated tag points to
+        command = ['git', 'ls-remote', '--', url, reference, f'{reference}^{{}}']
+        # Never wait for a password prompt, private repositories without credentials simply fail
+        credentials = self._credentials_env(url, username, password)
+        env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0', 'GIT_ASKPASS': '', 'SSH_ASKPASS': '', 'GIT_SSH_COMMAND': 'ssh -o BatchMode=yes', **credentials}
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout, env=env, stdin=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise GitError('git is not installed.')
+        except subprocess.TimeoutExpired:
+            raise GitError(f'No answer from {self._scrub(url)} within {self.timeout} seconds.')
+
+        if result.returncode != 0:
+            details = self._scrub(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else '', password, credentials.get('GIT_CONFIG_VALUE_0', '').rpartition(' ')[2])
+            raise GitError(f'Could not list the references of {self._scrub(url)}' + (f': {details}' if details else '.'))
+        return self.parse_ls_remote(result.stdout, reference)
+
+    @staticmethod
+    def parse_ls_remote(output: str, reference: str):
+        '''Pick the commit of the reference from ls-remote output, peeling annotated tags. Raises GitError if it is missing.'''
+        refs = {}
+        for line in output.splitlines():
+            commit, _, name = line.partition('\t')
+            if name:
+                refs[name] = commit
+
+        # Full names are used as they are, a short name is a branch first, then a tag, never a longer name ending with it
+        if reference == 'HEAD' or reference.startswith('refs/'):
+            candidates = [f'{reference}^{{}}', reference]
+        else:
+            candidates = [f'refs/heads/{reference}', f'refs/tags/{reference}^{{}}', f'refs/tags/{reference}']
+
+        for name in candidates:
+            if name in refs:
+                return refs[name]
+        raise GitError(f'Reference {reference} was not found.')
+
+    @staticmethod
+    def _credentials_env(url: str, username: str = None, password: str = None):
+        '''Pass the stack credentials of an HTTP(S) repository as an Authorization header set through the environment.
+
+        Arguments can be read by any local user from the process list, the environment of a process only by its owner.
+        '''
+        if not username or not password or urlsplit(url).scheme not in ('http', 'https'):
+            return {}
+        token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        return {'GIT_CONFIG_COUNT': '1', 'GIT_CONFIG_KEY_0': 'http.extraHeader', 'GIT_CONFIG_VALUE_0': f'Authorization: Basic {token}'}
+
+    @staticmethod
+    def _scrub(text: str, *secrets: str):
+        '''Remove credentials from a URL or git output before it is logged.'''
+        text = re.sub(r'(://)[^/@\s]+@', r'\1***@', text)
+        for secret in secrets:
+            if secret:
+                text = text.replace(secret, '***')
+        return text
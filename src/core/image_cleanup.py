@@ -0,0 +1,86 @@
+import re
+from dataclasses import dataclass
+
+SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+def parse_size(value):
+    '''Parse a size such as 500MB or 10GB (binary units) into bytes, plain numbers are bytes.'''
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*', str(value).upper())
+    if not match:
+        raise ValueError(f'Invalid size: {value}')
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit if unit in SIZE_UNITS else unit + 'B'])
+
+@dataclass
+class ImageCleanup:
+    '''Pick the unused images of an environment to delete, and how to delete them.'''
+    concurrency: int = 4
+    prune: bool = False
+    keep_last_tags: int = 0
+    reclaim_target: int = 0
+    dry_run: bool = False
+    always: bool = False
+
+    @classmethod
+    def from_instance(cls, instance: dict):
+        '''Read the imageCleanup settings of an instance.'''
+        config = instance.get('imageCleanup') or {}
+        return cls(
+            concurrency=max(1, config.get('concurrency', cls.concurrency)),
+            prune=config.get('prune', cls.prune),
+            keep_last_tags=max(0, config.get('keepLastTags', cls.keep_last_tags)),
+            reclaim_target=parse_size(config.get('reclaimTarget', cls.reclaim_target)),
+            dry_run=config.get('dryRun', cls.dry_run),
+            always=config.get('always', cls.always))
+
+    @property
+    def uses_prune(self):
+        '''A single prune call removes every unused image, so it is only used without a retention or size policy.'''
+        return self.prune and not self.keep_last_tags and not self.reclaim_target and not self.dry_run
+
+    def preview(self, images: list[dict]):
+        '''The images a cleanup would delete now, every unused image when a single prune call is used.'''
+        if self.uses_prune:
+            return [image for image in images if not image.get('used', True)]
+        return self.select(images)
+
+    def select(self, images: list[dict]):
+        '''Return the unused images to delete, largest first, honouring the retention and the reclaim target.'''
+        kept = self._retained(images)
+        candidates = [
+            image for image in images
+            if not image.get('used', True) and image.get('id') and image.get('id') not in kept
+        ]
+        candidates.sort(key=lambda image: image.get('size', 0), reverse=True)
+
+        if not self.reclaim_target:
+            return candidates
+
+        selected = []
+        reclaimed = 0
+        for image in candidates:
+            if reclaimed >= self.reclaim_target:
+                break
+            selected.append(image)
+            reclaimed += image.get('size', 0)
+        return selected
+
+    def _retained(self, images: list[dict]):
+        '''Ids of the newest keep_last_tags images of each repository, used images included.'''
+        if not self.keep_last_tags:
+            return set()
+
+        repositories = {}
+        for image in images:
+            for tag in image.get('tags') or []:
+                repository = tag.rpartition(':')[0] if ':' in tag.rpartition('/')[2] else tag
+                repositories.setdefault(repository, {})[image.get('id')] = image.get('created', 0)
+
+        kept = set()
+        for created_by_id in repositories.values():
+            newest = sorted(created_by_id, key=created_by_id.get, reverse=True)
+            kept.update(newest[:self.keep_last_tags])
+        return kept
@@ -0,0 +1,66 @@
+import re
+from dataclasses import dataclass
+
+DOCKER_HUB = 'docker.io'
+
+# ${VAR}, ${VAR:-default}, ${VAR-default} and $VAR, the forms Docker Compose interpolates
+VARIABLE = re.compile(r'\$(?:\{(?P<braced>[A-Za-z_][A-Za-z0-9_]*)(?:(?P<separator>:?-)(?P<default>[^}]*))?\}|(?P<plain>[A-Za-z_][A-Za-z0-9_]*))')
+
+@dataclass(frozen=True)
+class ImageReference:
+    '''An image reference of a stack file, split into registry, repository, tag and pinned digest.'''
+    registry: str
+    repository: str
+    tag: str = 'latest'
+    digest: str = None
+
+    @classmethod
+    def parse(cls, reference: str):
+        '''Parse a reference such as postgres:16, ghcr.io/org/app:1.2 or registry:5000/app@sha256:...'''
+        name, _, digest = reference.partition('@')
+
+        # A colon after the last slash separates the tag, a colon before it belongs to a registry port
+        tag = 'latest'
+        slash = name.rfind('/')
+        colon = name.rfind(':')
+        if colon > slash:
+            name, tag = name[:colon], name[colon + 1:]
+
+        first, _, rest = name.partition('/')
+        if rest and ('.' in first or ':' in first or first == 'localhost'):
+            registry, repository = first, rest
+        else:
+            registry, repository = DOCKER_HUB, name
+
+        if registry == DOCKER_HUB and '/' not in repository:
+            repository = f'library/{repository}'
+
+        return cls(registry=registry, repository=repository, tag=tag, digest=digest or None)
+
+    @property
+    def api_host(self):
+        '''Host serving the registry v2 API.'''
+        return 'registry-1.docker.io' if self.registry == DOCKER_HUB else self.registry
+
+    def __str__(self):
+        return f'{self.registry}/{self.repository}:{self.tag}' + (f'@{self.digest}' if self.digest else '')
+
+def interpolate(value: str, env: dict):
+    '''Substitute Compose variables from the stack environment. Returns None if a variable has no value.'''
+    missing = False
+
+    def substitute(match: re.Match):
+        nonlocal missing
+        variable = match.group('braced') or match.group('plain')
+        current = env.get(variable)
+        separator = match.group('separator')
+
+        if separator == ':-' and not current or separator == '-' and current is None:
+            return match.group('default')
+        if current is None:
+            missing = True
+            return ''
+        return current
+
+    result = VARIABLE.sub(substitute, value.replace('$$', '\0')).replace('\0', '$')
+    return None if missing else result
@@ -0,0 +1,99 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from core.image_cleanup import ImageCleanup
+from core.redeploy_scheduler import RedeployScheduler
+from core.request_policy import RequestPolicy
+from core.stack_matcher import StackMatcher
+
+# Keys left out of the fingerprint, so it can be stored in plans and reports
+SECRET_KEYS = ('accessToken',)
+
+@dataclass(frozen=True, slots=True)
+class InstanceConfig:
+    '''Settings of a Portainer instance, compiled once when the configuration is read.'''
+    index: int
+    name: str = None
+    host: str = None
+    access_token: str = None
+    verify_ssl: bool = False
+    update_portainer: bool = False
+    update_stacks_with_git: bool = False
+    prune_services: bool = False
+    delete_unused_images: bool = False
+    refresh_concurrency: int = 4
+    timeout: float = None
+    self_update_timeout: float = 300
+    schedule: str = None
+    ignore_stacks: StackMatcher = field(default_factory=StackMatcher)
+    include_stacks: tuple = ()
+    request_policy: RequestPolicy = field(default_factory=RequestPolicy)
+    redeploy_scheduler: RedeployScheduler = field(default_factory=RedeployScheduler)
+    image_cleanup: ImageCleanup = field(default_factory=ImageCleanup)
+    fingerprint: str = ''
+
+    @classmethod
+    def from_dict(cls, index: int, instance: dict):
+        '''Compile an instance of the configuration file. Raises ValueError if a setting cannot be used.'''
+        # Keys left empty in the YAML file fall back to their default
+        instance = {key: value for key, value in (instance or {}).items() if value is not None}
+        if instance.get('imageCleanup'):
+            instance['imageCleanup'] = {key: value for key, value in instance['imageCleanup'].items() if value is not None}
+        where = f'of the instance at index {index}'
+
+        try:
+            image_cleanup = ImageCleanup.from_instance(instance)
+        except ValueError:
+            raise ValueError(f'"imageCleanup.reclaimTarget" {where} must be a size such as 500MB or 10GB.')
+
+        try:
+            ignore_stacks = StackMatcher(instance.get('ignoreStacks'))
+        except ValueError as e:
+            raise ValueError(f'"ignoreStacks" {where} has an {e}.')
+
+        # A list applies to every environment, a mapping lists the stacks per environment name or pattern
+        include = instance.get('includeStacks') or []
+        rules = include.items() if isinstance(include, dict) else [('*', include)] if include else []
+        try:
+            include_stacks = tuple((StackMatcher([environment]), StackMatcher(patterns)) for environment, patterns in rules)
+        except ValueError as e:
+            raise ValueError(f'"includeStacks" {where} has an {e}.')
+
+        schedule = instance.get('schedule')
+        return cls(
+            index=index,
+            name=instance.get('name'),
+            host=instance.get('host'),
+            access_token=instance.get('accessToken'),
+            verify_ssl=bool(instance.get('verifySSL', False)),
+            update_portainer=bool(instance.get('updatePortainerVersion', False)),
+            update_stacks_with_git=bool(instance.get('updateStacksWithGitIntegration', False)),
+            prune_services=bool(instance.get('pruneServices', False)),
+            delete_unused_images=bool(instance.get('deleteUnusedImages', False)),
+            refresh_concurrency=max(1, instance.get('refreshConcurrency', 4)),
+            timeout=instance.get('instanceTimeout'),
+            self_update_timeout=instance.get('selfUpdateTimeout', 300),
+            schedule=str(schedule) if schedule is not None else None,
+            ignore_stacks=ignore_stacks,
+            include_stacks=include_stacks,
+            request_policy=RequestPolicy.from_instance(instance),
+            redeploy_scheduler=RedeployScheduler.from_instance(instance),
+            image_cleanup=image_cleanup,
+            fingerprint=fingerprint({key: value for key, value in instance.items() if key not in SECRET_KEYS}))
+
+    def included_stacks(self, env_name: str):
+        '''Matchers of the stacks included in an environment, or None when every stack is included.'''
+        matchers = [stacks for environments, stacks in self.include_stacks if environments.matches(env_name)]
+        return matchers or None
+
+    def skip_reason(self, stack_name: str, included: list = None):
+        '''Why a stack is left out by the ignore and include rules, None if it is processed.'''
+        if self.ignore_stacks.matches(stack_name):
+            return 'ignored'
+        if included is not None and not any(matcher.matches(stack_name) for matcher in included):
+            return 'not included'
+        return None
+
+def fingerprint(value):
+    '''Stable hash of a configuration value, equal for equal settings whatever the key order.'''
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
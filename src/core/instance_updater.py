@@ -0,0 +1,852 @@
+import time
+from contextlib import nullcontext
+from core.flow_step import FlowStep, drive
+from core.instance_config import InstanceConfig
+from core.portainer import Portainer
+from core.redeploy_scheduler import COMPOSE_STACK_TYPE
+from core.run_context import RunContext
+from errors.circuit_open_error import CircuitOpenError
+from errors.portainer_error import PortainerError
+from errors.instance_timeout_error import InstanceTimeoutError
+from errors.stack_not_found_error import StackNotFoundError
+from logs.base_logger import BaseLogger
+from logs.event import Event
+from utils.helpers import format_size
+
+# Seconds between the readiness checks of a Portainer instance restarting after a self-update, doubling up to the maximum
+SELF_UPDATE_FIRST_POLL = 1
+SELF_UPDATE_MAX_POLL = 10
+
+class InstanceUpdater:
+    '''Check and redeploy the stacks of a Portainer instance.
+
+    The instance -> environment -> stack flow is written once as generators yielding FlowSteps, run here with the
+    blocking Portainer client and threads, and by AsyncInstanceUpdater on an event loop.
+    '''
+
+    def __init__(self, index: int, instance: InstanceConfig, logger: BaseLogger, context: RunContext = None, discovery_ttl: float = 0):
+        self.index = index
+        self.logger = logger
+        self.context = context or RunContext()
+        self.cache = self.context.cache
+        self.discovery_cache = self.context.discovery_cache
+        self.metrics = self.context.metrics
+        self.digest_resolver = self.context.digest_resolver
+        self.git_resolver = self.context.git_resolver
+        self.plan = self.context.plan
+        self.applied_plan = self.context.applied_plan
+        self.events = self.context.events
+        self.discovery_ttl = discovery_ttl
+
+        self.settings = instance
+        self.name = instance.name
+        self.host = instance.host
+        self.access_token = instance.access_token
+        self.verify_ssl = instance.verify_ssl
+        self.update_portainer = instance.update_portainer
+        self.delete_unused_images_flag = instance.delete_unused_images
+        self.prune_services = instance.prune_services
+        self.update_stacks_with_git = instance.update_stacks_with_git
+        self.timeout = instance.timeout
+        self.refresh_concurrency = instance.refresh_concurrency
+        self.request_policy = instance.request_policy
+        self.redeploy_scheduler = instance.redeploy_scheduler
+        self.image_cleanup = instance.image_cleanup
+
+        self.deadline = None
+
+        # Set while Portainer restarts after a self-update: when it started, the version it ran, whether the update
+        # succeeded and whether a poll found it down since
+        self.restarting_since = None
+        self.previous_version = None
+        self.update_succeeded = False
+        self.went_down = False
+
+        # Session and discovered environments/stacks, kept warm between runs in daemon mode
+        self.portainer = None
+        self.environments = None
+        self.environments_at = 0
+        self.stacks = {}
+
+    def _phase(self, name: str):
+        '''Time a phase of the instance when metrics are enabled.'''
+        return self.metrics.phase(self.name, name) if self.metrics else nullcontext()
+
+    def _check_deadline(self):
+        '''Stop processing the instance if its wall-clock budget is exhausted.'''
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise InstanceTimeoutError(f'Portainer instance [{self.name}]({self.host}) exceeded its time budget of {self.timeout} seconds, skipping the remaining work.')
+
+    @property
+    def label(self):
+        '''Name of the instance in events and summaries.'''
+        return self.name or f'instance at index {self.index}'
+
+    def _event(self, action: str, environment: str = None, stack: str = None, **details):
+        '''Record what happened for the run or instance summary.'''
+        if self.events:
+            self.events.record(Event(self.label, action, environment, stack, **details))
+
+    def run(self, defer_restart: bool = False):
+        '''Process every environment and stack of the Portainer instance, then send its summary if summaries are per instance.
+
+        With defer_restart, the run stops once a Portainer self-update is started and returns True, run must then be
+        called again to wait for the new version and process the environments, leaving the time of the restart to
+        the other instances.
+        '''
+        restarting = False
+        try:
+            restarting = self._run(defer_restart)
+            return restarting
+        finally:
+            if not restarting:
+                self._send_summary()
+
+    def report_unexpected_error(self, error: Exception):
+        '''Log an error that stopped the run and record it, with its own summary when summaries are per instance.'''
+        self.logger.log(f'Unexpected error while processing instance at index {self.index}: {error}', level='ERROR')
+        self._event('failed', error=f'unexpected error: {error}')
+        self._send_summary()
+
+    def _send_summary(self):
+        if self.events and self.events.per_instance:
+            summary = self.events.summary(self.label, drain=True)
+            if summary:
+                self.logger.notify(summary)
+
+    def _run(self, defer_restart: bool = False):
+        if not self._start():
+            return False
+
+        if self.portainer is None:
+            self.portainer = Portainer(url=self.host, access_token=self.access_token, verify_ssl=self.verify_ssl,
+                                       pool_size=max(self.refresh_concurrency, self.redeploy_scheduler.concurrency), metrics=self.metrics, instance_name=self.name,
+                                       policy=self.request_policy)
+        self.portainer.deadline = self.deadline
+        return drive(self._flow(defer_restart), self.portainer)
+
+    def _start(self):
+        '''Check the settings and start the time budget of a run. Returns False if the instance cannot be processed.'''
+        if not all([self.name, self.host, self.access_token]):
+            self.logger.log(f'Instance {self.name} is missing required fields.' if self.name else
+                            f'Instance at index {self.index} is missing required fields.',
+                            level='ERROR')
+            self._event('failed', error='missing required fields')
+            return False
+
+        # A run resumed after a self-update keeps the budget and plan entry of its first start
+        if self.restarting_since is not None:
+            return True
+
+        # The clients cap their timeouts and retries at what is left of the budget
+        self.deadline = time.monotonic() + self.timeout if self.timeout else None
+
+        if self.plan:
+            self.plan.add_instance(self.index, self.name, self.host, self.settings.fingerprint)
+        return True
+
+    @staticmethod
+    def _outcomes(items: list, results: list):
+        '''Pair gathered items with their results, raising the errors that stop the instance.
+
+        A PortainerError only concerns its item and is returned for the caller to log.
+        '''
+        for item, result in zip(items, results):
+            if isinstance(result, BaseException) and (isinstance(result, CircuitOpenError) or not isinstance(result, PortainerError)):
+                raise result
+            yield item, result
+
+    def _flow(self, defer_restart: bool = False):
+        '''Process the environments of the instance, returning True if it stopped while Portainer restarts.'''
+        name, host = self.name, self.host
+
+        try:
+            if self.restarting_since is None:
+                # Ping the Portainer instance
+                yield FlowStep.call('ping')
+                self.logger.log(f'Successfully connected to Portainer instance: [{name}]({host})')
+
+                # Redeploy what a previous --plan run found, without checking the images again
+                if self.applied_plan:
+                    yield from self._apply_plan()
+                    self.logger.log(f'Finished processing Portainer instance [{name}]({host}).')
+                    return False
+
+                # Check if Portainer needs an update
+                if self.update_portainer and (yield FlowStep.call('check_if_portainer_needs_update')):
+                    self.logger.log(f'Portainer instance [{name}]({host}) needs an update.')
+                    if self.plan:
+                        # Plans only report the update, the next normal run applies it
+                        self.plan.add_instance(self.index, name, host, self.settings.fingerprint, portainer_update_available=True)
+                    else:
+                        previous_version = yield FlowStep.call('probe_version')
+                        self._update_portainer(previous_version, (yield FlowStep.call('update_portainer_version')))
+                        if defer_restart:
+                            self.logger.log(f'Portainer instance [{name}]({host}) is restarting, its environments are processed after the other instances.')
+                            return True
+
+            # Wait for the new version instead of a fixed delay
+            if self.restarting_since is not None:
+                yield from self._wait_until_restarted()
+
+            # Get portainer environments
+            with self._phase('discovery'):
+                environments = yield from self._get_environments()
+            self.logger.log(f'Retrieved {len(environments)} environments for Portainer instance [{name}]({host}).')
+
+            # Process each environment
+            for env in environments:
+                self._check_deadline()
+                if not self._is_online(env):
+                    continue
+                try:
+                    yield from self._process_environment(env)
+                except CircuitOpenError:
+                    raise
+                except PortainerError as e:
+                    self._log_error(e, env.get('Name'))
+                    continue
+
+            self.logger.log(f'Finished processing Portainer instance [{name}]({host}).')
+
+        except (PortainerError, InstanceTimeoutError) as e:
+            self._log_error(e)
+        return False
+
+    def _update_portainer(self, previous_version: str, succeeded: bool):
+        '''Log the outcome of a self-update and remember what to wait for while Portainer restarts.'''
+        if succeeded:
+            self.logger.log(f'Portainer instance [{self.name}]({self.host}) updated successfully.')
+            self._event('portainer_updated')
+        else:
+            self.logger.log(f'An error occurred while updating Portainer instance [{self.name}]({self.host}).', level='ERROR')
+            self._event('failed', error='Portainer update failed')
+
+        self.restarting_since = time.monotonic()
+        self.previous_version = previous_version
+        self.update_succeeded = succeeded
+        self.went_down = False
+
+    def _restart_result(self, version: str, timed_out: bool):
+        '''Check a readiness poll of a restarting Portainer. Returns True once it runs the new version.
+
+        When the version before the update is unknown, an answer only counts after a poll found Portainer down, the
+        first answers may come from the old version. After a failed update, any answer will do since the version is
+        not expected to change.
+        '''
+        elapsed = time.monotonic() - self.restarting_since
+        if not version:
+            self.went_down = True
+        restarted = version != self.previous_version if self.previous_version else self.went_down
+        if version and (restarted or not self.update_succeeded):
+            self.logger.log(f'Portainer instance [{self.name}]({self.host}) answers with version {version} after {elapsed:.0f} seconds.')
+            return True
+        if timed_out:
+            raise PortainerError(f'Portainer instance [{self.name}]({self.host}) did not come back with a new version within '
+                                 f'{self.settings.self_update_timeout} seconds of its update, skipping it.')
+        return False
+
+    def _wait_until_restarted(self):
+        '''Poll /api/system/status with a growing delay until the updated Portainer answers, up to selfUpdateTimeout.'''
+        give_up_at = self.restarting_since + self.settings.self_update_timeout
+        delay = SELF_UPDATE_FIRST_POLL
+        try:
+            while True:
+                version = yield FlowStep.call('probe_version')
+                if self._restart_result(version, time.monotonic() + delay > give_up_at):
+                    return
+                self._check_deadline()
+                yield FlowStep.sleep(delay)
+                delay = min(delay * 2, SELF_UPDATE_MAX_POLL)
+        finally:
+            # Also after a timeout or an error, the next run of a daemon must not start in the restarting state
+            self.restarting_since = None
+
+    def _log_error(self, error: Exception, env_name: str = None):
+        '''Log an error, also keeping it in the plan of --plan runs.'''
+        self.logger.log(error, level='ERROR')
+        self._event('failed', env_name, error=str(error))
+        if self.plan:
+            self.plan.add_error(self.name, self.host, str(error))
+
+    def _skip_stack(self, env_id: int, env_name: str, stack: dict, reason: str, action: str = 'skipped'):
+        '''Record why a stack is not redeployed, in the events and in the plan of --plan runs.'''
+        self._event(action, env_name, stack.get('Name'), reason=reason, error=reason if action == 'failed' else None)
+        if self.plan:
+            self.plan.add_stack(self.name, self.host, env_id, env_name, stack, reason=reason)
+
+    def _plans_cleanup(self, outdated_stacks: list[dict]):
+        '''Whether a --plan run lists the images the cleanup would delete in an environment.'''
+        return self.delete_unused_images_flag and bool(outdated_stacks or self.image_cleanup.always)
+
+    def _plan_environment(self, env_id: int, env_name: str, outdated_stacks: list[dict], images: list[dict]):
+        '''Record the outdated stacks of an environment and the images the cleanup would delete.'''
+        for stack in outdated_stacks:
+            self.plan.add_stack(self.name, self.host, env_id, env_name, stack)
+            self._event('outdated', env_name, stack.get('Name'))
+        if self._plans_cleanup(outdated_stacks):
+            self.plan.add_images(self.name, self.host, env_id, env_name, self.image_cleanup.preview(images))
+
+        self.logger.log(f'Planned {len(outdated_stacks)} outdated stacks for environment [{env_name}] in Portainer instance [{self.name}]({self.host}).')
+
+    def _planned_environments(self):
+        '''Environments of the applied plan with outdated stacks for this instance.'''
+        entry = self.applied_plan.instance(self.name, self.host)
+        if entry is None:
+            self.logger.log(f'Portainer instance [{self.name}]({self.host}) is not part of the plan, skipping it.', level='WARNING')
+            return []
+        if entry.get('config_fingerprint') not in (None, self.settings.fingerprint):
+            self.logger.log(f'The settings of Portainer instance [{self.name}]({self.host}) changed since the plan was computed, '
+                            f'redeploying the planned stacks anyway.', level='WARNING')
+        return [environment for environment in entry.get('environments', []) if environment.get('outdated')]
+
+    def _changed_since_plan(self, env_name: str, planned: dict, stack: dict):
+        '''A stack edited or redeployed after the plan was computed is left for the next run.'''
+        if (stack.get('UpdateDate') or stack.get('CreationDate')) == planned.get('version'):
+            return False
+
+        self.logger.log(f'Stack [{planned.get("name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                        f'changed since the plan was computed, skipping it.', level='WARNING')
+        self._event('skipped', env_name, planned.get('name'), reason='changed since the plan')
+        return True
+
+    def _deleted_since_plan(self, env_name: str, planned: dict):
+        '''A stack deleted after the plan was computed is skipped, the other planned stacks are still redeployed.'''
+        self.logger.log(f'Stack [{planned.get("name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                        f'no longer exists, skipping it.', level='WARNING')
+        self._event('skipped', env_name, planned.get('name'), reason='no longer exists')
+
+    def _apply_plan(self):
+        '''Redeploy the outdated stacks the applied plan recorded for this instance.'''
+        for environment in self._planned_environments():
+            self._check_deadline()
+            try:
+                yield from self._apply_environment(environment)
+            except CircuitOpenError:
+                raise
+            except PortainerError as e:
+                self._log_error(e, environment.get('name'))
+                continue
+
+    def _apply_environment(self, environment: dict):
+        '''Redeploy the planned stacks of an environment that did not change since the plan, then clean up its images.'''
+        env_id, env_name = environment.get('id'), environment.get('name')
+
+        with self._phase('discovery'):
+            stacks = []
+            for planned in environment.get('outdated'):
+                try:
+                    stack = yield FlowStep.call('get_stack', planned.get('id'))
+                except StackNotFoundError:
+                    self._deleted_since_plan(env_name, planned)
+                    continue
+                if not self._changed_since_plan(env_name, planned, stack):
+                    stacks.append(stack)
+
+        any_stack_updated = yield from self._redeploy_stacks(env_id, env_name, stacks)
+
+        if self.delete_unused_images_flag and (any_stack_updated or self.image_cleanup.always):
+            with self._phase('image cleanup'):
+                yield from self._clean_images(env_id, env_name)
+
+        self.logger.log(f'Finished processing environment [{env_name}] in Portainer instance [{self.name}]({self.host}).')
+
+    def _redeploy_stacks(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Redeploy the outdated stacks, each one holding its slot until its containers are up. Returns True if any was updated.'''
+        if not stacks:
+            return False
+
+        with self._phase('redeploy'):
+            updated = []
+            chains = self.redeploy_scheduler.plan(stacks)
+            # A chain holds its slot until it is finished, the first unexpected error drops the chains not started yet
+            yield FlowStep.gather([self._redeploy_chain(env_id, env_name, chain, updated) for chain in chains],
+                                  self.redeploy_scheduler.concurrency, return_exceptions=False)
+            return bool(updated)
+
+    def _process_environment(self, env: dict):
+        '''Check and update the stacks of a single environment.'''
+        name, host = self.name, self.host
+        env_name = env.get('Name')
+        env_id = env.get('Id')
+        outdated_stacks = []
+
+        # Get environment stacks
+        with self._phase('discovery'):
+            stacks = yield from self._get_environment_stacks(env)
+        self.logger.log(f'Retrieved {len(stacks)} stacks for environment [{env_name}] in Portainer instance [{name}]({host}).')
+
+        # Drop ignored stacks before sending any refresh
+        stacks = self._select_stacks(env_id, env_name, stacks)
+
+        # Git stacks whose reference moved since their last deploy are outdated whatever their images
+        if self.git_resolver:
+            with self._phase('refresh'):
+                outdated_stacks, stacks = yield from self._check_git_commits(env_id, env_name, stacks)
+
+        # Skip the stacks already confirmed current within the cache TTL
+        stacks = self._skip_cached_stacks(env_id, env_name, stacks)
+
+        if stacks:
+            with self._phase('refresh'):
+                # Compare Compose stacks with their registries, Portainer only refreshes the ones left unknown
+                digest_outdated, stacks = yield from self._check_digests(env_id, env_name, stacks)
+                outdated_stacks += digest_outdated
+
+                if stacks:
+                    # Clear images status
+                    yield FlowStep.call('clear_images_status', env_id)
+                    self.logger.log(f'Cleared images status for environment [{env_name}] in Portainer instance [{name}]({host}).')
+
+                    self._check_deadline()
+                    outdated_stacks += yield from self._refresh_stacks(env_id, env_name, stacks)
+
+        if self.plan:
+            # Plans stop before any change, recording what a run would do
+            images = (yield FlowStep.collect('iter_images_with_usage', env_id)) if self._plans_cleanup(outdated_stacks) else []
+            self._plan_environment(env_id, env_name, outdated_stacks, images)
+            return
+
+        any_stack_updated = yield from self._redeploy_stacks(env_id, env_name, outdated_stacks)
+
+        # Check if unused images should be deleted
+        if self.delete_unused_images_flag and (any_stack_updated or self.image_cleanup.always):
+            with self._phase('image cleanup'):
+                yield from self._clean_images(env_id, env_name)
+
+        self.logger.log(f'Finished processing environment [{env_name}] in Portainer instance [{name}]({host}).')
+
+    def _clean_images(self, env_id: int, env_name: str):
+        '''Delete the unused images of an environment, with one prune call or parallel deletes of the selected images.'''
+        cleanup = self.image_cleanup
+        self.logger.log(f'Deleting unused images in environment [{env_name}] of Portainer instance [{self.name}]({self.host}).')
+
+        if cleanup.uses_prune:
+            result = yield FlowStep.call('prune_images', env_id)
+            self._log_cleanup_summary(env_name, len(result.get('ImagesDeleted') or []), result.get('SpaceReclaimed', 0))
+            return
+
+        images = self._select_images(env_name, (yield FlowStep.collect('iter_images_with_usage', env_id)))
+        if not images:
+            return
+
+        results = yield FlowStep.gather([FlowStep.call('delete_image', env_id, image.get('id')) for image in images], cleanup.concurrency)
+        self._log_deletions(env_name, list(self._outcomes(images, results)))
+
+    def _select_images(self, env_name: str, images: list[dict]):
+        '''Pick the images to delete, logging what a dry run would reclaim. Returns an empty list when nothing is deleted.'''
+        name, host = self.name, self.host
+        selected = self.image_cleanup.select(images)
+
+        if not selected:
+            self.logger.log(f'No unused images found in environment [{env_name}] of Portainer instance [{name}]({host}).')
+            return []
+
+        if self.image_cleanup.dry_run:
+            for image in selected:
+                self.logger.log(f'Would delete unused image {self._image_label(image)} ({format_size(image.get("size", 0))}) in environment [{env_name}] of Portainer instance [{name}]({host}).')
+            reclaimable = sum(image.get('size', 0) for image in selected)
+            self.logger.log(f'Dry run: {len(selected)} unused images would reclaim up to {format_size(reclaimable)} in environment [{env_name}] of Portainer instance [{name}]({host}).')
+            return []
+
+        return selected
+
+    def _log_deletions(self, env_name: str, outcomes: list[tuple]):
+        '''Log the result of each image deletion and the space reclaimed.'''
+        name, host = self.name, self.host
+        deleted = 0
+        reclaimed = 0
+
+        for image, result in outcomes:
+            if isinstance(result, PortainerError):
+                # An image still referenced by another image cannot be deleted, the others are still deleted
+                self.logger.log(result, level='WARNING')
+                continue
+
+            deleted += 1
+            reclaimed += image.get('size', 0)
+            self.logger.log(f'Deleted unused image {self._image_label(image)} in environment [{env_name}] of Portainer instance [{name}]({host}).')
+
+        self._log_cleanup_summary(env_name, deleted, reclaimed)
+
+    def _log_cleanup_summary(self, env_name: str, deleted: int, reclaimed: int):
+        self._event('images_deleted', env_name, count=deleted, size=reclaimed)
+        self.logger.log(f'Deleted {deleted} unused images, reclaiming up to {format_size(reclaimed)} in environment [{env_name}] of Portainer instance [{self.name}]({self.host}).')
+
+    @staticmethod
+    def _image_label(image: dict):
+        tags = image.get('tags') or []
+        return tags[0] if tags else image.get('id')
+
+    def _get_environments(self):
+        '''Get the environments, reusing the last discovery while it is younger than discovery_ttl.'''
+        if self.environments is None or time.monotonic() - self.environments_at >= self.discovery_ttl:
+            self.environments = yield FlowStep.collect('iter_environments')
+            self.environments_at = time.monotonic()
+            self.stacks = {}
+        return self.environments
+
+    def _get_environment_stacks(self, env: dict):
+        '''Get the stacks of an environment, reusing a warm or cached listing when it is still valid.'''
+        env_id = env.get('Id')
+        fetched_at, stacks = self.stacks.get(env_id, (0, None))
+        if stacks is not None and time.monotonic() - fetched_at < self.discovery_ttl:
+            return stacks
+
+        stacks = self._get_cached_listing(env)
+        if stacks is None:
+            stacks = yield FlowStep.collect('iter_environment_stacks', env_id)
+            self._cache_listing(env, stacks)
+
+        self.stacks[env_id] = (time.monotonic(), stacks)
+        return stacks
+
+    def _is_online(self, env: dict):
+        '''Check the environment status so no call is sent to one that is down.'''
+        # Portainer reports 1 for up and 2 for down
+        if env.get('Status', 1) == 1:
+            return True
+
+        if self.plan:
+            self.plan.add_environment(self.name, self.host, env.get('Id'), env.get('Name'), skipped='offline')
+        self.logger.log(f'Skipping environment [{env.get("Name")}] in Portainer instance [{self.name}]({self.host}) because it is offline.', level='WARNING')
+        self._event('offline', env.get('Name'))
+        return False
+
+    def _get_cached_listing(self, env: dict):
+        '''Return the stack listing stored for the environment within the discovery cache TTL, if any.'''
+        if not self.discovery_cache:
+            return None
+
+        stacks = self.discovery_cache.get_stacks(self.host, env.get('Id'))
+        if stacks is not None:
+            self.logger.log(f'Reusing the cached stack listing of environment [{env.get("Name")}] in Portainer instance [{self.name}]({self.host}).')
+        return stacks
+
+    def _cache_listing(self, env: dict, stacks: list[dict]):
+        '''Store the stack listing of the environment for the next runs.'''
+        if self.discovery_cache:
+            self.discovery_cache.set_stacks(self.host, env.get('Id'), stacks)
+
+    def _listings_may_be_stale(self):
+        '''Warm and cached listings can be outdated or stripped, the stack must be fetched before a redeploy.'''
+        return bool(self.discovery_ttl or self.discovery_cache)
+
+    def _select_stacks(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Filter out the stacks that are ignored, not included or managed by Git when Git updates are disabled.'''
+        name, host = self.name, self.host
+        included = self.settings.included_stacks(env_name)
+        selected = []
+
+        for stack in stacks:
+            stack_name = stack.get('Name')
+
+            # Check if the stack is ignored or left out by the include rules of the environment
+            reason = self.settings.skip_reason(stack_name, included)
+            if reason == 'ignored':
+                self.logger.log(f'Ignoring stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}).')
+            elif reason:
+                self.logger.log(f'Skipping stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) '
+                                f'because it is not included.')
+            if reason:
+                self._skip_stack(env_id, env_name, stack, reason)
+                continue
+
+            # Check if the stack is from git integration and if it needs to be updated
+            if stack.get('GitConfig') and not self.update_stacks_with_git:
+                self.logger.log(f'Skipping stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) due to Git integration.')
+                self._skip_stack(env_id, env_name, stack, 'git integration disabled')
+                continue
+
+            selected.append(stack)
+
+        return selected
+
+    def _skip_cached_stacks(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Return the stacks that still need a refresh, skipping the ones the cache confirms current.'''
+        if not self.cache:
+            return stacks
+
+        name, host = self.name, self.host
+        remaining = []
+
+        for stack in stacks:
+            if self.cache.is_current(host, env_id, stack):
+                self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{name}]({host}) is updated (cached).')
+                self._skip_stack(env_id, env_name, stack, 'up to date (cached)', action='current')
+                continue
+            remaining.append(stack)
+
+        return remaining
+
+    def _mark_current(self, env_id: int, stack: dict):
+        '''Remember that the stack images are up to date.'''
+        if self.cache:
+            self.cache.mark_current(self.host, env_id, stack)
+
+    def _git_candidates(self, env_name: str, stacks: list[dict]):
+        '''Git stacks that record the commit they were deployed from, and whose credentials are known if they need any.'''
+        candidates = []
+        for stack in stacks:
+            git_config = stack.get('GitConfig') or {}
+            if not git_config.get('ConfigHash'):
+                continue
+            # Credentials are not written to the discovery cache, a lookup without them would fail
+            if git_config.get('Authenticated') and not git_config.get('Authentication'):
+                self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                                f'comes from the cached listing without its Git credentials, its images are checked instead.')
+                continue
+            candidates.append(stack)
+        return candidates
+
+    def _apply_git_commits(self, env_name: str, stacks: list[dict], commits: dict):
+        '''Split the stacks into the ones whose reference moved to a new commit and the ones left for the image checks.'''
+        moved = []
+        remaining = []
+
+        for stack in stacks:
+            commit = commits.get(stack.get('Id'))
+            if not commit:
+                remaining.append(stack)
+                continue
+
+            git_config = stack.get('GitConfig')
+            self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                            f'has new commits on {git_config.get("ReferenceName") or "HEAD"}: {git_config.get("ConfigHash")[:7]} -> {commit[:7]}.')
+            moved.append(stack)
+
+        return moved, remaining
+
+    def _new_commit(self, stack: dict):
+        '''The commit the reference of a Git stack moved to since its deploy, None if it did not move or cannot be resolved.'''
+        commit = yield FlowStep.blocking(self.git_resolver.resolve, stack.get('GitConfig'))
+        if not commit or commit == stack.get('GitConfig').get('ConfigHash'):
+            return None
+
+        # A warm or cached listing may predate the last redeploy of the stack
+        if self._listings_may_be_stale():
+            current = yield FlowStep.call('get_stack', stack.get('Id'))
+            if (current.get('GitConfig') or {}).get('ConfigHash') == commit:
+                return None
+        return commit
+
+    def _check_git_commits(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Compare the Git stacks with their remote reference, returning the ones with new commits and the other stacks.'''
+        candidates = self._git_candidates(env_name, stacks)
+        if not candidates:
+            return [], stacks
+
+        # Stacks sharing a repository and reference wait for a single lookup
+        results = yield FlowStep.gather([self._new_commit(stack) for stack in candidates], self.refresh_concurrency)
+
+        commits = {}
+        for stack, result in self._outcomes(candidates, results):
+            if isinstance(result, PortainerError):
+                self.logger.log(result, level='WARNING')
+                continue
+            commits[stack.get('Id')] = result
+
+        return self._apply_git_commits(env_name, stacks, commits)
+
+    def _digest_candidates(self, stacks: list[dict]):
+        '''Stacks whose images can be compared with their registries, Compose stacks running on the environment node.'''
+        if not self.digest_resolver:
+            return []
+        return [stack for stack in stacks if stack.get('Type') == COMPOSE_STACK_TYPE]
+
+    def _apply_digest_statuses(self, env_id: int, env_name: str, stacks: list[dict], statuses: dict):
+        '''Split the stacks by registry status, returning the outdated ones and the ones Portainer still has to refresh.'''
+        name, host = self.name, self.host
+        outdated = []
+        remaining = []
+
+        for stack in stacks:
+            status = statuses.get(stack.get('Id'))
+            if status == 'outdated':
+                outdated.append(stack)
+            elif status == 'updated':
+                self._mark_current(env_id, stack)
+                self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{name}]({host}) is updated (registry).')
+                self._skip_stack(env_id, env_name, stack, 'up to date (registry)', action='current')
+            else:
+                remaining.append(stack)
+
+        return outdated, remaining
+
+    def _check_digests(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Check the Compose stacks against their registries, returning the outdated stacks and the ones left for Portainer.'''
+        candidates = self._digest_candidates(stacks)
+        if not candidates:
+            return [], stacks
+
+        try:
+            containers, images = yield FlowStep.gather([FlowStep.call('get_compose_containers', env_id), FlowStep.call('get_docker_images', env_id)],
+                                                       2, return_exceptions=False)
+        except CircuitOpenError:
+            raise
+        except PortainerError as e:
+            self.logger.log(e, level='WARNING')
+            return [], stacks
+
+        running = self.digest_resolver.running_digests(containers, images)
+        results = yield FlowStep.gather([self._digest_status(stack, running) for stack in candidates], self.refresh_concurrency)
+
+        statuses = {}
+        for stack, result in self._outcomes(candidates, results):
+            if isinstance(result, PortainerError):
+                self.logger.log(result, level='WARNING')
+                continue
+            statuses[stack.get('Id')] = result
+
+        return self._apply_digest_statuses(env_id, env_name, stacks, statuses)
+
+    def _digest_status(self, stack: dict, running: dict):
+        '''Compare the images of a Compose stack with their registries.'''
+        stack_file_content = yield FlowStep.call('get_stack_file_content', stack.get('Id'))
+        # Registry lookups are shared with the other instances of the run and stay on the pooled requests session
+        return (yield FlowStep.blocking(self.digest_resolver.stack_status, stack.get('Name'), stack_file_content, stack.get('Env'), running))
+
+    def _refresh_stacks(self, env_id: int, env_name: str, stacks: list[dict]):
+        '''Refresh the images status of the stacks concurrently and return the outdated ones.'''
+        name, host = self.name, self.host
+        outdated = []
+
+        results = yield FlowStep.gather([FlowStep.call('refresh_stack_images', stack.get('Id')) for stack in stacks], self.refresh_concurrency)
+
+        # Read the results in listing order so the log lines stay stable
+        for stack, result in self._outcomes(stacks, results):
+            stack_name = stack.get('Name')
+            if isinstance(result, PortainerError):
+                self.logger.log(result, level='ERROR')
+                self._skip_stack(env_id, env_name, stack, str(result), action='failed')
+                continue
+
+            status = result.lower()
+
+            if status == 'updated':
+                self._mark_current(env_id, stack)
+
+            if status != 'outdated':
+                self.logger.log(f'Stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) is {status}.')
+                if status == 'updated':
+                    self._skip_stack(env_id, env_name, stack, 'up to date', action='current')
+                else:
+                    self._skip_stack(env_id, env_name, stack, f'image status {status}')
+                continue
+
+            outdated.append(stack)
+
+        return outdated
+
+    def _redeploy_chain(self, env_id: int, env_name: str, chain: list[dict], updated: list[dict]):
+        '''Redeploy the stacks of a chain in order, stopping at the first one that fails or does not come up.'''
+        for position, stack in enumerate(chain):
+            self._check_deadline()
+            started = time.monotonic()
+            try:
+                if (yield from self._update_stack(env_id, env_name, stack)):
+                    updated.append(stack)
+                    healthy = yield from self._wait_until_healthy(env_id, env_name, stack)
+                    self._event('updated', env_name, stack.get('Name'), duration=time.monotonic() - started)
+                    if healthy:
+                        continue
+            except CircuitOpenError:
+                raise
+            except PortainerError as e:
+                self.logger.log(e, level='ERROR')
+                self._event('failed', env_name, stack.get('Name'), error=str(e))
+
+            self._skip_rest_of_chain(env_name, stack, chain[position + 1:])
+            return
+
+    def _skip_rest_of_chain(self, env_name: str, failed_stack: dict, remaining: list[dict]):
+        '''Log the stacks of a group left outdated because an earlier stack of the group failed.'''
+        for stack in remaining:
+            self.logger.log(f'Skipping stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                            f'because stack [{failed_stack.get("Name")}] of its group was not updated.', level='WARNING')
+            self._event('skipped', env_name, stack.get('Name'), reason='group member not updated')
+
+    def _health_result(self, env_name: str, stack: dict, ready: bool, reason: str, timed_out: bool):
+        '''Log the outcome of a health check poll. Returns True once the poll is over.'''
+        if ready:
+            self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) is up.')
+            return True
+        if timed_out:
+            self.logger.log(f'Stack [{stack.get("Name")}] in environment [{env_name}] of Portainer instance [{self.name}]({self.host}) '
+                            f'did not come up within {self.redeploy_scheduler.health_timeout} seconds: {reason}.', level='WARNING')
+            return True
+        return False
+
+    def _wait_until_healthy(self, env_id: int, env_name: str, stack: dict):
+        '''Poll the containers of a redeployed stack until they are running or healthy. Returns False if they never are.'''
+        scheduler = self.redeploy_scheduler
+        if not scheduler.gates_health(stack):
+            return True
+
+        give_up_at = time.monotonic() + scheduler.health_timeout
+        while True:
+            ready, reason = scheduler.containers_ready((yield FlowStep.call('get_stack_containers', env_id, stack.get('Name'))))
+            if self._health_result(env_name, stack, ready, reason, time.monotonic() + scheduler.health_interval > give_up_at):
+                return ready
+            self._check_deadline()
+            yield FlowStep.sleep(scheduler.health_interval)
+
+    def _git_redeploy_arguments(self, stack: dict):
+        '''Build the repository arguments used to redeploy a stack with Git integration.'''
+        git_config = stack.get('GitConfig') or {}
+        git_authentication = git_config.get('Authentication') or {}
+        repository_git_credential_id = git_authentication.get('GitCredentialID')
+        repository_password = git_authentication.get('Password')
+        repository_username = git_authentication.get('Username')
+
+        return {
+            'repository_authentication': bool((repository_username and repository_password) or repository_git_credential_id),
+            'repository_git_credential_id': repository_git_credential_id,
+            'repository_password': repository_password,
+            'repository_reference_name': git_config.get('ReferenceName'),
+            'repository_username': repository_username
+        }
+
+    def _update_stack(self, env_id: int, env_name: str, stack: dict):
+        '''Redeploy an outdated stack. Returns True if the stack was updated.'''
+        name, host = self.name, self.host
+        stack_name = stack.get('Name')
+        stack_id = stack.get('Id')
+
+        # A warm or cached listing may be stale, redeploy with the current stack configuration
+        if self._listings_may_be_stale():
+            stack = yield FlowStep.call('get_stack', stack_id)
+
+        if stack.get('GitConfig'):
+            self.logger.log(f'Updating stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) with Git integration.')
+            result = yield FlowStep.call(
+                'update_stack_with_git',
+                stack_id=stack_id,
+                environment_id=env_id,
+                env=stack.get('Env', []),
+                prune=self.prune_services,
+                **self._git_redeploy_arguments(stack) )
+        else:
+            self.logger.log(f'Updating stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}).')
+            webhook = stack.get('Webhook', '')
+            stack_file_content = yield FlowStep.call('get_stack_file_content', stack_id)
+            if not stack_file_content:
+                self.logger.log(f'Stack file content for stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host})is empty.', level='ERROR')
+                self._event('failed', env_name, stack_name, error='empty stack file')
+                return False
+            env_vars = stack.get('Env', [])
+
+            result = yield FlowStep.call(
+                'update_stack',
+                stack_id=stack_id,
+                environment_id=env_id,
+                env=env_vars,
+                stack_file_content=stack_file_content,
+                prune=self.prune_services,
+                webhook=webhook )
+
+        # The redeploy pulled the latest images, so the stack is current at its new version
+        self._mark_current(env_id, {**stack, **result} if isinstance(result, dict) else stack)
+
+        self.logger.log(f'Stack [{stack_name}] updated successfully in environment [{env_name}] of Portainer instance [{name}]({host}).')
+        return True
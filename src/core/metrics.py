@@ -0,0 +1,264 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from logs.event_collector import EventCollector
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# Requests recorded under this prefix went to an image registry and not to a Portainer instance
+REGISTRY_PREFIX = 'registry:'
+
+def endpoint_label(method: str, path: str):
+    '''Turn a request path into a low-cardinality label, replacing ids with placeholders.'''
+    path = path.split('?', 1)[0]
+    path = re.sub(r'/sha256:[0-9a-f]+', '/{id}', path)
+    path = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+    return f'{method} {path or "/"}'
+
+class Metrics:
+    '''Collect request latencies, retries, transferred bytes and phase timings for a run.'''
+
+    def __init__(self, config_fingerprint: str = None, shard: str = None, events: 'EventCollector' = None):
+        self.lock = threading.Lock()
+        self.config_fingerprint = config_fingerprint
+        self.shard = shard
+        self.events = events
+        self.started_at = time.time()
+        self.requests = {}
+        self.phases = {}
+
+    def observe_request(self, instance: str, endpoint: str, seconds: float, bytes_sent: int = 0, bytes_received: int = 0,
+                        retries: int = 0, error: bool = False):
+        '''Record a finished request to a Portainer endpoint.'''
+        with self.lock:
+            stats = self.requests.setdefault((instance, endpoint), {
+                'count': 0, 'errors': 0, 'retries': 0, 'bytes_sent': 0, 'bytes_received': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0, 'buckets': [0] * len(BUCKETS)
+            })
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['retries'] += retries
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][index] += 1
+                    break
+
+    @contextmanager
+    def phase(self, instance: str, name: str):
+        '''Time a phase of the run (discovery, refresh, redeploy, image cleanup) for an instance.'''
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.phases[(instance, name)] = self.phases.get((instance, name), 0.0) + elapsed
+
+    def report(self):
+        '''Build the machine-readable run report.'''
+        with self.lock:
+            phases = {}
+            for (instance, name), seconds in sorted(self.phases.items()):
+                phases.setdefault(instance, {})[name] = round(seconds, 3)
+
+            requests = []
+            for (instance, endpoint), stats in sorted(self.requests.items()):
+                requests.append({
+                    'instance': instance,
+                    'endpoint': endpoint,
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes_sent': stats['bytes_sent'],
+                    'bytes_received': stats['bytes_received'],
+                    'total_seconds': round(stats['total_seconds'], 3),
+                    'average_seconds': round(stats['total_seconds'] / stats['count'], 3),
+                    'max_seconds': round(stats['max_seconds'], 3),
+                    'histogram': {str(bound): count for bound, count in zip(BUCKETS, stats['buckets'])}
+                })
+
+        events = self.events.report() if self.events else {'outcomes': {}, 'failures': []}
+        return {
+            'started_at': self.started_at,
+            'config_fingerprint': self.config_fingerprint,
+            'shard': self.shard,
+            'duration_seconds': round(time.time() - self.started_at, 3),
+            'outcomes': events['outcomes'],
+            'failures': events['failures'],
+            'phases': phases,
+            'requests': requests
+        }
+
+    def write_report(self, path: str):
+        '''Write the run report as JSON.'''
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def prometheus(self):
+        '''Render the collected metrics in the Prometheus text format.'''
+        prefix = 'portainer_stack_update'
+        lines = []
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+            phases = sorted(self.phases.items())
+
+        lines.append(f'# TYPE {prefix}_request_duration_seconds histogram')
+        for (instance, endpoint), stats in requests:
+            labels = f'instance="{_escape(instance)}",endpoint="{_escape(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, stats['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {stats["total_seconds"]}')
+            lines.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {stats["count"]}')
+
+        for name in ('errors', 'retries', 'bytes_sent', 'bytes_received'):
+            lines.append(f'# TYPE {prefix}_request_{name}_total counter')
+            for (instance, endpoint), stats in requests:
+                lines.append(f'{prefix}_request_{name}_total{{instance="{_escape(instance)}",endpoint="{_escape(endpoint)}"}} {stats[name]}')
+
+        lines.append(f'# TYPE {prefix}_phase_seconds_total counter')
+        for (instance, name), seconds in phases:
+            lines.append(f'{prefix}_phase_seconds_total{{instance="{_escape(instance)}",phase="{_escape(name)}"}} {seconds}')
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, address: str = '0.0.0.0'):
+        '''Expose the metrics on /metrics from a background thread.'''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+def merge_reports(reports: list[dict]):
+    '''Combine the run reports of the shards of a fleet into a single report, keeping a line per shard.'''
+    started_at = min(report['started_at'] for report in reports)
+    ended_at = max(report['started_at'] + report['duration_seconds'] for report in reports)
+    fingerprints = {report.get('config_fingerprint') for report in reports}
+
+    phases = {}
+    for report in reports:
+        for instance, instance_phases in report['phases'].items():
+            merged = phases.setdefault(instance, {})
+            for name, seconds in instance_phases.items():
+                merged[name] = round(merged.get(name, 0.0) + seconds, 3)
+
+    outcomes = {}
+    for report in reports:
+        for action, count in report.get('outcomes', {}).items():
+            outcomes[action] = outcomes.get(action, 0) + count
+
+    return {
+        'started_at': started_at,
+        'config_fingerprint': fingerprints.pop() if len(fingerprints) == 1 else None,
+        'shard': None,
+        'duration_seconds': round(ended_at - started_at, 3),
+        'outcomes': dict(sorted(outcomes.items())),
+        'failures': [failure for report in reports for failure in report.get('failures', [])],
+        'phases': phases,
+        'requests': sorted((request for report in reports for request in report['requests']),
+                           key=lambda request: (request['instance'], request['endpoint'])),
+        'shards': [
+            {
+                'shard': report.get('shard'),
+                'config_fingerprint': report.get('config_fingerprint'),
+                'duration_seconds': report['duration_seconds'],
+                'instances': len(_report_instances(report)),
+                'requests': sum(request['count'] for request in _portainer_requests(report)),
+                'errors': sum(request['errors'] for request in _portainer_requests(report)),
+                'registry_requests': sum(request['count'] for request in report['requests'] if _is_registry(request))
+            }
+            for report in reports
+        ]
+    }
+
+def summarize_report(report: dict):
+    '''Render a run report as a short notification: totals, shards, failing and slowest instances.'''
+    requests = _portainer_requests(report)
+    errors_by_instance = {}
+    for request in requests:
+        if request['errors']:
+            errors_by_instance[request['instance']] = errors_by_instance.get(request['instance'], 0) + request['errors']
+
+    lines = [
+        f'Run finished in {report["duration_seconds"]:.1f}s: {len(_report_instances(report))} instances, '
+        f'{sum(request["count"] for request in requests)} Portainer requests, {sum(errors_by_instance.values())} failed, '
+        f'{sum(request["retries"] for request in requests)} retried.'
+    ]
+
+    registry_requests = [request for request in report['requests'] if _is_registry(request)]
+    if registry_requests:
+        registries = {request['instance'][len(REGISTRY_PREFIX):] for request in registry_requests}
+        lines.append(f'Registries: {sum(request["count"] for request in registry_requests)} requests to {len(registries)} registries, '
+                     f'{sum(request["errors"] for request in registry_requests)} failed.')
+
+    outcomes = report.get('outcomes') or {}
+    if outcomes:
+        lines.append(f'Outcomes: {outcomes.get("updated", 0)} stacks updated, {outcomes.get("current", 0)} up to date, '
+                     f'{outcomes.get("skipped", 0)} skipped, {outcomes.get("failed", 0)} failed.')
+    failures = report.get('failures') or []
+    if failures:
+        lines.append('Failures: ' + '; '.join(
+            ' '.join(f'[{failure[key]}]' for key in ('instance', 'environment', 'stack') if failure.get(key)) + f': {failure["error"]}'
+            for failure in failures[:5]
+        ) + (f'; and {len(failures) - 5} more.' if len(failures) > 5 else '.'))
+
+    shards = report.get('shards') or []
+    if shards:
+        slowest = max(shards, key=lambda shard: shard['duration_seconds'])
+        lines.append(f'{len(shards)} shards, the slowest ({slowest["shard"]}) took {slowest["duration_seconds"]:.1f}s.')
+        if len({shard['config_fingerprint'] for shard in shards}) > 1:
+            lines.append('The shards did not run with the same configuration.')
+
+    if errors_by_instance:
+        failing = sorted(errors_by_instance.items(), key=lambda item: item[1], reverse=True)[:5]
+        lines.append('Failed requests: ' + ', '.join(f'{instance} ({count})' for instance, count in failing) + '.')
+
+    durations = {instance: sum(phases.values()) for instance, phases in report['phases'].items()}
+    if durations:
+        slowest_instances = sorted(durations.items(), key=lambda item: item[1], reverse=True)[:3]
+        lines.append('Slowest instances: ' + ', '.join(f'{instance} {seconds:.1f}s' for instance, seconds in slowest_instances) + '.')
+
+    return '\n'.join(lines)
+
+def _is_registry(request: dict):
+    return request['instance'].startswith(REGISTRY_PREFIX)
+
+def _portainer_requests(report: dict):
+    return [request for request in report['requests'] if not _is_registry(request)]
+
+def _report_instances(report: dict):
+    return set(report['phases']) | {request['instance'] for request in _portainer_requests(report)}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
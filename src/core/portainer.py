@@ -1,13 +1,41 @@
+import json
 import requests
 import urllib3
+import time
+from requests.adapters import HTTPAdapter
+from core.circuit_breaker import CircuitBreaker
+from core.metrics import Metrics, endpoint_label
+from core.request_policy import RequestPolicy
+from errors.instance_timeout_error import InstanceTimeoutError
 from errors.portainer_error import PortainerError
+from errors.stack_not_found_error import StackNotFoundError
+from utils.json_stream import iter_json_array
+
+# Fields of the list endpoints the update loop uses, everything else is dropped while streaming
+ENVIRONMENT_FIELDS = ('Id', 'Name', 'Type', 'URL', 'PublicURL', 'GroupId', 'TagIds', 'Status')
+STACK_FIELDS = ('Id', 'Name', 'EndpointId', 'Type', 'Status', 'CreationDate', 'UpdateDate', 'Env', 'GitConfig', 'Webhook')
+IMAGE_FIELDS = ('id', 'tags', 'used', 'size', 'created')
+
+# Bytes read from the socket at a time when streaming a list
+STREAM_CHUNK_SIZE = 64 * 1024
 
 class Portainer:
-    def __init__(self, url: str, access_token: str, verify_ssl: bool = False):
+    def __init__(self, url: str, access_token: str, verify_ssl: bool = False, pool_size: int = 10,
+                 metrics: Metrics = None, instance_name: str = None, policy: RequestPolicy = None):
         self.url = url
+        self.metrics = metrics
+        self.instance_name = instance_name or url
+        self.policy = policy or RequestPolicy()
+        self.breaker = CircuitBreaker(self.instance_name, self.policy.failure_threshold, self.policy.reset_timeout)
+
+        # Monotonic time at which the current run of the instance must stop, set by the updater
+        self.deadline = None
 
-        # Initialize the session
+        # Initialize the session, with enough pooled connections for concurrent calls and retries of idempotent calls
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, pool_size), max_retries=self.policy.urllib3_retry(budget=self.remaining))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({'X-API-Key': access_token})
         self.session.headers.update({'Content-Type': 'application/json'})
 
@@ -17,10 +45,88 @@ class Portainer:
         # Suppress the InsecureRequestWarning
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+    def remaining(self):
+        '''Seconds left before the deadline of the current run, None without a deadline.'''
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def _timeout(self, redeploy: bool = False):
+        '''Timeouts of a request, which cannot outlast the time budget of the run.'''
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise InstanceTimeoutError(f'Portainer instance {self.instance_name} exceeded its time budget, not sending any more requests.')
+        return self.policy.timeout(redeploy=redeploy, remaining=remaining)
+
+    def _send(self, method: str, url: str, redeploy: bool = False, **kwargs):
+        '''Send a request through the session with the instance timeouts and circuit breaker, recording its metrics.
+
+        urllib3 retries the request inside the session, the circuit breaker records its final outcome once.
+        '''
+        kwargs['timeout'] = self._timeout(redeploy)
+        self.breaker.before_call()
+
+        endpoint = endpoint_label(method, url[len(self.url):])
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            if self.metrics:
+                self.metrics.observe_request(self.instance_name, endpoint, time.monotonic() - started, error=True)
+            raise
+
+        self.breaker.record_status(response.status_code)
+
+        # Streamed bodies are observed by their reader once consumed
+        if not kwargs.get('stream'):
+            self._observe(endpoint, started, response, len(response.content), error=not response.ok)
+        return response
+
+    def _observe(self, endpoint: str, started: float, response: requests.Response, received: int, error: bool):
+        '''Record the metrics of a request that got an answer.'''
+        if not self.metrics:
+            return
+
+        request_body = response.request.body or b''
+        retries = getattr(response.raw, 'retries', None)
+        self.metrics.observe_request(
+            self.instance_name, endpoint, time.monotonic() - started,
+            bytes_sent=len(request_body),
+            bytes_received=received,
+            retries=len(retries.history) if retries else 0,
+            error=error)
+
+    def _iter_list(self, url: str, error_message: str, fields: tuple, **kwargs):
+        '''Stream a JSON array response, yielding its items one by one with only the given fields.
+
+        Chunked responses have no Content-Length, the metrics count the bytes actually read.
+        '''
+        started = time.monotonic()
+        received = 0
+        failed = True
+
+        def chunks(response: requests.Response):
+            nonlocal received
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                received += len(chunk)
+                yield chunk
+
+        try:
+            with self._send('GET', url, stream=True, **kwargs) as response:
+                try:
+                    response.raise_for_status()
+                    yield from iter_json_array(chunks(response), fields)
+                    failed = False
+                finally:
+                    self._observe(endpoint_label('GET', url[len(self.url):]), started, response, received, error=failed)
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'{error_message}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
     def ping(self):
         '''Ping the Portainer instance to check if it's reachable.'''
         try:
-            response = self.session.get(self.url)
+            response = self._send('GET', self.url)
 
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
@@ -29,7 +135,7 @@ class Portainer:
     def check_if_portainer_needs_update(self):
         '''Check if the Portainer instance needs an update.'''
         try:
-            response = self.session.get(f'{self.url}/api/system/version')
+            response = self._send('GET', f'{self.url}/api/system/version')
         
             response.raise_for_status()
             
@@ -42,7 +148,7 @@ class Portainer:
     def update_portainer_version(self):
         '''Update the Portainer instance to the last version.'''
         try:
-            response = self.session.post(f'{self.url}/api/system/update')
+            response = self._send('POST', f'{self.url}/api/system/update', redeploy=True)
 
             response.raise_for_status()
 
@@ -52,10 +158,24 @@ class Portainer:
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
         
-    def get_environments(self):
-        '''Get the list of environments from Portainer.'''
+    def probe_version(self):
+        '''Return the version a restarting instance reports on /api/system/status, or None while it does not answer.
+
+        A single attempt without the session retries or the circuit breaker, the caller polls with its own backoff.
+        '''
         try:
-            response = self.session.get(f'{self.url}/api/endpoints')
+            response = requests.get(f'{self.url}/api/system/status', headers=self.session.headers, verify=self.session.verify,
+                                    timeout=self._timeout())
+            if not response.ok:
+                return None
+            return response.json().get('Version') or None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def get_environments(self, exclude_snapshots: bool = True):
+        '''Get the list of environments from Portainer, without the heavy Docker snapshots by default.'''
+        try:
+            response = self._send('GET', f'{self.url}/api/endpoints', params={'excludeSnapshots': 'true'} if exclude_snapshots else None)
 
             response.raise_for_status()
 
@@ -65,10 +185,14 @@ class Portainer:
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
         
+    def iter_environments(self, fields: tuple = ENVIRONMENT_FIELDS):
+        '''Stream the environments without their Docker snapshots, keeping only the given fields.'''
+        return self._iter_list(f'{self.url}/api/endpoints', 'Failed to get environments', fields, params={'excludeSnapshots': 'true'})
+
     def get_environment_stacks(self, environment_id: int):
         '''Get the stacks for a specific environment.'''
         try:
-            response = self.session.get(f'{self.url}/api/stacks?filters={{\"EndpointID\": {environment_id},\"IncludeOrphanedStacks\": false}}')
+            response = self._send('GET', f'{self.url}/api/stacks?filters={{\"EndpointID\": {environment_id},\"IncludeOrphanedStacks\": false}}')
 
             response.raise_for_status()
 
@@ -78,10 +202,30 @@ class Portainer:
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
         
+    def iter_environment_stacks(self, environment_id: int, fields: tuple = STACK_FIELDS):
+        '''Stream the stacks of a specific environment, keeping only the given fields.'''
+        filters = json.dumps({'EndpointID': environment_id, 'IncludeOrphanedStacks': False})
+        return self._iter_list(f'{self.url}/api/stacks', f'Failed to get stacks for environment {environment_id}', fields, params={'filters': filters})
+
+    def get_stack(self, stack_id: int):
+        '''Get a single stack with its current configuration.'''
+        try:
+            response = self._send('GET', f'{self.url}/api/stacks/{stack_id}')
+            if response.status_code == 404:
+                raise StackNotFoundError(f'Stack {stack_id} no longer exists.')
+
+            response.raise_for_status()
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'Failed to get stack {stack_id}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
     def clear_images_status(self, environment_id: int):
         '''Clear the status of images in a specific environment.'''
         try:
-            response = self.session.post(f'{self.url}/api/stacks/image_status/clear?environmentId={environment_id}')
+            response = self._send('POST', f'{self.url}/api/stacks/image_status/clear?environmentId={environment_id}')
 
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
@@ -90,7 +234,7 @@ class Portainer:
     def refresh_stack_images(self, stack_id: int):
         '''Refresh the images for a specific stack.'''
         try:
-            response = self.session.get(f'{self.url}/api/stacks/{stack_id}/images_status?refresh=true')
+            response = self._send('GET', f'{self.url}/api/stacks/{stack_id}/images_status?refresh=true')
 
             response.raise_for_status()
 
@@ -112,7 +256,8 @@ class Portainer:
                 'Prune': prune,
                 'Webhook': webhook
             }
-            response = self.session.put(f'{self.url}/api/stacks/{stack_id}?endpointId={environment_id}', json=data)
+            response = self._send('PUT', f'{self.url}/api/stacks/{stack_id}?endpointId={environment_id}', json=data,
+                                  redeploy=True)
 
             response.raise_for_status()
 
@@ -136,7 +281,8 @@ class Portainer:
                 'Env': env,
                 'Prune': prune
             }
-            response = self.session.put(f'{self.url}/api/stacks/{stack_id}/git/redeploy?endpointId={environment_id}', json=data)
+            response = self._send('PUT', f'{self.url}/api/stacks/{stack_id}/git/redeploy?endpointId={environment_id}', json=data,
+                                  redeploy=True)
 
             response.raise_for_status()
 
@@ -149,7 +295,7 @@ class Portainer:
     def get_images_with_usage(self, environment_id: int):
         '''Get images with usage in a specific environment.'''
         try:
-            response = self.session.get(f'{self.url}/api/docker/{environment_id}/images?withUsage=true')
+            response = self._send('GET', f'{self.url}/api/docker/{environment_id}/images?withUsage=true')
 
             response.raise_for_status()
 
@@ -159,10 +305,15 @@ class Portainer:
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
         
+    def iter_images_with_usage(self, environment_id: int, fields: tuple = IMAGE_FIELDS):
+        '''Stream the images of a specific environment with their usage, keeping only the given fields.'''
+        return self._iter_list(f'{self.url}/api/docker/{environment_id}/images', f'Failed to get images with usage for environment {environment_id}',
+                               fields, params={'withUsage': 'true'})
+
     def delete_image(self, environment_id: int, image_id: str):
         '''Delete an image from a specific environment.'''
         try:
-            response = self.session.delete(f'{self.url}/api/endpoints/{environment_id}/docker/images/{image_id}?force=false')
+            response = self._send('DELETE', f'{self.url}/api/endpoints/{environment_id}/docker/images/{image_id}?force=false')
 
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
@@ -170,10 +321,25 @@ class Portainer:
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
 
+    def prune_images(self, environment_id: int):
+        '''Delete every unused image of a specific environment in a single call.'''
+        try:
+            filters = json.dumps({'dangling': ['false']})
+            response = self._send('POST', f'{self.url}/api/endpoints/{environment_id}/docker/images/prune', params={'filters': filters},
+                                  redeploy=True)
+
+            response.raise_for_status()
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'Failed to prune images in environment {environment_id}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
     def get_stack_file_content(self, stack_id: int):
         '''Get the stack file content for a specific stack.'''
         try:
-            response = self.session.get(f'{self.url}/api/stacks/{stack_id}/file')
+            response = self._send('GET', f'{self.url}/api/stacks/{stack_id}/file')
 
             response.raise_for_status()
 
@@ -182,3 +348,44 @@ class Portainer:
             raise PortainerError(f'Failed to get stack file content for stack {stack_id}: {e}')
         except ValueError:
             raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
+    def get_compose_containers(self, environment_id: int):
+        '''Get every container of a Docker Compose project in a specific environment, including stopped ones.'''
+        try:
+            filters = json.dumps({'label': ['com.docker.compose.project']})
+            response = self._send('GET', f'{self.url}/api/endpoints/{environment_id}/docker/containers/json', params={'all': 1, 'filters': filters})
+
+            response.raise_for_status()
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'Failed to get containers for environment {environment_id}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
+    def get_docker_images(self, environment_id: int):
+        '''Get the Docker images of a specific environment with their repository digests.'''
+        try:
+            response = self._send('GET', f'{self.url}/api/endpoints/{environment_id}/docker/images/json')
+
+            response.raise_for_status()
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'Failed to get Docker images for environment {environment_id}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
+
+    def get_stack_containers(self, environment_id: int, stack_name: str):
+        '''Get the containers of a Docker Compose stack, including stopped ones.'''
+        try:
+            filters = json.dumps({'label': [f'com.docker.compose.project={stack_name}']})
+            response = self._send('GET', f'{self.url}/api/endpoints/{environment_id}/docker/containers/json', params={'all': 1, 'filters': filters})
+
+            response.raise_for_status()
+
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise PortainerError(f'Failed to get containers of stack {stack_name} in environment {environment_id}: {e}')
+        except ValueError:
+            raise PortainerError('Invalid response from Portainer API. Could not parse JSON.')
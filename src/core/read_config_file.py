@@ -1,42 +1,83 @@
-from yaml import safe_load
 from errors.read_config_file_error import ReadConfigFileError
-from logs.console_logger import ConsoleLogger
-from logs.discord_logger import DiscordLogger
-from logs.slack_logger import SlackLogger
-from logs.telegram_logger import TelegramLogger
 
 class ReadConfigFile:
     def __init__(self, path: str):
         self.path = path
 
     def _init_logger(self, logging_config: dict):
-        '''Initialize the logger based on the provided configuration.'''
+        '''Initialize the logger based on the provided configuration.
+
+        Chat channels only receive the run or instance summaries by default, every message still goes to the console
+        and, if configured, to a file.
+        '''
         logger_type = logging_config.get('type', 'console').lower()
+        notifications = logging_config.get('notifications', 'summary').lower()
+        if notifications not in ('all', 'summary'):
+            raise ReadConfigFileError('"logging.notifications" must be "all" or "summary".')
+        if logging_config.get('summary', 'run').lower() not in ('run', 'instance'):
+            raise ReadConfigFileError('"logging.summary" must be "run" or "instance".')
+
+        backend = self._init_backend(logger_type, logging_config)
+        detail = []
+        channel = None
+        if logger_type == 'console' or notifications == 'summary':
+            from logs.console_logger import ConsoleLogger
+            detail.append(backend if logger_type == 'console' else ConsoleLogger())
+        if logging_config.get('file'):
+            from logs.file_logger import FileLogger
+            try:
+                detail.append(FileLogger(logging_config['file']))
+            except OSError as e:
+                raise ReadConfigFileError(f'Cannot open the log file {logging_config["file"]}: {e}')
+        if logger_type != 'console':
+            if notifications == 'all':
+                detail.append(backend)
+            else:
+                channel = backend
+
+        if len(detail) == 1 and channel is None:
+            return detail[0]
+        from logs.summary_logger import SummaryLogger
+        return SummaryLogger(detail, channel)
+
+    def _init_backend(self, logger_type: str, logging_config: dict):
+        '''Create the logger of the configured type.'''
 
+        # Only the configured backend is imported, the webhook loggers pull in requests
         if logger_type == 'console':
+            from logs.console_logger import ConsoleLogger
             return ConsoleLogger()
         
         if logger_type == 'discord':
+            from logs.discord_logger import DiscordLogger
             webhook_url = logging_config.get('webhookUrl')
             if not webhook_url:
                 raise ReadConfigFileError('Discord logger requires a "webhookUrl" in the configuration.')
             return DiscordLogger(webhook_url)
         
         if logger_type == 'slack':
+            from logs.slack_logger import SlackLogger
             webhook_url = logging_config.get('webhookUrl')
             if not webhook_url:
                 raise ReadConfigFileError('Slack logger requires a "webhookUrl" in the configuration.')
             return SlackLogger(webhook_url)
         
         if logger_type == 'telegram':
+            from logs.telegram_logger import TelegramLogger
             bot_token = logging_config.get('botToken')
             chat_id = logging_config.get('chatId')
             if not bot_token or not chat_id:
                 raise ReadConfigFileError('Telegram logger requires "botToken" and "chatId" in the configuration.')
             return TelegramLogger(bot_token, chat_id)
 
-    def read(self):
-        '''Read the configuration file and return the contents.'''
+        raise ReadConfigFileError(f'Unknown logging type "{logger_type}", expected console, discord, slack or telegram.')
+
+    def load(self):
+        '''Read and validate the configuration file, returning the compiled Config.'''
+        from yaml import safe_load
+        from core.config import Config
+        from core.config_schema import validate_config
+
         try:
             with open(self.path, 'r') as file:
                 config = safe_load(file)
@@ -46,13 +87,28 @@ class ReadConfigFile:
             
             if not config.get('instances') or not isinstance(config.get('instances'), list):
                 raise ReadConfigFileError('No instances found in the configuration file.')
-            
-            logging_config = config.get('logging', {})
-            logger = self._init_logger(logging_config)
 
-            return config, logger
+            # Report every problem at once, a typo in a key is an error instead of a silently ignored setting
+            errors = validate_config(config)
+            if errors:
+                raise ReadConfigFileError('Invalid configuration file:\n' + '\n'.join(f'  - {error}' for error in errors))
+
+            try:
+                return Config.from_dict(config)
+            except ValueError as e:
+                raise ReadConfigFileError(str(e))
         except FileNotFoundError:
             raise ReadConfigFileError(f'Configuration file not found at {self.path}. Please provide a valid path or use --init-config to create a default one.')
+        except Exception as e:
+            if isinstance(e, ReadConfigFileError):
+                raise e
+            raise ReadConfigFileError(f'An error occurred while reading the configuration file: {e}')
+
+    def read(self):
+        '''Read and validate the configuration file, returning the compiled Config and the logger.'''
+        config = self.load()
+        try:
+            return config, self._init_logger(config.logging)
         except Exception as e:
             if isinstance(e, ReadConfigFileError):
                 raise e
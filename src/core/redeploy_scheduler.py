@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field
+
+# Portainer stack type of Docker Compose stacks, the only ones whose containers all run on the environment node
+COMPOSE_STACK_TYPE = 2
+
+@dataclass
+class RedeployScheduler:
+    '''Order the outdated stacks of an environment into chains, redeployed with a concurrency limit.'''
+    concurrency: int = 1
+    priorities: dict = field(default_factory=dict)
+    groups: list = field(default_factory=list)
+    health_timeout: float = 0
+    health_interval: float = 5
+
+    @classmethod
+    def from_instance(cls, instance: dict):
+        '''Read the scheduler settings of an instance.'''
+        return cls(
+            concurrency=max(1, instance.get('redeployConcurrency', cls.concurrency)),
+            priorities=instance.get('stackPriorities') or {},
+            groups=instance.get('stackGroups') or [],
+            health_timeout=instance.get('healthCheckTimeout', cls.health_timeout),
+            health_interval=max(1, instance.get('healthCheckInterval', cls.health_interval)))
+
+    def plan(self, stacks: list[dict]):
+        '''Split the stacks into chains redeployed one stack after another, highest priority first.
+
+        Stacks of the same group form a single chain in the order of the group, every other stack is a chain of its own.
+        '''
+        by_name = {stack.get('Name'): stack for stack in stacks}
+        grouped = set()
+        chains = []
+
+        for group in self.groups:
+            chain = [by_name[stack_name] for stack_name in group if stack_name in by_name and stack_name not in grouped]
+            grouped.update(stack.get('Name') for stack in chain)
+            if chain:
+                chains.append(chain)
+
+        chains.extend([stack] for stack in stacks if stack.get('Name') not in grouped)
+
+        # Stable sort, equal priorities keep the listing order
+        return sorted(chains, key=lambda chain: -max(self.priorities.get(stack.get('Name'), 0) for stack in chain))
+
+    def gates_health(self, stack: dict):
+        '''Whether the redeploy slot of the stack is held until its containers are up.'''
+        return bool(self.health_timeout) and stack.get('Type') == COMPOSE_STACK_TYPE
+
+    @staticmethod
+    def containers_ready(containers: list[dict]):
+        '''Check the containers of a stack, returning whether they are all up and the reason when they are not.'''
+        if not containers:
+            return False, 'no containers are running yet'
+
+        for container in containers:
+            names = container.get('Names') or [container.get('Id', '')[:12]]
+            container_name = names[0].lstrip('/')
+            state = container.get('State')
+            status = container.get('Status', '')
+
+            # One-shot containers (migrations, init jobs) are done once they exit successfully
+            if state == 'exited' and status.startswith('Exited (0)'):
+                continue
+            if state != 'running':
+                return False, f'container {container_name} is {state}'
+            if '(health: starting)' in status:
+                return False, f'container {container_name} is starting'
+            if '(unhealthy)' in status:
+                return False, f'container {container_name} is unhealthy'
+
+        return True, ''
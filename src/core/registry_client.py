@@ -0,0 +1,111 @@
+import re
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from core.image_reference import ImageReference
+from core.metrics import REGISTRY_PREFIX, Metrics, endpoint_label
+from errors.registry_error import RegistryError
+
+# Manifest lists and OCI indexes first, their digest is the one Docker records in RepoDigests when pulling by tag
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json'
+])
+
+class RegistryClient:
+    '''Resolve image digests with HEAD requests against the registry v2 API, on a pooled session.'''
+
+    def __init__(self, registries: list[dict] = None, pool_size: int = 10, timeout: float = 10, metrics: Metrics = None):
+        self.registries = {registry.get('host'): registry for registry in registries or [] if registry.get('host')}
+        self.timeout = timeout
+        self.metrics = metrics
+        self.tokens = {}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, len(self.registries)), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        '''Close the pooled connections.'''
+        self.session.close()
+
+    def get_digest(self, reference: ImageReference):
+        '''Return the digest the registry currently serves for the tag of the reference.'''
+        registry = self.registries.get(reference.registry, {})
+        scheme = 'http' if registry.get('insecure', False) else 'https'
+        url = f'{scheme}://{reference.api_host}/v2/{reference.repository}/manifests/{reference.tag}'
+
+        try:
+            response = self._head(url, reference)
+            if response.status_code == 401:
+                self._authenticate(reference, response.headers.get('WWW-Authenticate', ''))
+                response = self._head(url, reference)
+
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise RegistryError(f'Failed to get the digest of image {reference}: {e}')
+        except ValueError:
+            raise RegistryError(f'Invalid token response from registry {reference.registry}.')
+
+        digest = response.headers.get('Docker-Content-Digest')
+        if not digest:
+            raise RegistryError(f'Registry {reference.registry} did not return a digest for image {reference}.')
+        return digest
+
+    def _head(self, url: str, reference: ImageReference):
+        headers = {'Accept': MANIFEST_TYPES}
+        auth = None
+
+        token, expires_at = self.tokens.get((reference.registry, reference.repository), (None, 0))
+        if token == 'basic':
+            registry = self.registries.get(reference.registry, {})
+            auth = (registry.get('username'), registry.get('password'))
+        elif token and time.monotonic() < expires_at:
+            headers['Authorization'] = f'Bearer {token}'
+
+        started = time.monotonic()
+        error = True
+        try:
+            response = self.session.head(url, headers=headers, auth=auth, timeout=self.timeout)
+            error = response.status_code >= 400 and response.status_code != 401
+            return response
+        finally:
+            if self.metrics:
+                self.metrics.observe_request(f'{REGISTRY_PREFIX}{reference.registry}', endpoint_label('HEAD', '/v2/{name}/manifests/{tag}'),
+                                             time.monotonic() - started, error=error)
+
+    def _authenticate(self, reference: ImageReference, challenge: str):
+        '''Answer a 401 challenge, fetching a pull token for Bearer realms.'''
+        registry = self.registries.get(reference.registry, {})
+        credentials = (registry.get('username'), registry.get('password')) if registry.get('username') else None
+        key = (reference.registry, reference.repository)
+
+        scheme, _, parameters = challenge.partition(' ')
+        if scheme.lower() == 'basic':
+            if not credentials:
+                raise RegistryError(f'Registry {reference.registry} requires credentials.')
+            self.tokens[key] = ('basic', float('inf'))
+            return
+        if scheme.lower() != 'bearer':
+            raise RegistryError(f'Registry {reference.registry} uses an unsupported authentication scheme: {scheme}')
+
+        parameters = dict(re.findall(r'(\w+)="([^"]*)"', parameters))
+        if not parameters.get('realm'):
+            raise RegistryError(f'Registry {reference.registry} sent a Bearer challenge without a realm.')
+
+        response = self.session.get(parameters['realm'], auth=credentials, timeout=self.timeout, params={
+            'service': parameters.get('service', ''),
+            'scope': f'repository:{reference.repository}:pull'
+        })
+        response.raise_for_status()
+
+        data = response.json()
+        token = data.get('token') or data.get('access_token')
+        if not token:
+            raise RegistryError(f'Registry {reference.registry} did not return a token.')
+
+        # Renew a little before the token expires
+        self.tokens[key] = (token, time.monotonic() + max(0, data.get('expires_in', 60) - 10))
@@ -0,0 +1,122 @@
+import random
+from dataclasses import dataclass
+from urllib3.util.retry import Retry
+
+# Methods that can be sent again safely, whatever happened to the first attempt
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'DELETE', 'OPTIONS'})
+
+# Stack redeploys, only sent again when Portainer never started them
+REDEPLOY_METHODS = frozenset({'PUT'})
+
+# Transient gateway errors worth retrying
+RETRY_STATUSES = (502, 503, 504)
+
+# Gateway errors returned before the request reached Portainer, a 504 can come while the redeploy is running
+REDEPLOY_RETRY_STATUSES = (502, 503)
+
+class PolicyRetry(Retry):
+    '''urllib3 retries that stop once their backoff would outlast the time budget of the run.
+
+    budget returns the seconds left, or None without a budget. Redeploys are left out of allowed_methods, so read
+    errors never send them again, and only their REDEPLOY_RETRY_STATUSES are retried.
+    '''
+
+    def __init__(self, *args, budget=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.budget = self.budget
+        return retry
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False):
+        if method in REDEPLOY_METHODS:
+            return bool(self.total) and status_code in REDEPLOY_RETRY_STATUSES
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def is_exhausted(self):
+        if super().is_exhausted():
+            return True
+        remaining = self.budget() if self.budget else None
+        return remaining is not None and remaining <= self.get_backoff_time()
+
+@dataclass
+class RequestPolicy:
+    '''Timeouts, retries and circuit breaker settings used to talk to a Portainer instance.'''
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    redeploy_timeout: float = 600
+    retries: int = 3
+    backoff_factor: float = 0.5
+    max_backoff: float = 30
+    failure_threshold: int = 5
+    reset_timeout: float = 60
+
+    @classmethod
+    def from_instance(cls, instance: dict):
+        '''Read the policy from the settings of an instance.'''
+        return cls(
+            connect_timeout=instance.get('connectTimeout', cls.connect_timeout),
+            read_timeout=instance.get('readTimeout', cls.read_timeout),
+            redeploy_timeout=instance.get('redeployTimeout', cls.redeploy_timeout),
+            retries=instance.get('retries', cls.retries),
+            backoff_factor=instance.get('retryBackoff', cls.backoff_factor),
+            failure_threshold=instance.get('circuitBreakerThreshold', cls.failure_threshold),
+            reset_timeout=instance.get('circuitBreakerReset', cls.reset_timeout))
+
+    def timeout(self, redeploy: bool = False, remaining: float = None):
+        '''Return the (connect, read) timeout of a request, capped at the seconds remaining in the time budget of the run.'''
+        timeout = (self.connect_timeout, self.redeploy_timeout if redeploy else self.read_timeout)
+        if remaining is None:
+            return timeout
+        return tuple(min(value, remaining) for value in timeout)
+
+    def backoff(self, attempt: int):
+        '''Exponential backoff with full jitter before the given retry attempt (starting at 1).'''
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** (attempt - 1))))
+
+    def retry_delay(self, method: str, attempt: int, status: int = None, sent: bool = True, remaining: float = None):
+        '''Seconds to wait before sending a request again after the given attempt (starting at 1), None if it must not be retried.
+
+        A status is the answer of a failed attempt, without one the attempt got no answer and sent tells whether the
+        request may have reached Portainer. The same rules as urllib3_retry, for the clients that retry on their own.
+        '''
+        if attempt > self.retries:
+            return None
+        if status is None and sent and method not in IDEMPOTENT_METHODS:
+            return None
+        if status is not None and status not in self.retry_statuses(method):
+            return None
+        delay = self.backoff(attempt)
+        if remaining is not None and remaining <= delay:
+            return None
+        return delay
+
+    @staticmethod
+    def retry_statuses(method: str):
+        '''Answers a request is sent again on, none for POST calls.'''
+        if method in IDEMPOTENT_METHODS:
+            return RETRY_STATUSES
+        return REDEPLOY_RETRY_STATUSES if method in REDEPLOY_METHODS else ()
+
+    def urllib3_retry(self, budget=None):
+        '''Build the urllib3 retry strategy mounted on the requests session, budget returns the seconds left in the run.'''
+        options = dict(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            backoff_max=self.max_backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+            budget=budget)
+        try:
+            return PolicyRetry(backoff_jitter=self.backoff_factor, **options)
+        except TypeError:
+            # urllib3 1.x has neither jitter nor backoff_max
+            options.pop('backoff_max')
+            return PolicyRetry(**options)
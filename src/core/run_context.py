@@ -0,0 +1,30 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Only needed for the annotations, the services import sqlite3 and the registry client
+    from core.digest_resolver import DigestResolver
+    from core.discovery_cache import DiscoveryCache
+    from core.git_resolver import GitResolver
+    from core.metrics import Metrics
+    from core.status_cache import StatusCache
+    from core.update_plan import UpdatePlan
+    from logs.event_collector import EventCollector
+
+@dataclass
+class RunContext:
+    '''Services shared by every instance processed in a run.'''
+    cache: 'StatusCache' = None
+    discovery_cache: 'DiscoveryCache' = None
+    metrics: 'Metrics' = None
+    digest_resolver: 'DigestResolver' = None
+    git_resolver: 'GitResolver' = None
+    plan: 'UpdatePlan' = None
+    applied_plan: 'UpdatePlan' = None
+    events: 'EventCollector' = None
+
+    def close(self):
+        '''Close the caches and registry sessions opened for the run.'''
+        for service in (self.cache, self.discovery_cache, self.digest_resolver):
+            if service:
+                service.close()
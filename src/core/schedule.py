@@ -0,0 +1,100 @@
+import re
+from datetime import datetime, timedelta
+from errors.schedule_error import ScheduleError
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# (minimum, maximum) of each cron field: minute, hour, day of month, month, day of week
+_CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+# Highest value written in each field, 7 is accepted as Sunday like most cron implementations
+_CRON_LIMITS = [59, 23, 31, 12, 7]
+
+class Schedule:
+    '''When an instance should run in daemon mode: a fixed interval ("15m", 900) or a cron expression ("*/15 * * * *").'''
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.interval = None
+        self.fields = None
+        # Whether both day fields are restricted, cron then runs on the days matching either of them
+        self.either_day = False
+
+        if isinstance(expression, (int, float)) and not isinstance(expression, bool):
+            self.interval = float(expression)
+        elif isinstance(expression, str) and re.fullmatch(r'\s*\d+\s*[smhd]?\s*', expression):
+            match = re.fullmatch(r'\s*(\d+)\s*([smhd]?)\s*', expression)
+            self.interval = float(match.group(1)) * _INTERVAL_UNITS[match.group(2) or 's']
+        elif isinstance(expression, str):
+            self.fields = self._parse_cron(expression)
+            days, weekdays = expression.split()[2:5:2]
+            self.either_day = not days.startswith('*') and not weekdays.startswith('*')
+            # Raise now for expressions such as "0 0 31 2 *" instead of at their first run
+            self.next_run(datetime.now())
+        else:
+            raise ScheduleError(f'Invalid schedule "{expression}".')
+
+        if self.interval is not None and self.interval <= 0:
+            raise ScheduleError(f'Schedule interval must be greater than zero, got "{expression}".')
+
+    def _parse_cron(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ScheduleError(f'Cron expression "{expression}" must have 5 fields.')
+
+        fields = []
+        for part, (minimum, maximum), limit in zip(parts, _CRON_RANGES, _CRON_LIMITS):
+            values = set()
+            for item in part.split(','):
+                match = re.fullmatch(r'(\*|\d+(?:-\d+)?)(?:/(\d+))?', item)
+                if not match:
+                    raise ScheduleError(f'Invalid cron field "{part}" in "{expression}".')
+
+                value_range, step = match.group(1), int(match.group(2) or 1)
+                if value_range == '*':
+                    start, end = minimum, maximum
+                elif '-' in value_range:
+                    start, end = (int(value) for value in value_range.split('-'))
+                else:
+                    start = int(value_range)
+                    end = maximum if match.group(2) else start
+
+                if start < minimum or end > limit or start > end or step < 1:
+                    raise ScheduleError(f'Cron field "{part}" is out of range in "{expression}".')
+                values.update(range(start, end + 1, step))
+            fields.append(values)
+
+        if 7 in fields[4]:
+            fields[4].discard(7)
+            fields[4].add(0)
+
+        return fields
+
+    def next_run(self, after: datetime):
+        '''Return the first time strictly after the given one at which the instance should run.'''
+        if self.interval is not None:
+            return after + timedelta(seconds=self.interval)
+
+        minutes, hours, days, months, weekdays = self.fields
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 4)
+
+        while moment < limit:
+            if moment.month not in months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+                continue
+            # Cron weekdays start on Sunday, Python ones on Monday
+            day_matches = moment.day in days
+            weekday_matches = (moment.weekday() + 1) % 7 in weekdays
+            if not (day_matches or weekday_matches if self.either_day else day_matches and weekday_matches):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if moment.hour not in hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            if moment.minute not in minutes:
+                moment += timedelta(minutes=1)
+                continue
+            return moment
+
+        raise ScheduleError(f'Cron expression "{self.expression}" never matches.')
@@ -0,0 +1,38 @@
+import hashlib
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
+class Shard:
+    '''One of `count` deterministic slices of the instances, numbered from 1.
+
+    An instance belongs to the shard picked by a hash of its name, so every process or machine given the same
+    configuration agrees on the split and an instance keeps its shard when others are added or removed.
+    '''
+    number: int = 1
+    count: int = 1
+
+    @classmethod
+    def parse(cls, value: str):
+        '''Parse "i/N", raising ValueError unless 1 <= i <= N.'''
+        number, separator, count = value.partition('/')
+        try:
+            shard = cls(int(number), int(count))
+        except ValueError:
+            raise ValueError(f'invalid shard "{value}", expected i/N such as 1/4')
+        if not separator or not 1 <= shard.number <= shard.count:
+            raise ValueError(f'invalid shard "{value}", expected i/N with 1 <= i <= N')
+        return shard
+
+    def __str__(self):
+        return f'{self.number}/{self.count}'
+
+    def includes(self, instance):
+        '''Whether the instance (an InstanceConfig) is processed by this shard.'''
+        if self.count == 1:
+            return True
+        # Python's hash() is salted per process, sha256 gives the same answer everywhere
+        key = instance.name or instance.host or str(instance.index)
+        return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'big') % self.count == self.number - 1
+
+    def select(self, instances):
+        return [instance for instance in instances if self.includes(instance)]
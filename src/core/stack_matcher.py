@@ -0,0 +1,50 @@
+import fnmatch
+import re
+
+# Characters that turn a pattern into a shell-style glob
+GLOB_CHARACTERS = frozenset('*?[')
+
+class StackMatcher:
+    '''Compiled list of stack or environment name patterns.
+
+    Plain names are looked up in a set, glob patterns (*, ?, [abc]) and `re:` regular expressions are compiled into a
+    single regular expression, so matching a name costs one set lookup and at most one regex match.
+    '''
+    __slots__ = ('patterns', 'names', 'expression')
+
+    def __init__(self, patterns: list = None):
+        self.patterns = tuple(str(pattern) for pattern in patterns or [])
+        names = set()
+        expressions = []
+
+        for pattern in self.patterns:
+            if pattern.startswith('re:'):
+                # Validated on its own so the error names the faulty pattern
+                try:
+                    re.compile(pattern[3:])
+                except re.error as e:
+                    raise ValueError(f'invalid regular expression "{pattern[3:]}": {e}')
+                expressions.append(f'(?:{pattern[3:]})')
+            elif GLOB_CHARACTERS.intersection(pattern):
+                expressions.append(fnmatch.translate(pattern))
+            else:
+                names.add(pattern)
+
+        self.names = frozenset(names)
+        try:
+            self.expression = re.compile('|'.join(expressions)) if expressions else None
+        except re.error as e:
+            # Global flags such as (?i) are only allowed at the start, use the scoped form (?i:...) instead
+            raise ValueError(f'invalid pattern list {list(self.patterns)}: {e}')
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __repr__(self):
+        return f'StackMatcher({list(self.patterns)!r})'
+
+    def matches(self, name: str):
+        '''Whether the name is one of the plain names or fully matches a pattern.'''
+        if name in self.names:
+            return True
+        return self.expression is not None and name is not None and self.expression.fullmatch(name) is not None
@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+import time
+
+class StatusCache:
+    '''On-disk cache of the stacks confirmed current, used to skip their registry check within the TTL.'''
+
+    def __init__(self, path: str, ttl: int = 3600, max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS stack_status (
+                instance TEXT NOT NULL,
+                environment_id INTEGER NOT NULL,
+                stack_id INTEGER NOT NULL,
+                stack_version TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (instance, environment_id, stack_id)
+            )''')
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        '''Drop expired entries and keep only the most recent max_entries rows.'''
+        with self.lock:
+            self.connection.execute('DELETE FROM stack_status WHERE checked_at < ?', (time.time() - self.ttl,))
+            self.connection.execute('''
+                DELETE FROM stack_status WHERE rowid NOT IN (
+                    SELECT rowid FROM stack_status ORDER BY checked_at DESC LIMIT ?
+                )''', (self.max_entries,))
+            self.connection.commit()
+
+    def is_current(self, instance: str, environment_id: int, stack: dict):
+        '''Check if the stack was confirmed current within the TTL and has not been redeployed since.'''
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT stack_version, checked_at FROM stack_status WHERE instance = ? AND environment_id = ? AND stack_id = ?',
+                (instance, environment_id, stack.get('Id'))).fetchone()
+
+        if not row:
+            return False
+
+        stack_version, checked_at = row
+        return stack_version == self._stack_version(stack) and time.time() - checked_at < self.ttl
+
+    def mark_current(self, instance: str, environment_id: int, stack: dict):
+        '''Record that every image of the stack is up to date.'''
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO stack_status (instance, environment_id, stack_id, stack_version, checked_at) VALUES (?, ?, ?, ?, ?)',
+                (instance, environment_id, stack.get('Id'), self._stack_version(stack), time.time()))
+            self.connection.commit()
+
+    def close(self):
+        '''Close the database connection.'''
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def _stack_version(stack: dict):
+        # Portainer bumps UpdateDate on every redeploy or edit of the stack
+        return str(stack.get('UpdateDate') or stack.get('CreationDate') or '')
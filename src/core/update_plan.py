@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+
+class UpdatePlan:
+    '''What a run would do: outdated stacks, skipped stacks with the reason, and images that would be deleted.
+
+    Filled by --plan runs and written as JSON, then loaded by --apply to redeploy without checking the images again.
+    '''
+    VERSION = 1
+
+    def __init__(self, created_at: float = None, instances: list[dict] = None):
+        self.lock = threading.Lock()
+        self.created_at = created_at or time.time()
+        self.instances = {(instance.get('name'), instance.get('host')): instance for instance in instances or []}
+
+    @classmethod
+    def load(cls, path: str):
+        '''Read a plan written by write. Raises ValueError if the file is not a plan.'''
+        with open(path) as file:
+            data = json.load(file)
+
+        if not isinstance(data, dict) or data.get('version') != cls.VERSION or not isinstance(data.get('instances'), list):
+            raise ValueError(f'{path} is not a plan written by --plan.')
+        return cls(created_at=data.get('created_at'), instances=data['instances'])
+
+    def write(self, path: str):
+        '''Write the plan as JSON.'''
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'version': self.VERSION,
+                'created_at': self.created_at,
+                'instances': sorted(self.instances.values(), key=lambda instance: instance.get('index', 0))
+            }
+
+    @property
+    def age(self):
+        '''Seconds since the plan was computed.'''
+        return time.time() - self.created_at
+
+    def instance(self, name: str, host: str):
+        '''Return the planned work of an instance, or None if the plan does not cover it.'''
+        return self.instances.get((name, host))
+
+    def summary(self):
+        '''Count the outdated and skipped stacks and the images of the plan.'''
+        counts = {'outdated': 0, 'skipped': 0, 'images': 0, 'reclaimable_bytes': 0, 'errors': 0}
+        with self.lock:
+            for instance in self.instances.values():
+                counts['errors'] += len(instance['errors'])
+                for environment in instance['environments']:
+                    counts['outdated'] += len(environment['outdated'])
+                    counts['skipped'] += len(environment['skipped'])
+                    counts['images'] += len(environment['images'])
+                    counts['reclaimable_bytes'] += sum(image['size'] for image in environment['images'])
+        return counts
+
+    def add_instance(self, index: int, name: str, host: str, config_fingerprint: str = None, portainer_update_available: bool = False):
+        with self.lock:
+            self._instance(name, host).update(index=index, config_fingerprint=config_fingerprint,
+                                              portainer_update_available=portainer_update_available)
+
+    def add_environment(self, name: str, host: str, env_id: int, env_name: str, skipped: str = None):
+        with self.lock:
+            self._environment(name, host, env_id, env_name)['skipped_reason'] = skipped
+
+    def add_stack(self, name: str, host: str, env_id: int, env_name: str, stack: dict, reason: str = None):
+        '''Record an outdated stack, or a skipped one when a reason is given.'''
+        entry = {
+            'id': stack.get('Id'),
+            'name': stack.get('Name'),
+            'git': bool(stack.get('GitConfig')),
+            'version': stack.get('UpdateDate') or stack.get('CreationDate')
+        }
+        with self.lock:
+            environment = self._environment(name, host, env_id, env_name)
+            if reason:
+                environment['skipped'].append({**entry, 'reason': reason})
+            else:
+                environment['outdated'].append(entry)
+
+    def add_images(self, name: str, host: str, env_id: int, env_name: str, images: list[dict]):
+        with self.lock:
+            self._environment(name, host, env_id, env_name)['images'] = [
+                {'id': image.get('id'), 'tags': image.get('tags') or [], 'size': image.get('size', 0)} for image in images
+            ]
+
+    def add_error(self, name: str, host: str, message: str):
+        with self.lock:
+            self._instance(name, host)['errors'].append(message)
+
+    def _instance(self, name: str, host: str):
+        return self.instances.setdefault((name, host), {'name': name, 'host': host, 'environments': [], 'errors': []})
+
+    def _environment(self, name: str, host: str, env_id: int, env_name: str):
+        environments = self._instance(name, host)['environments']
+        for environment in environments:
+            if environment['id'] == env_id:
+                return environment
+
+        environment = {'id': env_id, 'name': env_name, 'skipped_reason': None, 'outdated': [], 'skipped': [], 'images': []}
+        environments.append(environment)
+        return environment
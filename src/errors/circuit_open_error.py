@@ -0,0 +1,5 @@
+from errors.portainer_error import PortainerError
+
+class CircuitOpenError(PortainerError):
+    '''Raised when calls to a Portainer instance are short-circuited after repeated failures.'''
+    pass
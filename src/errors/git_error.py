@@ -0,0 +1,3 @@
+class GitError(Exception):
+    '''Raised when the commit of a Git reference cannot be resolved from its repository.'''
+    pass
@@ -0,0 +1,3 @@
+class InstanceTimeoutError(Exception):
+    '''Raised when an instance exceeds its wall-clock processing budget.'''
+    pass
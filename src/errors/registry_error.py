@@ -0,0 +1,3 @@
+class RegistryError(Exception):
+    '''Raised when an image digest cannot be resolved from its registry.'''
+    pass
@@ -0,0 +1,3 @@
+class ScheduleError(Exception):
+    '''Raised when an instance schedule cannot be parsed.'''
+    pass
@@ -0,0 +1,5 @@
+from errors.portainer_error import PortainerError
+
+class StackNotFoundError(PortainerError):
+    '''Raised when Portainer answers 404 for a stack, which was deleted since it was listed.'''
+    pass
@@ -3,4 +3,12 @@ from abc import ABC, abstractmethod
 class BaseLogger(ABC):
     @abstractmethod
     def log(self, message: str, level: str = 'INFO'):
-        pass
\ No newline at end of file
+        pass
+
+    def notify(self, message: str, level: str = 'INFO'):
+        '''Send a summary, which also reaches the notification channels that only receive summaries.'''
+        self.log(message, level=level)
+
+    def close(self):
+        '''Flush any pending message before the process exits.'''
+        pass
@@ -0,0 +1,26 @@
+import threading
+from .base_logger import BaseLogger
+
+class BufferedLogger(BaseLogger):
+    '''Collect the messages of one instance and write them together, keeping them ordered.'''
+    _flush_lock = threading.Lock()
+
+    def __init__(self, logger: BaseLogger):
+        self.logger = logger
+        self.messages = []
+
+    def log(self, message: str, level: str = 'INFO'):
+        self.messages.append((message, level, False))
+
+    def notify(self, message: str, level: str = 'INFO'):
+        self.messages.append((message, level, True))
+
+    def flush(self):
+        '''Send the buffered messages to the wrapped logger.'''
+        with BufferedLogger._flush_lock:
+            for message, level, summary in self.messages:
+                if summary:
+                    self.logger.notify(message, level=level)
+                else:
+                    self.logger.log(message, level=level)
+        self.messages = []
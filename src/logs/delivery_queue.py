@@ -0,0 +1,150 @@
+import atexit
+import queue
+import re
+import threading
+import time
+import requests
+
+_STOP = object()
+
+# [name](url) links, never split across two posts
+LINK = re.compile(r'\[[^\]\n]*\]\([^)\n]*\)')
+
+class DeliveryQueue:
+    '''Deliver notification messages from a background thread, batching them into as few posts as possible.'''
+
+    def __init__(self, send, max_length: int, name: str, linger: float = 0.5, max_attempts: int = 5, send_plain=None):
+        self.send = send
+        self.send_plain = send_plain
+        self.max_length = max_length
+        self.name = name
+        self.linger = linger
+        self.max_attempts = max_attempts
+
+        # Pooled session reused for every post
+        self.session = requests.Session()
+        self.queue = queue.Queue()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._run, name=f'{name}-delivery', daemon=True)
+        self.thread.start()
+
+        # Make sure pending messages are delivered before the process exits
+        atexit.register(self.close)
+
+    def put(self, text: str):
+        '''Queue a message for delivery without waiting for it to be sent.'''
+        self.queue.put(text)
+
+    def close(self, timeout: float = 30):
+        '''Flush the pending messages and stop the delivery thread.'''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.session.close()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            messages = [item]
+
+            # Wait a little so bursts of log lines end up in the same post
+            deadline = time.monotonic() + self.linger
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 and not self.closed else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                messages.append(item)
+
+            for chunk in self._batch(messages):
+                self._deliver(chunk)
+
+    def _batch(self, messages: list[str]):
+        '''Join the lines of the messages into chunks that fit in a single post, splitting only between lines.'''
+        chunks = []
+        lines, size = [], 0
+        for message in messages:
+            for line in str(message).split('\n'):
+                for piece in self._split_line(line):
+                    if lines and size + 1 + len(piece) > self.max_length:
+                        chunks.append('\n'.join(lines))
+                        lines, size = [], 0
+                    size += len(piece) + (1 if lines else 0)
+                    lines.append(piece)
+
+        if lines:
+            chunks.append('\n'.join(lines))
+        return chunks
+
+    def _split_line(self, line: str):
+        '''Split a line too long for a post on its own at spaces, keeping links whole.'''
+        while len(line) > self.max_length:
+            limit = self.max_length
+            for link in LINK.finditer(line):
+                if link.start() >= limit:
+                    break
+                if limit < link.end() and link.start() > 0:
+                    limit = link.start()
+                    break
+
+            space = line.rfind(' ', 0, limit + 1)
+            cut = space if space > 0 else limit
+            yield line[:cut]
+            line = line[cut + 1:] if space > 0 else line[cut:]
+        yield line
+
+    def _deliver(self, text: str):
+        '''Post a chunk, waiting and retrying when the platform rate limits us.
+
+        When the platform rejects the formatting of the chunk, it is sent again as plain text with send_plain.
+        '''
+        send = self.send
+        for _ in range(self.max_attempts):
+            try:
+                response = send(self.session, text)
+            except requests.exceptions.RequestException as e:
+                print(f'Failed to send {self.name} log: {e}')
+                return
+
+            if response.status_code == 429:
+                time.sleep(self._retry_after(response))
+                continue
+
+            if response.status_code == 400 and self.send_plain and send is not self.send_plain:
+                # A single line with unbalanced Markdown must not drop the whole batch
+                send = self.send_plain
+                continue
+
+            try:
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                print(f'Failed to send {self.name} log: {e}')
+            return
+
+        print(f'Failed to send {self.name} log: still rate limited after {self.max_attempts} attempts.')
+
+    def _retry_after(self, response: requests.Response):
+        '''Read how long to wait from a 429 response.'''
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            try:
+                body = response.json()
+                # Discord sends "retry_after", Telegram nests it in "parameters"
+                retry_after = body.get('retry_after') or body.get('parameters', {}).get('retry_after')
+            except ValueError:
+                retry_after = None
+
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            return 1.0
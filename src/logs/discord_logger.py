@@ -1,13 +1,20 @@
 from .base_logger import BaseLogger
+from .delivery_queue import DeliveryQueue
 import requests
 
 class DiscordLogger(BaseLogger):
+    # Discord rejects messages longer than 2000 characters
+    max_length = 2000
+
     def __init__(self, webhook_url: str):
         self.webhook_url = webhook_url
+        self.queue = DeliveryQueue(self._send, max_length=self.max_length, name='Discord')
+
+    def _send(self, session: requests.Session, text: str):
+        return session.post(self.webhook_url, json={'content': text}, timeout=10)
 
     def log(self, message: str, level: str = 'INFO'):
-        payload = {'content': f'[{level}] {message}'}
-        try:
-            requests.post(self.webhook_url, json=payload)
-        except Exception as e:
-            print(f'Failed to send Discord log: {e}')
+        self.queue.put(f'[{level}] {message}')
+
+    def close(self):
+        self.queue.close()
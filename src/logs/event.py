@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    '''Something that happened to a stack, an environment or an instance during a run.
+
+    Actions: updated, current, outdated (found by --plan), skipped, failed, offline (environment),
+    images_deleted (count and size of one cleanup) and portainer_updated.
+    '''
+    instance: str
+    action: str
+    environment: str = None
+    stack: str = None
+    duration: float = None
+    error: str = None
+    reason: str = None
+    count: int = 1
+    size: int = 0
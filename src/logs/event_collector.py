@@ -0,0 +1,107 @@
+import threading
+import time
+from utils.helpers import format_size
+from .event import Event
+
+# Failures listed in a summary, and kept for the run report
+MAX_LISTED_FAILURES = 10
+MAX_REPORTED_FAILURES = 50
+
+class EventCollector:
+    '''Keep the structured events of a run in memory and render them as compact summaries.
+
+    With per_instance, each instance sends its own summary when it finishes and its events are dropped, which keeps
+    memory flat in daemon mode. The totals used by the run report cover the whole run either way.
+    '''
+
+    def __init__(self, per_instance: bool = False):
+        self.per_instance = per_instance
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.events = []
+        self.totals = {}
+        self.failures = []
+
+    def record(self, event: Event):
+        with self.lock:
+            self.events.append(event)
+            self.totals[event.action] = self.totals.get(event.action, 0) + event.count
+            if event.action == 'failed' and len(self.failures) < MAX_REPORTED_FAILURES:
+                self.failures.append({'instance': event.instance, 'environment': event.environment, 'stack': event.stack, 'error': event.error})
+
+    def report(self):
+        '''Totals per action and the first failures, for the run report.'''
+        with self.lock:
+            return {'outcomes': dict(sorted(self.totals.items())), 'failures': list(self.failures)}
+
+    def summary(self, instance: str = None, drain: bool = False):
+        '''Render the events of an instance, or of the whole run, as one message. Returns None if there is nothing to report.'''
+        with self.lock:
+            events = [event for event in self.events if instance is None or event.instance == instance]
+            if drain:
+                self.events = [event for event in self.events if instance is not None and event.instance != instance]
+
+        if not events:
+            return None
+
+        by_action = {}
+        for event in events:
+            by_action.setdefault(event.action, []).append(event)
+
+        stacks = [event for event in events if event.stack is not None]
+        environments = {(event.instance, event.environment) for event in events if event.environment is not None}
+        if instance is None:
+            instances = {event.instance for event in events}
+            title = f'Run summary: {len(instances)} instances, {len(environments)} environments, {len(stacks)} stacks in {time.monotonic() - self.started_at:.1f}s.'
+        else:
+            title = f'Summary of Portainer instance [{instance}]: {len(environments)} environments, {len(stacks)} stacks.'
+        lines = [title]
+
+        # Offline environments and instance errors are reported on their own lines
+        counts = [(sum(1 for event in by_action.get(action, []) if event.stack is not None), label) for action, label in
+                  (('updated', 'updated'), ('outdated', 'outdated'), ('current', 'up to date'), ('skipped', 'skipped'), ('failed', 'failed'))]
+        if any(count for count, _ in counts):
+            lines.append('Stacks: ' + ', '.join(f'{count} {label}' for count, label in counts if count) + '.')
+
+        updated = by_action.get('updated', [])
+        if updated:
+            slowest = max(updated, key=lambda event: event.duration or 0)
+            lines.append(f'Redeploys took {sum(event.duration or 0 for event in updated):.1f}s, the slowest was '
+                         f'{self._where(slowest, instance)} ({slowest.duration or 0:.1f}s).')
+
+        skipped = by_action.get('skipped', [])
+        if skipped:
+            reasons = {}
+            for event in skipped:
+                reasons[event.reason] = reasons.get(event.reason, 0) + 1
+            lines.append('Skipped: ' + ', '.join(f'{reason} {count}' for reason, count in sorted(reasons.items(), key=lambda item: -item[1])) + '.')
+
+        offline = by_action.get('offline', [])
+        if offline:
+            lines.append(f'Offline environments: {", ".join(self._where(event, instance) for event in offline)}.')
+
+        if by_action.get('portainer_updated'):
+            lines.append(f'Portainer updated on {len(by_action["portainer_updated"])} instances.')
+
+        cleanups = by_action.get('images_deleted', [])
+        if cleanups:
+            lines.append(f'Deleted {sum(event.count for event in cleanups)} unused images, reclaiming up to {format_size(sum(event.size for event in cleanups))}.')
+
+        failed = by_action.get('failed', [])
+        if failed:
+            lines.append('Failures:')
+            lines.extend(f'- {self._where(event, instance)}: {event.error}' for event in failed[:MAX_LISTED_FAILURES])
+            if len(failed) > MAX_LISTED_FAILURES:
+                lines.append(f'- and {len(failed) - MAX_LISTED_FAILURES} more, see the detailed log.')
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _where(event: Event, instance: str = None):
+        '''Short location of an event, leaving out the instance in per-instance summaries.'''
+        parts = [] if instance is not None else [f'[{event.instance}]']
+        if event.environment is not None:
+            parts.append(f'[{event.environment}]')
+        if event.stack is not None:
+            parts.append(f'[{event.stack}]')
+        return ' '.join(parts) or f'[{event.instance}]'
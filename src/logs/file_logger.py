@@ -0,0 +1,18 @@
+import threading
+import time
+from .base_logger import BaseLogger
+
+class FileLogger(BaseLogger):
+    '''Append every message to a file, with a timestamp.'''
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def log(self, message: str, level: str = 'INFO'):
+        with self.lock:
+            self.file.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} [{level}] {message}\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
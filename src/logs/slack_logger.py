@@ -1,16 +1,23 @@
 from .base_logger import BaseLogger
+from .delivery_queue import DeliveryQueue
 import requests
 import re
 
 class SlackLogger(BaseLogger):
+    # Slack truncates message text after 4000 characters
+    max_length = 4000
+
     def __init__(self, webhook_url: str):
         self.webhook_url = webhook_url
+        self.queue = DeliveryQueue(self._send, max_length=self.max_length, name='Slack')
+
+    def _send(self, session: requests.Session, text: str):
+        return session.post(self.webhook_url, json={'text': text}, timeout=10)
 
     def log(self, message: str, level: str = 'INFO'):
         # Replace []() with Slack-style links
-        message = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<\2|\1>', message)
-        payload = {'text': f'[{level}] {message}'}
-        try:
-            requests.post(self.webhook_url, json=payload)
-        except Exception as e:
-            print(f'Failed to send Slack log: {e}')
+        message = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<\2|\1>', str(message))
+        self.queue.put(f'[{level}] {message}')
+
+    def close(self):
+        self.queue.close()
@@ -0,0 +1,24 @@
+from .base_logger import BaseLogger
+
+class SummaryLogger(BaseLogger):
+    '''Write every message to the detail loggers (console, file) and only the run or instance summaries to a channel.
+
+    Keeps Discord, Slack and Telegram down to one compact message per run or per instance instead of one per stack.
+    '''
+
+    def __init__(self, detail: list[BaseLogger], channel: BaseLogger = None):
+        self.detail = detail
+        self.channel = channel
+
+    def log(self, message: str, level: str = 'INFO'):
+        for logger in self.detail:
+            logger.log(message, level=level)
+
+    def notify(self, message: str, level: str = 'INFO'):
+        self.log(message, level=level)
+        if self.channel:
+            self.channel.log(message, level=level)
+
+    def close(self):
+        for logger in self.detail + ([self.channel] if self.channel else []):
+            logger.close()
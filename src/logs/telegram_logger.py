@@ -1,22 +1,31 @@
 from .base_logger import BaseLogger
+from .delivery_queue import DeliveryQueue
 import requests
 
 class TelegramLogger(BaseLogger):
+    # Telegram rejects messages longer than 4096 characters
+    max_length = 4096
+
     def __init__(self, bot_token: str, chat_id: str):
         self.bot_token = bot_token
         self.chat_id = chat_id
         self.api_url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
+        self.queue = DeliveryQueue(self._send, max_length=self.max_length, name='Telegram', send_plain=self._send_plain)
 
-    def log(self, message: str, level: str = 'INFO'):
-        text = f'[{level}] {message}'
+    def _send(self, session: requests.Session, text: str):
         payload = {
             'chat_id': self.chat_id,
             'text': text,
             'parse_mode': 'markdown'
         }
-        try:
-            response = requests.post(self.api_url, data=payload)
-            response.raise_for_status()
-        except Exception as e:
-            print(f'Failed to send Telegram log: {e}')
+        return session.post(self.api_url, data=payload, timeout=10)
+
+    def _send_plain(self, session: requests.Session, text: str):
+        # Telegram answers 400 when it cannot parse the Markdown, e.g. a stack name with a single underscore
+        return session.post(self.api_url, data={'chat_id': self.chat_id, 'text': text}, timeout=10)
+
+    def log(self, message: str, level: str = 'INFO'):
+        self.queue.put(f'[{level}] {message}')
 
+    def close(self):
+        self.queue.close()
@@ -1,175 +1,320 @@
 import argparse
+import json
 import os
-import time
-from utils.helpers import init_config, delete_unused_images
-from core.portainer import Portainer
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from typing import TYPE_CHECKING
+from utils.helpers import format_size, init_config
 from core.read_config_file import ReadConfigFile
+from core.metrics import Metrics, merge_reports, summarize_report
+from core.run_context import RunContext
+from core.shard import Shard
+from core.update_plan import UpdatePlan
 from errors.read_config_file_error import ReadConfigFileError
-from errors.portainer_error import PortainerError
+from logs.base_logger import BaseLogger
+from logs.buffered_logger import BufferedLogger
+from logs.event_collector import EventCollector
+
+if TYPE_CHECKING:
+    # The compiled settings import the request policy and urllib3, only needed once a configuration is read
+    from core.config import Config
+    from core.instance_config import InstanceConfig
+    from core.instance_updater import InstanceUpdater
+
+def process_instance(updater: 'InstanceUpdater', defer_restart: bool = False):
+    '''Process a single instance, keeping its failures isolated and, in a worker, its log lines together.
+
+    Returns True if its Portainer is restarting and the instance must be resumed later.
+    '''
+    try:
+        return updater.run(defer_restart)
+    except Exception as e:
+        updater.report_unexpected_error(e)
+        return False
+    finally:
+        if isinstance(updater.logger, BufferedLogger):
+            updater.logger.flush()
+
+async def process_instances_async(instances: list, logger: BaseLogger, context: RunContext, workers: int, connections_per_host: int):
+    '''Process the instances on a single event loop, sharing one connection pool between them.'''
+    import asyncio
+    from core.async_instance_updater import AsyncInstanceUpdater
+    from core.async_portainer import create_connector
+
+    connector = create_connector(limit_per_host=connections_per_host)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run_updater(updater: AsyncInstanceUpdater, defer_restart: bool = False):
+        try:
+            return await updater.run(connector, defer_restart)
+        except Exception as e:
+            updater.report_unexpected_error(e)
+            return False
+        finally:
+            updater.logger.flush()
+
+    async def process(index: int, instance: 'InstanceConfig'):
+        updater = AsyncInstanceUpdater(index, instance, BufferedLogger(logger), context)
+        async with semaphore:
+            restarting = await run_updater(updater, defer_restart=True)
+        if restarting:
+            # The slot goes to the instances waiting for one while Portainer restarts
+            async with semaphore:
+                await run_updater(updater)
+
+    try:
+        await asyncio.gather(*(process(index, instance) for index, instance in instances))
+    finally:
+        await connector.close()
+
+def open_caches(cache_config: dict, logger: BaseLogger):
+    '''Open the status and discovery caches that are enabled in the configuration.'''
+    import sqlite3
+    from core.discovery_cache import DiscoveryCache
+    from core.status_cache import StatusCache
+
+    path = cache_config.get('path', os.path.join(os.getcwd(), 'stack-status-cache.db'))
+    status_cache = None
+    discovery_cache = None
+
+    try:
+        if cache_config.get('enabled', False):
+            status_cache = StatusCache(path, ttl=cache_config.get('ttl', 3600), max_entries=cache_config.get('maxEntries', 10000))
+        if cache_config.get('discoveryTtl', 0) > 0:
+            discovery_cache = DiscoveryCache(path, ttl=cache_config.get('discoveryTtl'))
+    except sqlite3.Error as e:
+        logger.log(f'Could not open the cache at {path}, continuing without it: {e}', level='WARNING')
+
+    return status_cache, discovery_cache
+
+def run(config: 'Config', logger: BaseLogger, args: argparse.Namespace, shard: Shard, report_path: str = None):
+    '''Process the instances of the configuration that belong to the shard, returning the metrics of the run.'''
+    if shard.count > 1:
+        config = replace(config, instances=tuple(shard.select(config.instances)))
+        logger.log(f'Shard {shard}: processing {len(config.instances)} instances.')
+
+    applied_plan = None
+    if args.apply:
+        try:
+            applied_plan = UpdatePlan.load(args.apply)
+        except (OSError, ValueError) as e:
+            logger.log(f'Could not read the plan {args.apply}: {e}', level='ERROR')
+            return None
+        logger.log(f'Applying the plan {args.apply} computed {applied_plan.age / 60:.0f} minutes ago.')
+
+    cache, discovery_cache = (None, None) if args.no_cache else open_caches(config.cache, logger)
+    metrics_config = config.metrics
+    # The daemon never finishes a run, it sends a summary each time an instance has been processed
+    events = EventCollector(per_instance=args.daemon or config.logging.get('summary', 'run').lower() == 'instance')
+    context = RunContext(cache=cache, discovery_cache=discovery_cache,
+                         metrics=Metrics(config.fingerprint, shard=str(shard) if shard.count > 1 else None, events=events),
+                         plan=UpdatePlan() if args.plan else None, applied_plan=applied_plan, events=events)
+
+    # Resolve image digests from the registries, each unique image once for the whole run
+    if config.registry_check.get('enabled', False):
+        from core.digest_resolver import DigestResolver
+        context.digest_resolver = DigestResolver.from_config(config.registry_check, metrics=context.metrics)
+
+    # Resolve the commit of each Git repository and reference once for the whole run
+    if config.git_check.get('enabled', False):
+        from core.git_resolver import GitResolver
+        context.git_resolver = GitResolver.from_config(config.git_check)
+
+    # The HTTP stack is only imported for runs that talk to Portainer, --help, --init-config and configuration errors return without it
+    from core.instance_updater import InstanceUpdater
+
+    try:
+        instances = [(instance.index, instance) for instance in config.instances]
+        workers = max(1, args.workers or config.max_workers)
+        engine = args.engine or config.engine
+
+        # Detection only reads from Portainer, every instance is planned at the same time
+        if args.plan and not args.workers:
+            workers = max(1, len(instances))
+
+        if args.daemon:
+            # Keep sessions and discovery warm, running each instance on its schedule
+            from core.daemon import Daemon
+            if engine == 'async':
+                logger.log('Daemon mode uses the threads engine, ignoring engine "async".', level='WARNING')
+            if metrics_config.get('prometheusPort'):
+                context.metrics.serve(metrics_config.get('prometheusPort'))
+                logger.log(f'Serving Prometheus metrics on port {metrics_config.get("prometheusPort")}.')
+            Daemon(config, logger, context, workers).run()
+            return context.metrics
+
+        if engine == 'async':
+            # Run the whole instance -> environment -> stack tree on one event loop
+            import asyncio
+            asyncio.run(process_instances_async(instances, logger, context, workers, config.connections_per_host))
+        elif workers == 1:
+            # Process each Portainer instance one after another
+            restarting = []
+            for index, instance in instances:
+                updater = InstanceUpdater(index, instance, logger, context)
+                if process_instance(updater, defer_restart=True):
+                    restarting.append(updater)
+
+            # Instances whose Portainer restarts after a self-update are finished once the others are done
+            for updater in restarting:
+                process_instance(updater)
+        else:
+            # Process the Portainer instances in parallel, each worker with its own session
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                updaters = {}
+                for index, instance in instances:
+                    updater = InstanceUpdater(index, instance, BufferedLogger(logger), context)
+                    updaters[executor.submit(process_instance, updater, True)] = updater
+
+                # An instance whose Portainer restarts goes back to the end of the queue instead of holding a worker
+                for future in as_completed(updaters):
+                    if future.result():
+                        executor.submit(process_instance, updaters[future])
+
+        logger.log('Processing completed for all Portainer instances.')
+
+        # One message for the whole run, the detail went to the console and the log file
+        summary = None if events.per_instance else events.summary()
+        if summary:
+            logger.notify(summary)
+
+        if context.plan:
+            try:
+                context.plan.write(args.plan)
+            except OSError as e:
+                logger.log(f'Could not write the plan to {args.plan}: {e}', level='ERROR')
+            else:
+                summary = context.plan.summary()
+                logger.log(f'Plan written to {args.plan}: {summary["outdated"]} outdated stacks, {summary["skipped"]} skipped stacks, '
+                           f'{summary["images"]} images to delete ({format_size(summary["reclaimable_bytes"])}), {summary["errors"]} errors.')
+    finally:
+        context.close()
+
+        if report_path:
+            try:
+                context.metrics.write_report(report_path)
+            except OSError as e:
+                logger.log(f'Could not write the run report to {report_path}: {e}', level='ERROR')
+
+    return context.metrics
+
+def run_shard(config_path: str, args: argparse.Namespace, shard: Shard):
+    '''Process one shard in a child process of --processes, returning its run report.
+
+    The detailed log lines go to the console, the parent sends a single summary through the configured logger.
+    '''
+    from logs.console_logger import ConsoleLogger
+
+    metrics = run(ReadConfigFile(config_path).load(), ConsoleLogger(), args, shard)
+    return metrics.report() if metrics else None
+
+def run_processes(config_path: str, logger: BaseLogger, args: argparse.Namespace, report_path: str = None):
+    '''Split the instances into --processes shards, each processed by its own Python process, and merge their reports.'''
+    from concurrent.futures import ProcessPoolExecutor
+
+    shards = [Shard(number, args.processes) for number in range(1, args.processes + 1)]
+    reports = []
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {shard: executor.submit(run_shard, config_path, args, shard) for shard in shards}
+        for shard, future in futures.items():
+            try:
+                report = future.result()
+            except Exception as e:
+                logger.log(f'Shard {shard} failed: {e}', level='ERROR')
+                continue
+            if report:
+                reports.append(report)
+
+    if reports:
+        finish_merged(merge_reports(reports), logger, report_path)
+
+def merge_report_files(paths: list[str], logger: BaseLogger, report_path: str = None):
+    '''Combine the run reports written by --shard runs, on one or several machines, into one summary.'''
+    reports = []
+    for path in paths:
+        try:
+            with open(path) as file:
+                reports.append(json.load(file))
+        except (OSError, ValueError) as e:
+            logger.log(f'Could not read the run report {path}: {e}', level='ERROR')
+
+    if reports:
+        finish_merged(merge_reports(reports), logger, report_path)
+
+def finish_merged(report: dict, logger: BaseLogger, report_path: str = None):
+    '''Write the merged report and send its summary as a single notification.'''
+    if report_path:
+        try:
+            with open(report_path, 'w') as file:
+                json.dump(report, file, indent=2)
+        except OSError as e:
+            logger.log(f'Could not write the run report to {report_path}: {e}', level='ERROR')
+    logger.notify(summarize_report(report))
 
 def main():
     parser = argparse.ArgumentParser(description='Portainer stack automatic update')
     parser.add_argument('--config', type=str, help='Path to config.yml file')
     parser.add_argument('--init-config', action='store_true', help='Generate default config.yml file')
+    parser.add_argument('--workers', type=int, help='Number of Portainer instances processed in parallel (overrides maxWorkers)')
+    parser.add_argument('--engine', choices=['threads', 'async'], help='Execution engine used to talk to Portainer (overrides engine)')
+    parser.add_argument('--daemon', action='store_true', help='Keep running and process each instance on its schedule')
+    parser.add_argument('--report', type=str, help='Write a JSON run report with timings and request metrics to this path')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the status and discovery caches for this run')
+    parser.add_argument('--shard', type=str, metavar='I/N', help='Only process the instances of shard I out of N, split by a hash of the instance name')
+    parser.add_argument('--processes', type=int, help='Split the instances into this many shards, each processed by its own process')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', type=str, metavar='PLAN_JSON', help='Only detect what would be updated and write the plan as JSON to this path')
+    mode.add_argument('--apply', type=str, metavar='PLAN_JSON', help='Redeploy the outdated stacks of a plan written by --plan, without checking the images again')
+    mode.add_argument('--merge-reports', type=str, nargs='+', metavar='REPORT_JSON', help='Combine the run reports of --shard runs and send one summary')
     args = parser.parse_args()
 
+    if args.daemon and (args.plan or args.apply or args.merge_reports):
+        parser.error('--plan, --apply and --merge-reports cannot be used with --daemon')
+
+    try:
+        shard = Shard.parse(args.shard) if args.shard else Shard()
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.processes is not None:
+        if args.processes < 1:
+            parser.error('--processes must be a positive integer')
+        if args.shard or args.daemon or args.plan or args.apply or args.merge_reports:
+            parser.error('--processes cannot be used with --shard, --daemon, --plan, --apply or --merge-reports')
+
     default_config_path = os.path.join(os.getcwd(), 'config.yml')
     config_path = args.config if args.config else default_config_path
 
     if args.init_config:
         init_config(config_path)
         return
-    
+
     try:
         config, logger = ReadConfigFile(config_path).read()
     except ReadConfigFileError as e:
         print(e)
         return
 
-    # Send initialization message
-    logger.log('Configuration file loaded successfully, starting processing.')
-    any_stack_updated = False
-
-    # Process each Portainer instance and perform actions
-    for index, instance in enumerate(config.get('instances', [])):
-        name = instance.get('name')
-        host = instance.get('host')
-        access_token = instance.get('accessToken')
-        verify_ssl = instance.get('verifySSL', False)
-        update_portainer = instance.get('updatePortainerVersion', False)
-        delete_unused_images_flag = instance.get('deleteUnusedImages', False)
-        prune_services = instance.get('pruneServices', False)
-        ignore_stack = instance.get('ignoreStacks', [])
-        update_stacks_with_git = instance.get('updateStacksWithGitIntegration', False)
-
-        if not all([name, host, access_token]):
-            logger.log(f'Instance {name} is missing required fields.' if name else
-                       f'Instance at index {index} is missing required fields.',
-                       level='ERROR')
-            continue
-
-        portainer = Portainer(url=host, access_token=access_token, verify_ssl=verify_ssl)
+    try:
+        if args.merge_reports:
+            merge_report_files(args.merge_reports, logger, args.report)
+            return
+
+        # Send initialization message
+        logger.log('Configuration file loaded successfully, starting processing.')
+        report_path = args.report or config.metrics.get('report')
 
-        try:
-            # Ping the Portainer instance
-            portainer.ping()
-            logger.log(f'Successfully connected to Portainer instance: [{name}]({host})')
-
-            # Check if Portainer needs an update
-            if update_portainer and portainer.check_if_portainer_needs_update():
-                logger.log(f'Portainer instance [{name}]({host}) needs an update.')
-                if portainer.update_portainer_version():
-                    logger.log(f'Portainer instance [{name}]({host}) updated successfully.')
-                else:
-                    logger.log(f'An error occurred while updating Portainer instance [{name}]({host}).', level='ERROR')
-
-                # Delay to make sure the update is applied
-                time.sleep(10)
-
-            # Get portainer environments
-            environments = portainer.get_environments()
-            logger.log(f'Retrieved {len(environments)} environments for Portainer instance [{name}]({host}).')
-
-            # Process each environment
-            for env in environments:
-                env_name = env.get('Name')
-                env_id = env.get('Id')
-
-                try:
-                    # Clear images status
-                    portainer.clear_images_status(env_id)
-                    logger.log(f'Cleared images status for environment [{env_name}] in Portainer instance [{name}]({host}).')
-
-                    # Get environment stacks
-                    stacks = portainer.get_environment_stacks(env_id)
-                    logger.log(f'Retrieved {len(stacks)} stacks for environment [{env_name}] in Portainer instance [{name}]({host}).')
-
-                    # Process each stack
-                    for stack in stacks:
-                        try:
-                            stack_name = stack.get('Name')
-
-                            # Check if the stack is ignored
-                            if stack_name in ignore_stack:
-                                logger.log(f'Ignoring stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}).')
-                                continue
-                            
-                            stack_id = stack.get('Id')
-
-                            # Check if the stack is from git integration and if it needs to be updated
-                            if stack.get('GitConfig') and not update_stacks_with_git:
-                                logger.log(f'Skipping stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) due to Git integration.')
-                                continue
-
-                            # Refresh the stack
-                            needs_update = portainer.refresh_stack_images(stack_id).lower()
-                            if needs_update in ('updated', 'skipped'):
-                                logger.log(f'Stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) is {needs_update}.')
-                                continue
-
-                            if stack.get('GitConfig'):
-                                logger.log(f'Updating stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}) with Git integration.')
-                                git_authentication = stack.get('GitConfig', {}).get('Authentication', {})
-                                repository_git_credential_id = git_authentication.get('GitCredentialID')
-                                repository_password = git_authentication.get('Password')
-                                repository_username = git_authentication.get('Username')
-
-                                repository_authentication = bool((repository_username and repository_password) or repository_git_credential_id)
-                                repository_reference_name = stack.get('GitConfig', {}).get('ReferenceName')
-                                env_vars = stack.get('Env', [])
-
-                                portainer.update_stack_with_git(
-                                    stack_id=stack_id,
-                                    environment_id=env_id,
-                                    repository_authentication=repository_authentication,
-                                    repository_git_credential_id=repository_git_credential_id,
-                                    repository_password=repository_password,
-                                    repository_reference_name=repository_reference_name,
-                                    repository_username=repository_username,
-                                    env=env_vars,
-                                    prune=prune_services )
-                                logger.log(f'Stack [{stack_name}] updated successfully in environment [{env_name}] of Portainer instance [{name}]({host}).')
-                                any_stack_updated = True
-                            else:
-                                logger.log(f'Updating stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host}).')
-                                webhook = stack.get('Webhook', '')
-                                stack_file_content = portainer.get_stack_file_content(stack_id)
-                                if not stack_file_content:
-                                    logger.log(f'Stack file content for stack [{stack_name}] in environment [{env_name}] of Portainer instance [{name}]({host})is empty.', level='ERROR')
-                                    continue
-                                env_vars = stack.get('Env', [])
-
-                                portainer.update_stack(
-                                    stack_id=stack_id,
-                                    environment_id=env_id,
-                                    env=env_vars,
-                                    stack_file_content=stack_file_content,
-                                    prune=prune_services,
-                                    webhook=webhook )
-                                logger.log(f'Stack [{stack_name}] updated successfully in environment [{env_name}] of Portainer instance [{name}]({host}).')
-                                any_stack_updated = True
-                        except PortainerError as e:
-                            logger.log(e, level='ERROR')
-                            continue    
-
-                    # Check if unused images should be deleted
-                    if delete_unused_images_flag and any_stack_updated:
-                        delete_unused_images(portainer=portainer, environment_id=env_id, environment_name=env_name, logger=logger, name=name, host=host)
-
-                    any_stack_updated = False  # Reset for the next environment
-                    logger.log(f'Finished processing environment [{env_name}] in Portainer instance [{name}]({host}).')
-
-                except PortainerError as e:
-                    logger.log(e, level='ERROR')
-                    continue    
-
-                logger.log(f'Finished processing Portainer instance [{name}]({host}).')
-
-        except PortainerError as e:
-            logger.log(e, level='ERROR')
-            continue
-
-    logger.log('Processing completed for all Portainer instances.')
+        if args.processes and args.processes > 1:
+            run_processes(config_path, logger, args, report_path)
+            return
+
+        run(config, logger, args, shard, report_path)
+    finally:
+        # Deliver any queued notification before exiting
+        logger.close()
 
 if __name__ == '__main__':
+    # Needed by the frozen executables, whose child processes start from the same binary
+    from multiprocessing import freeze_support
+    freeze_support()
     main()
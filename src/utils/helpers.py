@@ -1,8 +1,6 @@
 import sys
 import os
 import shutil
-from core.portainer import Portainer
-from logs.base_logger import BaseLogger
 
 def resource_path(relative_path):
     '''Get absolute path to resource, works in dev and compiled versions.'''
@@ -13,6 +11,14 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
+def format_size(size: int):
+    '''Format a number of bytes for log lines.'''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
 def init_config(target_path):
     '''Initialize the configuration file by copying the example configuration.'''
     example_path = resource_path(os.path.join('resources', 'example-config.yml'))
@@ -33,27 +39,3 @@ def init_config(target_path):
     # Copy the example configuration file to the target path    
     shutil.copyfile(example_path, target_path)
     print(f'Configuration file created at: {target_path}')
-
-def delete_unused_images(portainer: Portainer, logger: BaseLogger, environment_id: int, environment_name: str, name: str, host: str):
-    '''Function with logic to delete unused images in a specific environment.'''
-    logger.log(f'Deleting unused images in environment [{environment_name}] of Portainer instance [{name}]({host}).')
-    images = portainer.get_images_with_usage(environment_id)
-    
-    images_to_delete = [image for image in images if not image.get('used', True)]
-
-    if not images_to_delete:
-        logger.log(f'No unused images found in environment [{environment_name}] of Portainer instance [{name}]({host}).')
-        return
-    
-    for image in images_to_delete:
-        image_id = image.get('id')
-        image_tags = image.get('tags', [])
-        image_tag = image_tags[0] if image_tags else image_id
-
-        if not image_id:
-            logger.log(f'Image {image_tag} does not have a valid ID, skipping deletion.', level='WARNING')
-            continue
-
-        portainer.delete_image(environment_id, image_id)
-        logger.log(f'Deleted unused image {image_tag} in environment [{environment_name}] of Portainer instance [{name}]({host}).')
-    
\ No newline at end of file
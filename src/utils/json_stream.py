@@ -0,0 +1,161 @@
+import codecs
+import json
+import re
+
+# Text up to the next character that changes the nesting of the item being scanned, skipping whole strings, or the
+# quote of a string that does not end in the text, and the rest of a string
+TOKEN = re.compile(r'(?:"[^"\\]*(?:\\.[^"\\]*)*"|[^"\[\]{}])*([\[\]{}"])')
+STRING_REST = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+
+class JsonArrayStream:
+    '''Incremental parser of a top-level JSON array, fed with raw chunks and returning each complete item.
+
+    Only the text of the item being parsed is buffered, so memory depends on the largest item and not on the array.
+    Objects, arrays and strings are scanned once as their chunks arrive and decoded once complete, so an item spread
+    over many chunks costs time proportional to its size.
+    '''
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, fields: tuple = None):
+        self.fields = fields
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.started = False
+        self.expect_separator = False
+        self.done = False
+
+        # Chunks of an item still incomplete, joined once its end arrives, and where the scan of the item stands
+        self.pending = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk: bytes, final: bool = False):
+        '''Add a chunk of the response body and return the items it completed.'''
+        text = self.text_decoder.decode(chunk, final=final)
+        ready = None
+        if self.pending is not None:
+            end = self._scan(text, 0)
+            self.pending.append(text)
+            if end < 0:
+                if final:
+                    raise ValueError('Incomplete JSON array.')
+                return []
+            ready = sum(map(len, self.pending)) - len(text) + end
+            self.buffer, self.pending = ''.join(self.pending), None
+        else:
+            self.buffer += text
+
+        items = []
+        position = 0
+        length = len(self.buffer)
+
+        while not self.done:
+            while position < length and self.buffer[position] in ' \t\r\n':
+                position += 1
+            if position == length:
+                break
+
+            character = self.buffer[position]
+            if not self.started:
+                if character != '[':
+                    raise ValueError('Expected a JSON array.')
+                self.started = True
+                position += 1
+            elif character == ']':
+                self.done = True
+                position += 1
+            elif self.expect_separator:
+                if character != ',':
+                    raise ValueError(f'Expected "," or "]" in JSON array, found {character!r}.')
+                self.expect_separator = False
+                position += 1
+            else:
+                if ready is None and character in '{["':
+                    self.depth, self.in_string, self.escape = 0, False, False
+                    ready = self._scan(self.buffer, position)
+                    if ready < 0:
+                        # The item continues in the next chunks, they are kept apart until it is complete
+                        self.pending = [self.buffer[position:]]
+                        position = length
+                        break
+
+                try:
+                    item, end = self._decoder.raw_decode(self.buffer, position)
+                except json.JSONDecodeError:
+                    # A complete object, array or string that does not decode is invalid whatever comes next
+                    if final or ready is not None:
+                        raise
+                    # The number or literal continues in the next chunk
+                    break
+                ready = None
+                # A number at the end of the buffer may still have digits in the next chunk
+                if end == length and not final and not isinstance(item, (dict, list, str)):
+                    break
+
+                items.append(self._project(item))
+                self.expect_separator = True
+                position = end
+
+        self.buffer = self.buffer[position:]
+
+        if final and not self.done:
+            raise ValueError('Incomplete JSON array.')
+        return items
+
+    def _scan(self, text: str, index: int):
+        '''Continue scanning the current item, returning the index after its end or -1 if it ends in a later chunk.'''
+        length = len(text)
+        if self.escape:
+            if index >= length:
+                return -1
+            index += 1
+            self.escape = False
+        if self.in_string:
+            index = STRING_REST.match(text, index).end()
+            if index >= length:
+                return -1
+            if text[index] == '\\':
+                # The escaped character is in the next chunk
+                self.escape = True
+                return -1
+            index += 1
+            self.in_string = False
+            if self.depth <= 0:
+                return index
+
+        for match in TOKEN.finditer(text, index):
+            token = match.group(1)
+            if token == '"':
+                # A string left open by the pattern, at the end of the text or before it ends in a later chunk
+                self.in_string = True
+                return self._scan(text, match.end())
+            self.depth += 1 if token in '[{' else -1
+            if self.depth <= 0:
+                return match.end()
+        return -1
+
+    def close(self):
+        '''Signal the end of the body, returning the last items.'''
+        return self.feed(b'', final=True)
+
+    def _project(self, item):
+        if self.fields is None or not isinstance(item, dict):
+            return item
+        return {field: item[field] for field in self.fields if field in item}
+
+def iter_json_array(chunks, fields: tuple = None):
+    '''Yield the items of a JSON array read from an iterable of byte chunks, keeping only `fields` of each object.'''
+    stream = JsonArrayStream(fields)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+async def aiter_json_array(chunks, fields: tuple = None):
+    '''Asyncio version of iter_json_array, reading from an async iterable of byte chunks.'''
+    stream = JsonArrayStream(fields)
+    async for chunk in chunks:
+        for item in stream.feed(chunk):
+            yield item
+    for item in stream.close():
+        yield item
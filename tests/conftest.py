@@ -0,0 +1,39 @@
+import asyncio
+from core.async_instance_updater import AsyncInstanceUpdater
+from core.async_portainer import create_connector
+from core.instance_config import InstanceConfig
+from core.instance_updater import InstanceUpdater
+from core.run_context import RunContext
+from logs.base_logger import BaseLogger
+
+ENGINES = ['threads', 'async']
+
+class RecordingLogger(BaseLogger):
+    '''Keep the log lines as (level, message), summaries with the SUMMARY level.'''
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, message: str, level: str = 'INFO'):
+        self.messages.append((level, str(message)))
+
+    def notify(self, message: str, level: str = 'INFO'):
+        self.messages.append(('SUMMARY', message))
+
+def make_updater(engine: str, settings: dict, context: RunContext = None, logger: BaseLogger = None):
+    '''Build the updater of an engine for an instance given as configuration settings.'''
+    updater_class = InstanceUpdater if engine == 'threads' else AsyncInstanceUpdater
+    return updater_class(0, InstanceConfig.from_dict(0, settings), logger or RecordingLogger(), context or RunContext())
+
+def run_updater(updater: InstanceUpdater, defer_restart: bool = False):
+    '''Run an updater of either engine to completion, returning what its run returned.'''
+    if not isinstance(updater, AsyncInstanceUpdater):
+        return updater.run(defer_restart)
+
+    async def run():
+        connector = create_connector()
+        try:
+            return await updater.run(connector, defer_restart)
+        finally:
+            await connector.close()
+    return asyncio.run(run())
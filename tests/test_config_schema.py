@@ -0,0 +1,57 @@
+import pytest
+import yaml
+from core.config import Config
+from core.config_schema import validate_config
+from utils.helpers import resource_path
+
+def test_example_configuration_is_valid():
+    with open(resource_path('resources/example-config.yml')) as file:
+        assert validate_config(yaml.safe_load(file)) == []
+
+def test_unknown_keys_suggest_the_closest_one():
+    errors = validate_config({'maxWorker': 2, 'instances': [{'name': 'prod', 'ignoreStack': ['db']}], 'cache': {'enabeld': True}})
+
+    assert errors == [
+        'Unknown key "maxWorker", did you mean "maxWorkers"?',
+        'Unknown key "instances[0].ignoreStack", did you mean "ignoreStacks"?',
+        'Unknown key "cache.enabeld", did you mean "enabled"?',
+    ]
+    assert validate_config({'unrelated': 1}) == ['Unknown key "unrelated".']
+
+@pytest.mark.parametrize('config, error', [
+    ({'maxWorkers': 'two'}, '"maxWorkers" must be an integer.'),
+    ({'maxWorkers': True}, '"maxWorkers" must be an integer.'),
+    ({'cache': {'ttl': 'soon'}}, '"cache.ttl" must be an integer or a number.'),
+    ({'cache': []}, '"cache" must be a mapping.'),
+    ({'instances': {'name': 'prod'}}, '"instances" must be a list.'),
+    ({'instances': [{'ignoreStacks': 'db'}]}, '"instances[0].ignoreStacks" must be a list.'),
+    ({'instances': [{'stackGroups': [['db', 3]]}]}, '"instances[0].stackGroups[0][1]" must be a string.'),
+    ({'instances': [{'includeStacks': 'web'}]}, '"instances[0].includeStacks" must be a list or a mapping.'),
+    ({'instances': [{'includeStacks': {'prod-*': [1]}}]}, '"instances[0].includeStacks.prod-*[0]" must be a string.'),
+])
+def test_wrong_types_are_reported(config, error):
+    assert validate_config(config) == [error]
+
+def test_every_problem_is_listed():
+    errors = validate_config({'engine': 1, 'instances': [{'retries': 'many', 'verifySSl': True}, {'schedule': 1.5}]})
+
+    assert errors == [
+        '"engine" must be a string.',
+        '"instances[0].retries" must be an integer.',
+        'Unknown key "instances[0].verifySSl", did you mean "verifySSL"?',
+        '"instances[1].schedule" must be a string or an integer.',
+    ]
+
+def test_empty_values_fall_back_to_defaults():
+    assert validate_config({'maxWorkers': None, 'instances': [{'ignoreStacks': None}]}) == []
+
+def test_fingerprint_leaves_out_secrets():
+    def config(token: str, password: str, ttl: int = 300):
+        return Config.from_dict({
+            'registryCheck': {'ttl': ttl, 'registries': [{'host': 'ghcr.io', 'username': 'user', 'password': password}]},
+            'instances': [{'name': 'prod', 'host': 'https://portainer', 'accessToken': token}],
+        })
+
+    assert config('token', 'secret').fingerprint == config('other', 'changed').fingerprint
+    assert config('token', 'secret').fingerprint != config('token', 'secret', ttl=60).fingerprint
+    assert config('token', 'secret').registry_check['registries'][0]['password'] == 'secret'
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+from conftest import RecordingLogger
+from core.daemon import ScheduledInstance
+from core.instance_config import InstanceConfig
+from core.instance_updater import InstanceUpdater
+from core.run_context import RunContext
+from core.schedule import Schedule
+from logs.buffered_logger import BufferedLogger
+from logs.event_collector import EventCollector
+
+class BrokenUpdater(InstanceUpdater):
+    def _run(self, defer_restart: bool = False):
+        raise RuntimeError('boom')
+
+def test_unexpected_error_is_recorded_and_summarized():
+    logger = RecordingLogger()
+    instance_logger = BufferedLogger(logger)
+    events = EventCollector(per_instance=True)
+    updater = BrokenUpdater(0, InstanceConfig(0, name='broken', host='http://localhost', access_token='token'), instance_logger, RunContext(events=events))
+    scheduled = ScheduledInstance(updater, instance_logger, Schedule('15m'), timedelta(), datetime.now())
+
+    scheduled.run()
+
+    assert events.report()['failures'] == [{'instance': 'broken', 'environment': None, 'stack': None, 'error': 'unexpected error: boom'}]
+    assert ('ERROR', 'Unexpected error while processing instance at index 0: boom') in logger.messages
+    assert any(level == 'SUMMARY' and 'unexpected error: boom' in message for level, message in logger.messages)
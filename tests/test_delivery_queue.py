@@ -0,0 +1,58 @@
+import requests
+from logs.delivery_queue import DeliveryQueue
+
+class FakePlatform:
+    '''Record the posts of a DeliveryQueue, rejecting the formatted ones that contain unbalanced Markdown.'''
+
+    def __init__(self):
+        self.posts = []
+
+    def response(self, status: int):
+        response = requests.Response()
+        response.status_code = status
+        return response
+
+    def send(self, session, text: str):
+        self.posts.append(('markdown', text))
+        return self.response(400 if text.count('_') % 2 else 200)
+
+    def send_plain(self, session, text: str):
+        self.posts.append(('plain', text))
+        return self.response(200)
+
+def deliver(messages: list[str], max_length: int = 60, plain: bool = True):
+    platform = FakePlatform()
+    delivery = DeliveryQueue(platform.send, max_length=max_length, name='Test', linger=0.2,
+                             send_plain=platform.send_plain if plain else None)
+    for message in messages:
+        delivery.put(message)
+    delivery.close()
+    return platform.posts
+
+def test_batches_split_only_between_lines():
+    lines = [f'[INFO] Stack [stack-{i}](http://portainer/{i}) is up to date.' for i in range(6)]
+    posts = deliver(lines, max_length=120)
+
+    assert len(posts) > 1
+    assert all(len(text) <= 120 for _, text in posts)
+    assert [line for _, text in posts for line in text.split('\n')] == lines
+
+def test_a_long_line_is_cut_at_spaces_without_splitting_links():
+    line = 'Redeployed ' + ' '.join(f'[stack-{i}](http://portainer/stacks/{i})' for i in range(5))
+    posts = deliver([line], max_length=60)
+
+    assert all(len(text) <= 60 for _, text in posts)
+    assert ' '.join(text for _, text in posts) == line
+    assert all(text.count('[') == text.count('](') == text.count(')') for _, text in posts)
+
+def test_a_batch_with_unbalanced_markdown_is_sent_again_as_plain_text():
+    posts = deliver(['[INFO] Stack my_stack is outdated.', '[INFO] Stack web is up to date.'], max_length=200)
+
+    assert posts == [('markdown', '[INFO] Stack my_stack is outdated.\n[INFO] Stack web is up to date.'),
+                     ('plain', '[INFO] Stack my_stack is outdated.\n[INFO] Stack web is up to date.')]
+
+def test_platforms_without_plain_fallback_send_once(capsys):
+    posts = deliver(['[INFO] Stack my_stack is outdated.'], plain=False)
+
+    assert posts == [('markdown', '[INFO] Stack my_stack is outdated.')]
+    assert 'Failed to send Test log' in capsys.readouterr().out
@@ -0,0 +1,50 @@
+import pytest
+from core.digest_resolver import DigestResolver
+from core.image_reference import ImageReference
+from fake_registry import FakeRegistry, image_digest
+
+@pytest.fixture
+def registry():
+    fake = FakeRegistry(token_auth=True)
+    fake.start()
+    yield fake
+    fake.stop()
+
+def resolver_for(registry: FakeRegistry):
+    return DigestResolver.from_config({'registries': [{'host': registry.host, 'insecure': True}]})
+
+def test_resolves_a_digest_behind_a_token_challenge(registry):
+    resolver = resolver_for(registry)
+    try:
+        digest = resolver.resolve(ImageReference.parse(f'{registry.host}/team/app:1.0'))
+    finally:
+        resolver.close()
+
+    assert digest == image_digest('team/app')
+    # The first HEAD is challenged, the token is fetched and the HEAD sent again with it
+    assert registry.request_counts == {'HEAD /v2/{name}/manifests/{tag}': 2, 'GET /token': 1}
+
+def test_resolves_each_reference_once_and_reuses_the_token(registry):
+    resolver = resolver_for(registry)
+    reference = ImageReference.parse(f'{registry.host}/team/app:1.0')
+    try:
+        digests = {resolver.resolve(reference) for _ in range(3)}
+        other = resolver.resolve(ImageReference.parse(f'{registry.host}/team/app:2.0'))
+    finally:
+        resolver.close()
+
+    assert digests == {image_digest('team/app')} and other == image_digest('team/app')
+    # The second tag of the repository is sent with the token of the first one
+    assert registry.request_counts == {'HEAD /v2/{name}/manifests/{tag}': 3, 'GET /token': 1}
+
+def test_stack_status_compares_running_digests_with_the_registry(registry):
+    resolver = resolver_for(registry)
+    stack_file = f'services:\n  app:\n    image: {registry.host}/team/app:${{TAG}}\n'
+    env = [{'name': 'TAG', 'value': '1.0'}]
+    try:
+        updated = resolver.stack_status('web', stack_file, env, {('web', 'app'): [{image_digest('team/app')}]})
+        outdated = resolver.stack_status('web', stack_file, env, {('web', 'app'): [{image_digest('team/app', outdated=True)}]})
+    finally:
+        resolver.close()
+
+    assert (updated, outdated) == ('updated', 'outdated')
@@ -0,0 +1,51 @@
+from conftest import make_updater
+from core.discovery_cache import DiscoveryCache
+
+AUTHENTICATION = {'Username': 'deploy', 'Password': 's3cret'}
+
+def stacks():
+    return [
+        {'Id': 1, 'Name': 'web', 'EndpointId': 1, 'Type': 2, 'Env': [{'name': 'TOKEN', 'value': 'hidden'}]},
+        {'Id': 2, 'Name': 'private', 'EndpointId': 1, 'Type': 2, 'GitConfig': {
+            'URL': 'https://git.local/private.git', 'ReferenceName': 'refs/heads/main', 'ConfigHash': 'abc', 'Authentication': AUTHENTICATION}},
+        {'Id': 3, 'Name': 'public', 'EndpointId': 1, 'Type': 2, 'GitConfig': {
+            'URL': 'https://git.local/public.git', 'ReferenceName': 'refs/heads/main', 'ConfigHash': 'def', 'Authentication': None}},
+    ]
+
+def test_listing_is_reused_until_the_ttl(tmp_path):
+    cache = DiscoveryCache(str(tmp_path / 'cache.db'), ttl=60)
+    cache.set_stacks('https://portainer', 1, stacks())
+
+    assert [stack['Name'] for stack in cache.get_stacks('https://portainer', 1)] == ['web', 'private', 'public']
+    assert cache.get_stacks('https://portainer', 2) is None
+    assert cache.get_stacks('https://other', 1) is None
+
+    cache.ttl = 0
+    assert cache.get_stacks('https://portainer', 1) is None
+    cache.close()
+
+def test_credentials_stay_in_memory(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DiscoveryCache(path)
+    cache.set_stacks('https://portainer', 1, stacks())
+    assert cache.get_stacks('https://portainer', 1)[1]['GitConfig']['Authentication'] == AUTHENTICATION
+    cache.close()
+
+    with open(path, 'rb') as file:
+        content = file.read()
+    assert b's3cret' not in content and b'hidden' not in content
+
+    # A later run only knows that the stack needs credentials
+    cached = DiscoveryCache(path).get_stacks('https://portainer', 1)
+    assert cached[1]['GitConfig'] == {'URL': 'https://git.local/private.git', 'ReferenceName': 'refs/heads/main',
+                                      'ConfigFilePath': None, 'ConfigHash': 'abc', 'Authenticated': True}
+    assert cached[2]['GitConfig']['Authenticated'] is False
+
+def test_git_check_skips_cached_stacks_without_their_credentials(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    DiscoveryCache(path).set_stacks('https://portainer', 1, stacks())
+    cached = DiscoveryCache(path).get_stacks('https://portainer', 1)
+
+    updater = make_updater('threads', {'name': 'test', 'host': 'https://portainer', 'accessToken': 'token'})
+    assert [stack['Name'] for stack in updater._git_candidates('env-1', cached)] == ['public']
+    assert [stack['Name'] for stack in updater._git_candidates('env-1', stacks())] == ['private', 'public']
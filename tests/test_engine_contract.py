@@ -0,0 +1,113 @@
+import pytest
+from conftest import ENGINES, make_updater, run_updater
+from core.run_context import RunContext
+from core.update_plan import UpdatePlan
+from fake_portainer import FakePortainer
+from logs.event_collector import EventCollector
+
+# Calls that change something on Portainer
+WRITE_METHODS = ('PUT', 'POST', 'DELETE')
+
+def instance_settings(url: str):
+    return {
+        'name': 'contract',
+        'host': url,
+        'accessToken': 'token',
+        'deleteUnusedImages': True,
+        'refreshConcurrency': 3,
+        'redeployConcurrency': 2,
+        'healthCheckTimeout': 5,
+        'ignoreStacks': ['stack-1-0'],
+        'stackGroups': [['stack-1-1', 'stack-1-2', 'stack-1-3']],
+        'retries': 0,
+    }
+
+def start_fake():
+    fake = FakePortainer(environments=3, stacks=12, outdated_ratio=0.4, unused_images=3, seed=7)
+    # One environment is down and must not be called
+    fake.environments[2]['Status'] = 2
+    fake.start()
+    return fake
+
+def run_engine(engine: str, fake: FakePortainer, plan: UpdatePlan = None, applied_plan: UpdatePlan = None):
+    '''Process the fake instance with one engine, returning what it changed and the events it recorded.'''
+    events = EventCollector()
+    run_updater(make_updater(engine, instance_settings(fake.url), RunContext(events=events, plan=plan, applied_plan=applied_plan)))
+
+    writes = {endpoint: count for endpoint, count in fake.request_counts.items() if endpoint.split()[0] in WRITE_METHODS}
+    outcomes = sorted((event.action, event.environment, event.stack, event.reason, event.count, event.size) for event in events.events)
+    redeployed = sorted(stack['Name'] for stack in fake.stacks.values() if stack['UpdateDate'] != 1700000000)
+    return writes, outcomes, redeployed
+
+def planned(plan: UpdatePlan):
+    '''The plan without what differs between two fake servers, the host and the fingerprint of settings naming it.'''
+    return [{**instance, 'host': None, 'config_fingerprint': None} for instance in plan.to_dict()['instances']]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_redeploys_skips_and_cleans_up(engine):
+    fake = start_fake()
+    # Every outdated stack but the ignored one and the ones of the offline environment
+    outdated = sorted(stack['Name'] for stack in fake.stacks.values() if stack['outdated'] and stack['EndpointId'] != 3 and stack['Name'] != 'stack-1-0')
+    try:
+        writes, outcomes, redeployed = run_engine(engine, fake)
+    finally:
+        fake.stop()
+
+    assert outdated and redeployed == outdated
+    assert writes.get('PUT /api/stacks/{id}') == len(outdated)
+    assert ('skipped', 'env-1', 'stack-1-0', 'ignored', 1, 0) in outcomes
+    assert ('offline', 'env-3', None, None, 1, 0) in outcomes
+    assert sorted(stack for action, _, stack, _, _, _ in outcomes if action == 'updated') == outdated
+    assert sum(1 for event in outcomes if event[0] == 'images_deleted') == 2
+
+def test_engines_have_the_same_outcomes():
+    results = {}
+    for engine in ENGINES:
+        fake = start_fake()
+        try:
+            results[engine] = run_engine(engine, fake)
+        finally:
+            fake.stop()
+
+    writes, outcomes, redeployed = results['threads']
+    assert redeployed
+    assert any(action == 'images_deleted' and count for action, _, _, _, count, _ in outcomes)
+    assert results['async'] == results['threads']
+
+def test_engines_plan_and_apply_the_same_stacks():
+    plans, applied = {}, {}
+    for engine in ENGINES:
+        fake = start_fake()
+        try:
+            plan = UpdatePlan()
+            _, plan_outcomes, plan_redeployed = run_engine(engine, fake, plan=plan)
+            assert not plan_redeployed
+            plans[engine] = (planned(plan), plan_outcomes)
+
+            # Apply the plan of this engine on the same server, which did not change since
+            fake.request_counts.clear()
+            applied[engine] = run_engine(engine, fake, applied_plan=UpdatePlan(instances=plan.to_dict()['instances']))
+        finally:
+            fake.stop()
+
+    assert plans['async'] == plans['threads']
+    assert applied['async'] == applied['threads']
+    writes, _, redeployed = applied['threads']
+    assert redeployed and writes.get('PUT /api/stacks/{id}') == len(redeployed)
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_apply_skips_a_stack_deleted_since_the_plan(engine):
+    fake = start_fake()
+    try:
+        plan = UpdatePlan()
+        run_engine(engine, fake, plan=plan)
+        planned_stacks = [stack for environment in plan.to_dict()['instances'][0]['environments'] for stack in environment['outdated']]
+        deleted = planned_stacks[0]
+        del fake.stacks[deleted['id']]
+
+        _, outcomes, redeployed = run_engine(engine, fake, applied_plan=UpdatePlan(instances=plan.to_dict()['instances']))
+    finally:
+        fake.stop()
+
+    assert ('skipped', 'env-1', deleted['name'], 'no longer exists', 1, 0) in outcomes
+    assert redeployed == sorted(stack['name'] for stack in planned_stacks[1:])
@@ -0,0 +1,106 @@
+import pytest
+from conftest import ENGINES, RecordingLogger, make_updater, run_updater
+from core.run_context import RunContext
+from fake_portainer import FakePortainer
+from logs.event import Event
+from logs.event_collector import MAX_LISTED_FAILURES, EventCollector
+from logs.summary_logger import SummaryLogger
+
+def collect(events: list[Event], per_instance: bool = False):
+    collector = EventCollector(per_instance)
+    for event in events:
+        collector.record(event)
+    return collector
+
+def test_outcome_totals():
+    collector = collect([
+        Event('a', 'updated', 'prod', 'web', duration=2.0), Event('a', 'current', 'prod', 'db'), Event('a', 'current', 'prod', 'cache'),
+        Event('b', 'skipped', 'dev', 'api', reason='excluded'), Event('b', 'failed', 'dev', 'worker', error='HTTP 500'),
+        Event('b', 'offline', 'edge'), Event('b', 'images_deleted', 'dev', count=3, size=3 * 1024 * 1024),
+    ])
+    lines = collector.summary().split('\n')
+
+    assert lines[0].startswith('Run summary: 2 instances, 3 environments, 5 stacks in ')
+    assert lines[1] == 'Stacks: 1 updated, 2 up to date, 1 skipped, 1 failed.'
+    assert 'Offline environments: [b] [edge].' in lines
+    assert 'Deleted 3 unused images, reclaiming up to 3.0 MB.' in lines
+    assert collector.report() == {
+        'outcomes': {'current': 2, 'failed': 1, 'images_deleted': 3, 'offline': 1, 'skipped': 1, 'updated': 1},
+        'failures': [{'instance': 'b', 'environment': 'dev', 'stack': 'worker', 'error': 'HTTP 500'}],
+    }
+
+def test_skip_reasons_are_grouped_most_frequent_first():
+    collector = collect([Event('a', 'skipped', 'prod', f'stack-{i}', reason=reason)
+                         for i, reason in enumerate(['excluded', 'not running', 'excluded', 'excluded', 'not running', 'no image'])])
+    assert 'Skipped: excluded 3, not running 2, no image 1.' in collector.summary().split('\n')
+
+def test_slowest_redeploy_is_named():
+    collector = collect([Event('a', 'updated', 'prod', 'web', duration=1.5), Event('a', 'updated', 'prod', 'db', duration=4.0),
+                         Event('a', 'updated', 'dev', 'api', duration=0.5)])
+    assert 'Redeploys took 6.0s, the slowest was [a] [prod] [db] (4.0s).' in collector.summary().split('\n')
+    # Per-instance summaries leave out the instance
+    assert 'Redeploys took 6.0s, the slowest was [prod] [db] (4.0s).' in collector.summary('a').split('\n')
+
+def test_failures_are_listed_up_to_the_limit():
+    collector = collect([Event('a', 'failed', 'prod', f'stack-{i}', error=f'error {i}') for i in range(MAX_LISTED_FAILURES + 3)])
+    lines = collector.summary().split('\n')
+
+    listed = lines[lines.index('Failures:') + 1:]
+    assert listed[:MAX_LISTED_FAILURES] == [f'- [a] [prod] [stack-{i}]: error {i}' for i in range(MAX_LISTED_FAILURES)]
+    assert listed[MAX_LISTED_FAILURES:] == ['- and 3 more, see the detailed log.']
+    assert len(collector.report()['failures']) == MAX_LISTED_FAILURES + 3
+
+def test_instance_summary_drains_only_its_events():
+    collector = collect([Event('a', 'updated', 'prod', 'web', duration=1.0), Event('b', 'current', 'prod', 'web')], per_instance=True)
+
+    summary = collector.summary('a', drain=True)
+    assert summary.split('\n')[:2] == ['Summary of Portainer instance [a]: 1 environments, 1 stacks.', 'Stacks: 1 updated.']
+    assert collector.summary('a') is None
+    assert collector.summary('b') is not None
+    # The run report keeps the totals of drained instances
+    assert collector.report()['outcomes'] == {'current': 1, 'updated': 1}
+
+def test_empty_summary():
+    assert EventCollector().summary() is None
+
+def run_instances(engine: str, per_instance: bool):
+    fake = FakePortainer(environments=2, stacks=3, outdated_ratio=0.5)
+    fake.start()
+    logger = RecordingLogger()
+    events = EventCollector(per_instance)
+    try:
+        for name in ('first', 'second'):
+            settings = {'name': name, 'host': fake.url, 'accessToken': 'token', 'retries': 0}
+            run_updater(make_updater(engine, settings, RunContext(events=events), logger))
+    finally:
+        fake.stop()
+    return logger, events
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_instance_mode_sends_a_summary_per_instance(engine):
+    logger, events = run_instances(engine, per_instance=True)
+
+    summaries = [message for level, message in logger.messages if level == 'SUMMARY']
+    assert [summary.split('\n')[0] for summary in summaries] == [
+        'Summary of Portainer instance [first]: 2 environments, 6 stacks.',
+        'Summary of Portainer instance [second]: 2 environments, 6 stacks.',
+    ]
+    assert events.summary() is None
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_run_mode_sends_one_summary(engine):
+    logger, events = run_instances(engine, per_instance=False)
+
+    assert not any(level == 'SUMMARY' for level, _ in logger.messages)
+    assert events.summary().split('\n')[0].startswith('Run summary: 2 instances, 4 environments, 12 stacks in ')
+    assert sum(events.report()['outcomes'].values()) == 12
+
+def test_summary_logger_sends_only_summaries_to_the_channel():
+    detail, channel = RecordingLogger(), RecordingLogger()
+    logger = SummaryLogger([detail], channel)
+
+    logger.log('Stack [web] is up to date.')
+    logger.notify('Run summary: 1 instances.')
+
+    assert detail.messages == [('INFO', 'Stack [web] is up to date.'), ('INFO', 'Run summary: 1 instances.')]
+    assert channel.messages == [('INFO', 'Run summary: 1 instances.')]
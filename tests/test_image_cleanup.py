@@ -0,0 +1,88 @@
+import pytest
+from conftest import ENGINES, RecordingLogger, make_updater, run_updater
+from core.run_context import RunContext
+from fake_portainer import FakePortainer
+from logs.event_collector import EventCollector
+
+MB = 1024 * 1024
+
+def image(number: int, tag: str, size: int, created: int = 0, used: bool = False):
+    return {'id': f'sha256:{number:064x}', 'tags': [tag], 'used': used, 'size': size * MB, 'created': 1700000000 + created}
+
+class CleanupPortainer(FakePortainer):
+    '''Record the images deleted in order, refusing to delete the ones still referenced by another image.'''
+
+    def __init__(self, images: list[dict], referenced: tuple = ()):
+        super().__init__(environments=1, stacks=1, outdated_ratio=0)
+        self.images = {1: images}
+        self.referenced = {f'sha256:{number:064x}' for number in referenced}
+        self.deleted = []
+
+    def handle(self, method: str, raw_path: str, body: bytes):
+        if method == 'DELETE' and '/docker/images/' in raw_path:
+            image_id = raw_path.split('/docker/images/')[1].split('?')[0]
+            if image_id in self.referenced:
+                return 409, {'message': f'conflict: unable to delete {image_id[7:19]} (cannot be forced) - image has dependent child images'}
+            self.deleted.append(int(image_id[7:], 16))
+        return super().handle(method, raw_path, body)
+
+def clean(engine: str, fake: CleanupPortainer, **cleanup):
+    '''Run the instance with the cleanup of every environment enabled, returning the log lines and events.'''
+    fake.start()
+    logger = RecordingLogger()
+    events = EventCollector()
+    settings = {'name': 'cleanup', 'host': fake.url, 'accessToken': 'token', 'deleteUnusedImages': True,
+                'imageCleanup': {'always': True, 'concurrency': 1, **cleanup}}
+    try:
+        run_updater(make_updater(engine, settings, RunContext(events=events), logger))
+    finally:
+        fake.stop()
+    return logger.messages, events.report()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_keep_last_tags_keeps_the_newest_images_of_each_repository(engine):
+    fake = CleanupPortainer([
+        image(1, 'web:1', 10, created=1), image(2, 'web:2', 10, created=2), image(3, 'web:3', 10, created=3),
+        image(4, 'registry.local:5000/api:1', 10, created=1), image(5, 'registry.local:5000/api:2', 10, created=2, used=True),
+    ])
+    clean(engine, fake, keepLastTags=1)
+
+    # The newest image of a repository is kept even when unused, a used one counts as its newest
+    assert sorted(fake.deleted) == [1, 2, 4]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_reclaim_target_deletes_the_largest_images_first_and_stops(engine):
+    fake = CleanupPortainer([image(1, 'a:1', 10), image(2, 'b:1', 30), image(3, 'c:1', 20), image(4, 'd:1', 50, used=True)])
+    _, report = clean(engine, fake, reclaimTarget='40MB')
+
+    assert fake.deleted == [2, 3]
+    assert report['outcomes'].get('images_deleted') == 2
+
+def test_dry_run_sends_no_delete():
+    fake = CleanupPortainer([image(1, 'a:1', 10), image(2, 'b:1', 30), image(3, 'c:1', 20, used=True)])
+    messages, _ = clean('threads', fake, dryRun=True, prune=True)
+
+    assert fake.deleted == []
+    assert not any(endpoint.startswith('DELETE') or 'prune' in endpoint for endpoint in fake.request_counts)
+    assert any('Dry run: 2 unused images would reclaim up to 40.0 MB' in message for _, message in messages)
+
+@pytest.mark.parametrize('policy', [{'keepLastTags': 1}, {'reclaimTarget': '1GB'}, {'dryRun': True}])
+def test_prune_is_only_used_without_other_options(policy):
+    fake = CleanupPortainer([image(1, 'a:1', 10), image(2, 'a:2', 30, created=1)])
+    clean('threads', fake, prune=True, **policy)
+    assert not any('prune' in endpoint for endpoint in fake.request_counts)
+
+    fake = CleanupPortainer([image(1, 'a:1', 10), image(2, 'a:2', 30, created=1)])
+    clean('threads', fake, prune=True)
+    assert fake.request_counts.get('POST /api/endpoints/{id}/docker/images/prune') == 1
+    assert fake.deleted == []
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_a_failed_delete_does_not_stop_the_others(engine):
+    fake = CleanupPortainer([image(1, 'a:1', 10), image(2, 'b:1', 30), image(3, 'c:1', 20)], referenced=(2,))
+    messages, report = clean(engine, fake)
+
+    assert fake.deleted == [3, 1]
+    assert any(level == 'WARNING' and f'Failed to delete image sha256:{2:064x}' in message for level, message in messages)
+    assert any('Deleted 2 unused images, reclaiming up to 30.0 MB' in message for _, message in messages)
+    assert report['failures'] == []
@@ -0,0 +1,39 @@
+import time
+import pytest
+from conftest import ENGINES, make_updater, run_updater
+from core.run_context import RunContext
+from fake_portainer import FakePortainer
+from logs.event_collector import EventCollector
+
+def run_engine(engine: str, fake: FakePortainer, **settings):
+    '''Process the fake instance with a 1 second budget, returning the seconds it took and the recorded events.'''
+    events = EventCollector()
+    updater = make_updater(engine, {'name': 'slow', 'host': fake.url, 'accessToken': 'token', 'instanceTimeout': 1, **settings},
+                           RunContext(events=events))
+    started = time.monotonic()
+    run_updater(updater)
+    return time.monotonic() - started, events.report()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_budget_cuts_off_a_slow_redeploy(engine):
+    fake = FakePortainer(environments=1, stacks=2, outdated_ratio=1, redeploy_latency=10)
+    fake.start()
+    try:
+        elapsed, report = run_engine(engine, fake)
+    finally:
+        fake.stop()
+
+    assert elapsed < 3
+    assert report['outcomes'].get('failed')
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_budget_stops_the_retries(engine):
+    fake = FakePortainer(environments=1, stacks=2, error_rate=1)
+    fake.start()
+    try:
+        elapsed, report = run_engine(engine, fake, retries=5, retryBackoff=10)
+    finally:
+        fake.stop()
+
+    assert elapsed < 3
+    assert report['outcomes'].get('failed')
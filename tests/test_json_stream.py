@@ -0,0 +1,62 @@
+import json
+import time
+import pytest
+from utils.json_stream import JsonArrayStream, iter_json_array
+
+ITEMS = [
+    {'Id': 1, 'Name': 'web', 'Env': [{'name': 'A', 'value': '1'}]},
+    {'Id': 2, 'Name': 'db [primary] {main}', 'Labels': {'quote': 'say "hi"', 'path': 'C:\\stacks\\'}},
+    [1, 2.5, -3e2, True, None],
+    'plain string with ] and }',
+    42,
+    {'Name': 'unicode é ✓'},
+]
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 100000])
+def test_items_split_across_chunk_boundaries(size):
+    data = json.dumps(ITEMS).encode()
+    assert list(iter_json_array(chunked(data, size))) == ITEMS
+
+def test_strings_with_brackets_and_escaped_quotes():
+    items = [{'a': '}]"\\', 'b': '\\"[{'}, '\\', '"']
+    data = json.dumps(items).encode()
+    # Every split point, including between a backslash and the character it escapes
+    for split in range(1, len(data)):
+        assert list(iter_json_array([data[:split], data[split:]])) == items
+
+def test_empty_array():
+    assert list(iter_json_array([b' [ ', b' ] '])) == []
+    assert list(iter_json_array([b'[]'])) == []
+
+@pytest.mark.parametrize('data', [b'[{"Id": 1}, {"Id": 2', b'[{"Id": 1}, "open', b'[1, 2', b'[{"Id": 1},', b''])
+def test_truncated_input_is_rejected(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunked(data, 4)))
+
+@pytest.mark.parametrize('data', [b'{"Id": 1}', b'[{"Id": 1} {"Id": 2}]', b'[{"Id": 1, }]'])
+def test_invalid_input_is_rejected(data):
+    with pytest.raises(ValueError):
+        list(iter_json_array([data]))
+
+def test_fields_are_projected():
+    data = json.dumps(ITEMS[:2]).encode()
+    assert list(iter_json_array(chunked(data, 5), fields=('Id',))) == [{'Id': 1}, {'Id': 2}]
+
+def test_a_large_item_is_decoded_once(monkeypatch):
+    item = {'Images': [{'Id': f'sha256:{i:064x}', 'RepoTags': [f'app:{i}'], 'Labels': {'a': '[{"'}} for i in range(40000)]}
+    data = json.dumps([item, {'Id': 2}]).encode()
+    assert len(data) > 5 * 1024 * 1024
+
+    calls = []
+    decode = JsonArrayStream._decoder.raw_decode
+    monkeypatch.setattr(JsonArrayStream, '_decoder', type('Decoder', (), {
+        'raw_decode': staticmethod(lambda text, position: calls.append(position) or decode(text, position))})())
+
+    started = time.monotonic()
+    assert list(iter_json_array(chunked(data, 64 * 1024))) == [item, {'Id': 2}]
+    assert len(calls) == 2
+    # Linear in the size of the item, re-parsing it on every chunk took seconds
+    assert time.monotonic() - started < 2
@@ -0,0 +1,24 @@
+from core.metrics import Metrics, merge_reports, summarize_report
+
+def run_report(instance: str = 'prod', registry: str = 'ghcr.io', shard: str = None):
+    '''A report of one Portainer call and one registry lookup.'''
+    metrics = Metrics(shard=shard)
+    with metrics.phase(instance, 'discovery'):
+        metrics.observe_request(instance, 'GET /api/endpoints', 0.1, retries=1)
+    metrics.observe_request(f'registry:{registry}', 'HEAD /v2/{name}/manifests/{tag}', 0.2, error=True)
+    return metrics.report()
+
+def test_registry_requests_are_not_counted_as_instances():
+    lines = summarize_report(run_report()).split('\n')
+
+    assert lines[0].endswith(': 1 instances, 1 Portainer requests, 0 failed, 1 retried.')
+    assert 'Registries: 1 requests to 1 registries, 1 failed.' in lines
+    assert not any(line.startswith('Failed requests') for line in lines)
+
+def test_merged_shards_count_registry_requests_apart():
+    merged = merge_reports([run_report('prod', shard='1/2'), run_report('staging', 'docker.io', shard='2/2')])
+
+    assert [(shard['instances'], shard['requests'], shard['errors'], shard['registry_requests']) for shard in merged['shards']] == [(1, 1, 0, 1), (1, 1, 0, 1)]
+    lines = summarize_report(merged).split('\n')
+    assert lines[0].endswith(': 2 instances, 2 Portainer requests, 0 failed, 2 retried.')
+    assert 'Registries: 2 requests to 2 registries, 2 failed.' in lines
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, ReadTimeoutError
+from core.async_portainer import AsyncPortainer, create_connector
+from core.portainer import Portainer
+from core.request_policy import RequestPolicy
+from errors.portainer_error import PortainerError
+from fake_portainer import FakePortainer
+
+class GatewayTimeoutPortainer(FakePortainer):
+    '''Answers every redeploy with a 504, as a proxy does while Portainer is still pulling the images.'''
+
+    def handle(self, method: str, raw_path: str, body: bytes):
+        status, payload = super().handle(method, raw_path, body)
+        return (504, {'message': 'Gateway Timeout'}) if method == 'PUT' else (status, payload)
+
+class FlakyPortainer(FakePortainer):
+    '''Answers the first environment listing with a 502.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures_left = 1
+
+    def handle(self, method: str, raw_path: str, body: bytes):
+        status, payload = super().handle(method, raw_path, body)
+        if raw_path.startswith('/api/endpoints') and self.failures_left:
+            self.failures_left -= 1
+            return 502, {'message': 'Bad Gateway'}
+        return status, payload
+
+def test_retry_delay_rules():
+    policy = RequestPolicy(retries=2)
+    assert policy.retry_delay('GET', 1, 504) is not None
+    assert policy.retry_delay('GET', 1) is not None
+    assert policy.retry_delay('GET', 3, 502) is None
+    assert policy.retry_delay('PUT', 1, 502) is not None
+    assert policy.retry_delay('PUT', 1, 503) is not None
+    assert policy.retry_delay('PUT', 1, 504) is None
+    assert policy.retry_delay('PUT', 1, sent=False) is not None
+    assert policy.retry_delay('PUT', 1) is None
+    assert policy.retry_delay('POST', 1, 502) is None
+    assert policy.retry_delay('POST', 1, sent=False) is not None
+    assert policy.retry_delay('GET', 1, 502, remaining=0) is None
+
+def test_urllib3_retry_rules():
+    retry = RequestPolicy(retries=2).urllib3_retry()
+    assert retry.is_retry('GET', 504)
+    assert retry.is_retry('PUT', 502) and retry.is_retry('PUT', 503)
+    assert not retry.is_retry('PUT', 504)
+    assert not retry.is_retry('POST', 502)
+
+    # A read timeout is retried for a GET, never for a redeploy, while a failed connection is retried for both
+    read_error = ReadTimeoutError(None, '/api/stacks/1', 'Read timed out.')
+    assert retry.increment('GET', '/api/stacks/1', error=read_error).total == 1
+    with pytest.raises(ReadTimeoutError):
+        retry.increment('PUT', '/api/stacks/1', error=read_error)
+    assert retry.increment('PUT', '/api/stacks/1', error=ConnectTimeoutError()).total == 1
+
+def test_urllib3_retry_stops_at_the_budget():
+    # The first retry is sent right away, the second one would wait more than the second left
+    retry = RequestPolicy(retries=5, backoff_factor=10).urllib3_retry(budget=lambda: 1)
+    retry = retry.increment('GET', '/api', error=ConnectTimeoutError())
+    with pytest.raises(MaxRetryError):
+        retry.increment('GET', '/api', error=ConnectTimeoutError())
+
+@pytest.mark.parametrize('engine', ['threads', 'async'])
+def test_redeploy_is_not_sent_again_after_a_gateway_timeout(engine):
+    fake = GatewayTimeoutPortainer(environments=1, stacks=1)
+    fake.start()
+    policy = RequestPolicy(retries=3, backoff_factor=0)
+    arguments = dict(stack_id=100000, environment_id=1, env=[], stack_file_content='services: {}', prune=False, webhook='')
+    try:
+        with pytest.raises(PortainerError):
+            if engine == 'threads':
+                Portainer(fake.url, 'token', policy=policy).update_stack(**arguments)
+            else:
+                async def redeploy():
+                    connector = create_connector()
+                    try:
+                        async with AsyncPortainer(fake.url, 'token', connector, policy=policy) as portainer:
+                            await portainer.update_stack(**arguments)
+                    finally:
+                        await connector.close()
+                asyncio.run(redeploy())
+    finally:
+        fake.stop()
+
+    assert fake.request_counts == {'PUT /api/stacks/{id}': 1}
+
+@pytest.mark.parametrize('engine', ['threads', 'async'])
+def test_half_open_trial_call_keeps_its_retries(engine):
+    fake = FlakyPortainer(environments=1, stacks=1)
+    fake.start()
+    policy = RequestPolicy(retries=2, backoff_factor=0, failure_threshold=1, reset_timeout=0)
+    try:
+        if engine == 'threads':
+            portainer = Portainer(fake.url, 'token', policy=policy)
+            # Opened by an earlier failure, the next call is the half-open trial
+            portainer.breaker.record_failure()
+            environments = portainer.get_environments()
+            breaker = portainer.breaker
+        else:
+            async def list_environments():
+                connector = create_connector()
+                try:
+                    async with AsyncPortainer(fake.url, 'token', connector, policy=policy) as portainer:
+                        portainer.breaker.record_failure()
+                        return await portainer.get_environments(), portainer.breaker
+                finally:
+                    await connector.close()
+            environments, breaker = asyncio.run(list_environments())
+    finally:
+        fake.stop()
+
+    assert [environment['Name'] for environment in environments] == ['env-1']
+    assert fake.request_counts['GET /api/endpoints'] == 2
+    assert breaker.opened_at is None and breaker.failures == 0
@@ -0,0 +1,40 @@
+from datetime import datetime
+import pytest
+from core.schedule import Schedule
+from errors.schedule_error import ScheduleError
+
+# A Sunday
+NOW = datetime(2026, 10, 18, 12, 0)
+
+def test_interval():
+    assert Schedule('15m').next_run(NOW) == datetime(2026, 10, 18, 12, 15)
+    assert Schedule(90).next_run(NOW) == datetime(2026, 10, 18, 12, 1, 30)
+
+def test_restricted_day_fields_match_either_day():
+    assert Schedule('0 9 1 * 1').next_run(NOW) == datetime(2026, 10, 19, 9, 0)
+    assert Schedule('0 9 1 * 3').next_run(NOW) == datetime(2026, 10, 21, 9, 0)
+
+def test_wildcard_day_field_leaves_the_other_one():
+    assert Schedule('0 9 1 * *').next_run(NOW) == datetime(2026, 11, 1, 9, 0)
+    assert Schedule('0 9 * * 1').next_run(NOW) == datetime(2026, 10, 19, 9, 0)
+    assert Schedule('0 9 2-7 * */2').next_run(NOW) == datetime(2026, 11, 3, 9, 0)
+
+@pytest.mark.parametrize('expression', ['0 0 31 2 *', '0 0 30 2 *', '* * * *', '61 * * * *', ''])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(ScheduleError):
+        Schedule(expression)
+
+@pytest.mark.parametrize('expression, expected', [
+    ('0 9 * * 7', datetime(2026, 10, 25, 9, 0)),
+    ('0 9 * * 5-7', datetime(2026, 10, 23, 9, 0)),
+    ('0 13 * * 5-7', datetime(2026, 10, 18, 13, 0)),
+    ('0 9 * * */7', datetime(2026, 10, 25, 9, 0)),
+])
+def test_seven_is_sunday(expression, expected):
+    assert Schedule(expression).next_run(NOW) == expected
+
+def test_open_weekday_ranges_stop_at_saturday():
+    # 1/2 is Monday, Wednesday, Friday and not 7, the Sunday alias
+    assert Schedule('0 9 * * 1/2').fields[4] == {1, 3, 5}
+    with pytest.raises(ScheduleError):
+        Schedule('0 9 * * 8')
@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timedelta
+import pytest
+from conftest import ENGINES, RecordingLogger, make_updater, run_updater
+from core.daemon import ScheduledInstance
+from core.run_context import RunContext
+from core.schedule import Schedule
+from core.update_plan import UpdatePlan
+from fake_portainer import FakePortainer
+from logs.buffered_logger import BufferedLogger
+
+def settings(fake: FakePortainer, **overrides):
+    return {'name': 'updating', 'host': fake.url, 'accessToken': 'token', 'updatePortainerVersion': True, 'retries': 0, **overrides}
+
+@pytest.fixture
+def fake():
+    '''A Portainer with a newer version available, answering 503 for 2 seconds after its update.'''
+    fake = FakePortainer(environments=1, stacks=2, outdated_ratio=0, self_update_restart=2)
+    fake.start()
+    yield fake
+    fake.stop()
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_resumed_run_keeps_its_budget(engine, fake):
+    logger = RecordingLogger()
+    updater = make_updater(engine, settings(fake, instanceTimeout=60, selfUpdateTimeout=30), logger=logger)
+
+    assert run_updater(updater, defer_restart=True) is True
+    deadline = updater.deadline
+    time.sleep(0.1)
+    assert run_updater(updater) is False
+
+    assert updater.deadline == deadline
+    assert updater.restarting_since is None
+    assert ('INFO', 'Retrieved 1 environments for Portainer instance [updating]' + f'({fake.url}).') in logger.messages
+    assert any('answers with version 2.22.0' in message for _, message in logger.messages)
+    assert fake.request_counts.get('GET /') == 1
+
+def test_resumed_start_adds_no_second_plan_entry(fake):
+    plan = UpdatePlan()
+    updater = make_updater('threads', settings(fake, instanceTimeout=60), RunContext(plan=plan))
+
+    assert updater._start()
+    deadline = updater.deadline
+    updater.restarting_since = time.monotonic()
+    assert updater._start()
+
+    assert updater.deadline == deadline
+    assert len(plan.to_dict()['instances']) == 1
+
+def test_unknown_previous_version_waits_for_a_restart(fake):
+    updater = make_updater('threads', settings(fake))
+    updater._update_portainer(None, True)
+
+    # The old Portainer may still answer before going down
+    assert updater._restart_result('2.21.0', False) is False
+    assert updater._restart_result(None, False) is False
+    assert updater._restart_result('2.22.0', False) is True
+
+def test_self_update_timeout_is_reported(fake):
+    logger = RecordingLogger()
+    updater = make_updater('threads', settings(fake, selfUpdateTimeout=1), logger=logger)
+
+    assert run_updater(updater) is False
+
+    assert updater.restarting_since is None
+    assert any(level == 'ERROR' and 'did not come back with a new version within 1 seconds' in message for level, message in logger.messages)
+    assert not any(message.startswith('Retrieved') for _, message in logger.messages)
+
+def test_daemon_run_after_an_interrupted_restart_starts_afresh(fake):
+    logger = RecordingLogger()
+    instance_logger = BufferedLogger(logger)
+    # The instance budget runs out while Portainer restarts
+    updater = make_updater('threads', settings(fake, instanceTimeout=1, selfUpdateTimeout=30), logger=instance_logger)
+    scheduled = ScheduledInstance(updater, instance_logger, Schedule('15m'), timedelta(), datetime.now())
+
+    scheduled.run()
+    assert updater.restarting_since is None
+    assert any('exceeded its time budget' in message for _, message in logger.messages)
+
+    while time.monotonic() < fake.restarting_until:
+        time.sleep(0.1)
+    logger.messages.clear()
+    scheduled.run()
+
+    assert ('INFO', f'Successfully connected to Portainer instance: [updating]({fake.url})') in logger.messages
+    assert not any(level == 'ERROR' for level, _ in logger.messages)
+    assert fake.request_counts.get('POST /api/system/update') == 1
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import pytest
+import yaml
+from conftest import RecordingLogger
+from core.instance_config import InstanceConfig
+from core.metrics import Metrics
+from core.shard import Shard
+from fake_portainer import FakePortainer
+from logs.event import Event
+from logs.event_collector import EventCollector
+import main
+
+def instances(names: list[str]):
+    return [InstanceConfig.from_dict(index, {'name': name, 'host': f'https://{name}:9443', 'accessToken': 'token'})
+            for index, name in enumerate(names)]
+
+def assignment(names: list[str], count: int):
+    '''Shard number of each instance.'''
+    return {instance.name: next(number for number in range(1, count + 1) if Shard(number, count).includes(instance))
+            for instance in instances(names)}
+
+NAMES = [f'portainer-{i}' for i in range(40)]
+
+def test_every_instance_is_in_exactly_one_shard():
+    for count in (1, 2, 3, 7):
+        shards = [Shard(number, count).select(instances(NAMES)) for number in range(1, count + 1)]
+        assert sorted(instance.name for shard in shards for instance in shard) == sorted(NAMES)
+        if count > 1:
+            assert all(shards), 'every shard gets instances'
+
+def test_instances_keep_their_shard_when_others_are_added_or_removed():
+    before = assignment(NAMES, 4)
+    added = assignment(NAMES + [f'new-{i}' for i in range(10)], 4)
+    removed = assignment(NAMES[::2], 4)
+
+    assert {name: added[name] for name in NAMES} == before
+    assert removed == {name: before[name] for name in NAMES[::2]}
+
+def test_shards_agree_across_processes():
+    # Python's str hash is salted per process, the split must not depend on it
+    script = ('import json; from test_shard import NAMES, assignment; '
+              'print(json.dumps(assignment(NAMES, 5)))')
+    results = []
+    for seed in ('1', '2'):
+        environment = dict(os.environ, PYTHONHASHSEED=seed,
+                           PYTHONPATH=os.pathsep.join(['src', 'benchmarks', 'tests']))
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True, env=environment,
+                                cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+        results.append(json.loads(output))
+
+    assert results[0] == results[1] == assignment(NAMES, 5)
+
+def test_instances_without_name_use_their_host():
+    unnamed = InstanceConfig.from_dict(0, {'host': 'https://edge:9443', 'accessToken': 'token'})
+    named = InstanceConfig.from_dict(3, {'name': 'https://edge:9443', 'host': 'https://other:9443', 'accessToken': 'token'})
+    assert [Shard(number, 3).includes(unnamed) for number in (1, 2, 3)] == [Shard(number, 3).includes(named) for number in (1, 2, 3)]
+
+@pytest.mark.parametrize('value, expected', [('1/1', Shard(1, 1)), ('3/3', Shard(3, 3)), (' 2/4', Shard(2, 4))])
+def test_parse(value, expected):
+    assert Shard.parse(value) == expected
+
+@pytest.mark.parametrize('value', ['0/3', '4/3', '-1/3', '1/0', '3', '1/', '/3', 'a/3', '1/3/5', ''])
+def test_parse_rejects_invalid_shards(value):
+    with pytest.raises(ValueError, match=f'invalid shard "{value}"'):
+        Shard.parse(value)
+
+@pytest.mark.parametrize('value', ['0/3', '4/3', 'one/3'])
+def test_shard_argument_is_validated(value, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['main.py', '--shard', value])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+
+    assert exit_info.value.code == 2
+    assert f'invalid shard "{value}"' in capsys.readouterr().err
+
+def shard_report(instance: str, shard: str, fingerprint: str = 'abc', duration: float = 1.0):
+    events = EventCollector()
+    events.record(Event(instance, 'updated', 'prod', 'web', duration=duration))
+    events.record(Event(instance, 'failed', 'prod', 'db', error='HTTP 500'))
+    metrics = Metrics(fingerprint, shard, events)
+    with metrics.phase(instance, 'discovery'):
+        metrics.observe_request(instance, 'GET /api/endpoints', 0.1)
+    report = metrics.report()
+    report['duration_seconds'] = duration
+    return report
+
+def test_merge_report_files(tmp_path):
+    paths = []
+    for number, (instance, duration) in enumerate([('prod', 2.0), ('staging', 5.0)], start=1):
+        path = tmp_path / f'report-{number}.json'
+        path.write_text(json.dumps(shard_report(instance, f'{number}/2', duration=duration)))
+        paths.append(str(path))
+    (tmp_path / 'broken.json').write_text('{"started_at": ')
+    logger = RecordingLogger()
+
+    main.merge_report_files(paths + [str(tmp_path / 'broken.json'), str(tmp_path / 'missing.json')], logger, str(tmp_path / 'merged.json'))
+
+    merged = json.loads((tmp_path / 'merged.json').read_text())
+    assert merged['outcomes'] == {'failed': 2, 'updated': 2}
+    assert [failure['instance'] for failure in merged['failures']] == ['prod', 'staging']
+    assert set(merged['phases']) == {'prod', 'staging'}
+    assert [(shard['shard'], shard['instances']) for shard in merged['shards']] == [('1/2', 1), ('2/2', 1)]
+    assert merged['config_fingerprint'] == 'abc'
+
+    errors = [message for level, message in logger.messages if level == 'ERROR']
+    assert len(errors) == 2 and 'broken.json' in errors[0] and 'missing.json' in errors[1]
+    summaries = [message for level, message in logger.messages if level == 'SUMMARY']
+    assert len(summaries) == 1
+    assert '2 shards, the slowest (2/2) took 5.0s.' in summaries[0].split('\n')
+
+def test_merged_shards_with_different_configurations_are_flagged(tmp_path):
+    logger = RecordingLogger()
+    paths = []
+    for number, fingerprint in enumerate(['abc', 'def'], start=1):
+        path = tmp_path / f'report-{number}.json'
+        path.write_text(json.dumps(shard_report(f'instance-{number}', f'{number}/2', fingerprint)))
+        paths.append(str(path))
+
+    main.merge_report_files(paths, logger)
+
+    assert 'The shards did not run with the same configuration.' in logger.messages[-1][1].split('\n')
+
+def test_nothing_is_sent_without_readable_reports(tmp_path):
+    logger = RecordingLogger()
+    main.merge_report_files([str(tmp_path / 'missing.json')], logger)
+    assert [level for level, _ in logger.messages] == ['ERROR']
+
+def test_processes_split_the_instances_and_merge_their_reports(tmp_path):
+    fake = FakePortainer(environments=1, stacks=2, outdated_ratio=0)
+    fake.start()
+    config_path = tmp_path / 'config.yml'
+    config_path.write_text(yaml.safe_dump({'instances': [
+        {'name': f'portainer-{i}', 'host': fake.url, 'accessToken': 'token'} for i in range(6)]}))
+    args = argparse.Namespace(daemon=False, plan=None, apply=None, no_cache=True, workers=None, engine=None, processes=3)
+    logger = RecordingLogger()
+
+    try:
+        main.run_processes(str(config_path), logger, args, str(tmp_path / 'merged.json'))
+    finally:
+        fake.stop()
+
+    merged = json.loads((tmp_path / 'merged.json').read_text())
+    assert sorted(shard['shard'] for shard in merged['shards']) == ['1/3', '2/3', '3/3']
+    assert sum(shard['instances'] for shard in merged['shards']) == 6
+    assert merged['outcomes'] == {'current': 12}
+    # Each instance lists its environments once, in whichever process got it
+    assert fake.request_counts.get('GET /api/endpoints') == 6
+    assert [level for level, _ in logger.messages] == ['SUMMARY']
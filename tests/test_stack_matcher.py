@@ -0,0 +1,50 @@
+import pytest
+from core.instance_config import InstanceConfig
+from core.stack_matcher import StackMatcher
+
+def test_plain_names_match_exactly():
+    matcher = StackMatcher(['web', 'db'])
+    assert matcher.matches('web') and matcher.matches('db')
+    assert not matcher.matches('web-1') and not matcher.matches('we')
+    assert not StackMatcher([]).matches('web') and not StackMatcher()
+
+def test_globs():
+    matcher = StackMatcher(['test-*', 'app-?', 'db-[ab]'])
+    assert matcher.matches('test-') and matcher.matches('test-feature')
+    assert matcher.matches('app-1') and not matcher.matches('app-10')
+    assert matcher.matches('db-a') and not matcher.matches('db-c')
+    assert not matcher.matches('my-test-feature')
+
+def test_regular_expressions_match_the_whole_name():
+    matcher = StackMatcher([r're:ci-\d+', 're:(?i:preview)-.*'])
+    assert matcher.matches('ci-42')
+    assert not matcher.matches('ci-42-old') and not matcher.matches('old-ci-42')
+    assert matcher.matches('Preview-branch')
+    assert not matcher.matches(None)
+
+def test_invalid_regular_expressions_name_the_pattern():
+    with pytest.raises(ValueError, match=r'invalid regular expression "ci-\(": '):
+        StackMatcher(['re:ci-('])
+
+def test_include_stacks_per_environment():
+    instance = InstanceConfig.from_dict(0, {'name': 'prod', 'ignoreStacks': ['legacy'], 'includeStacks': {
+        'prod-*': ['web', 'api-*'],
+        'staging': ['re:.*'],
+    }})
+
+    assert instance.skip_reason('web', instance.included_stacks('prod-eu')) is None
+    assert instance.skip_reason('api-v2', instance.included_stacks('prod-us')) is None
+    assert instance.skip_reason('db', instance.included_stacks('prod-eu')) == 'not included'
+    assert instance.skip_reason('db', instance.included_stacks('staging')) is None
+    # Environments without a rule process every stack, the ignore list still applies
+    assert instance.included_stacks('dev') is None
+    assert instance.skip_reason('legacy', instance.included_stacks('staging')) == 'ignored'
+
+def test_include_stacks_list_applies_to_every_environment():
+    instance = InstanceConfig.from_dict(0, {'name': 'prod', 'includeStacks': ['web']})
+    assert instance.skip_reason('web', instance.included_stacks('any')) is None
+    assert instance.skip_reason('db', instance.included_stacks('any')) == 'not included'
+
+def test_invalid_include_pattern_names_the_setting():
+    with pytest.raises(ValueError, match='"includeStacks" of the instance at index 0'):
+        InstanceConfig.from_dict(0, {'name': 'prod', 'includeStacks': {'prod': ['re:[']}})
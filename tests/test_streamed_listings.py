@@ -0,0 +1,63 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from core.async_portainer import AsyncPortainer, create_connector
+from core.metrics import Metrics
+from core.portainer import Portainer
+
+ENVIRONMENTS = [{'Id': index, 'Name': f'env-{index}', 'Status': 1, 'Snapshots': [{'Heavy': 'x' * 1000}]} for index in range(1, 51)]
+BODY = json.dumps(ENVIRONMENTS).encode()
+
+class ChunkedHandler(BaseHTTPRequestHandler):
+    '''Answers /api/endpoints with a chunked body, without Content-Length.'''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(BODY), 4096):
+            chunk = BODY[start:start + 4096]
+            self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ChunkedHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+def received_bytes(metrics: Metrics):
+    return {request['endpoint']: request['bytes_received'] for request in metrics.report()['requests']}
+
+def test_streamed_listing_counts_the_bytes_read(server):
+    metrics = Metrics()
+    environments = list(Portainer(server, 'token', metrics=metrics).iter_environments())
+
+    assert [environment['Name'] for environment in environments] == [environment['Name'] for environment in ENVIRONMENTS]
+    assert 'Snapshots' not in environments[0]
+    assert received_bytes(metrics) == {'GET /api/endpoints': len(BODY)}
+
+def test_async_streamed_listing_counts_the_bytes_read(server):
+    metrics = Metrics()
+
+    async def list_environments():
+        connector = create_connector()
+        try:
+            async with AsyncPortainer(server, 'token', connector, metrics=metrics) as portainer:
+                return [environment async for environment in portainer.iter_environments()]
+        finally:
+            await connector.close()
+
+    environments = asyncio.run(list_environments())
+    assert len(environments) == len(ENVIRONMENTS) and 'Snapshots' not in environments[0]
+    assert received_bytes(metrics) == {'GET /api/endpoints': len(BODY)}